@@ -0,0 +1,657 @@
+#!/usr/bin/env python3
+"""
+PlanManager 性能基准测试
+
+所有测试都在临时数据库上运行，不会修改 plans.db。
+
+运行方式:
+    python benchmark.py            # 运行全部基准
+    python benchmark.py pool       # 只运行连接池基准
+"""
+
+import os
+import sys
+import json
+import time
+import tracemalloc
+import asyncio
+import logging
+import sqlite3
+import tempfile
+import argparse
+import contextlib
+
+# 在导入 main 之前指向临时数据库，避免模块级的 db 实例写入 plans.db
+_TMP_DIR = tempfile.mkdtemp(prefix="plan_bench_")
+os.environ.setdefault("PLAN_DB_PATH", os.path.join(_TMP_DIR, "module.db"))
+
+import main  # noqa: E402
+from main import SQLiteDB, STORAGE_PROFILES, SUBTREE_CTE, ToolRunner  # noqa: E402
+
+logging.getLogger().setLevel(logging.WARNING)
+
+
+def _fresh_db(name: str, **kwargs) -> SQLiteDB:
+    path = os.path.join(_TMP_DIR, f"{name}.db")
+    for suffix in ("", "-wal", "-shm"):
+        if os.path.exists(path + suffix):
+            os.remove(path + suffix)
+    return SQLiteDB(path, **kwargs)
+
+
+def _timeit(func, repeat: int) -> float:
+    """返回单次调用的平均耗时（微秒）"""
+    start = time.perf_counter()
+    for _ in range(repeat):
+        func()
+    return (time.perf_counter() - start) / repeat * 1e6
+
+
+def _report(title: str, rows):
+    print(f"\n{title}")
+    print("-" * 60)
+    for label, value in rows:
+        print(f"  {label:<40} {value}")
+
+
+def bench_pool(repeat: int = 2000):
+    """连接池 vs 每次调用新建连接的 get_item 延迟（关闭缓存，缓存命中见 bench_cache）"""
+    with contextlib.redirect_stdout(open(os.devnull, "w")):
+        db = _fresh_db("pool", cache_size=0)
+        item_id = db.create_item(name="基准计划", description="x" * 200,
+                                 metadata={"budget": 100})
+
+    def connect_per_call():
+        # 旧实现：每次调用都新建并关闭连接
+        conn = sqlite3.connect(db.db_path)
+        conn.execute("SELECT * FROM plans WHERE id = ?", (item_id,)).fetchone()
+        conn.close()
+
+    before = _timeit(connect_per_call, repeat)
+    after = _timeit(lambda: db.get_item(item_id), repeat)
+    db.close()
+
+    _report("get_item 单次延迟（连接池）", [
+        ("每次新建连接", f"{before:8.1f} µs"),
+        ("连接池复用连接", f"{after:8.1f} µs"),
+        ("加速比", f"{before / after:8.1f} x"),
+    ])
+
+
+def bench_tree(steps: int = 500, repeat: int = 20):
+    """单次递归CTE加载整棵树 vs 旧的逐节点递归查询（关闭缓存，缓存命中见 bench_cache）"""
+    with contextlib.redirect_stdout(open(os.devnull, "w")):
+        db = _fresh_db("tree", cache_size=0)
+        root = db.create_item(name="大型计划")
+    with db.transaction() as conn:
+        conn.executemany(
+            "INSERT INTO plans (name, parent_id) VALUES (?, ?)",
+            [(f"步骤{i}", root) for i in range(steps)])
+
+    def legacy_tree(item_id):
+        # 旧实现：每个节点一次 get_item + 一次 query_items，各自新建连接
+        conn = sqlite3.connect(db.db_path)
+        row = conn.execute("SELECT * FROM plans WHERE id = ?", (item_id,)).fetchone()
+        conn.close()
+        node = db._row_to_item(row)
+        conn = sqlite3.connect(db.db_path)
+        rows = conn.execute("SELECT * FROM plans WHERE parent_id = ? ORDER BY created_at",
+                            (item_id,)).fetchall()
+        conn.close()
+        if rows:
+            node["children"] = [legacy_tree(r[0]) for r in rows]
+        return node
+
+    before = _timeit(lambda: legacy_tree(root), repeat) / 1000
+    after = _timeit(lambda: db.get_tree(root), repeat) / 1000
+    count = _timeit(lambda: db.get_plan_tree_count(root), repeat) / 1000
+    db.close()
+
+    _report(f"get_tree（{steps} 个步骤）", [
+        ("逐节点递归查询", f"{before:8.2f} ms"),
+        ("递归CTE单次查询", f"{after:8.2f} ms"),
+        ("get_plan_tree_count（仅计数）", f"{count:8.2f} ms"),
+        ("加速比", f"{before / after:8.1f} x"),
+    ])
+
+
+def bench_profiles(inserts: int = 300):
+    """各存储配置档下单行插入（每次提交）的延迟，以及旧的回滚日志模式"""
+    rows = []
+
+    legacy_path = os.path.join(_TMP_DIR, "legacy.db")
+    if os.path.exists(legacy_path):
+        os.remove(legacy_path)
+    conn = sqlite3.connect(legacy_path)
+    conn.execute("CREATE TABLE plans (id INTEGER PRIMARY KEY, name TEXT)")
+    conn.commit()
+
+    def legacy_insert():
+        # 旧默认：回滚日志 + synchronous=FULL
+        conn.execute("INSERT INTO plans (name) VALUES ('x')")
+        conn.commit()
+
+    rows.append(("回滚日志（旧默认）", f"{_timeit(legacy_insert, inserts):8.1f} µs"))
+    conn.close()
+
+    for profile in STORAGE_PROFILES:
+        db = _fresh_db(f"profile_{profile}", profile=profile)
+
+        def insert():
+            with db.transaction() as c:
+                c.execute("INSERT INTO plans (name) VALUES ('x')")
+
+        rows.append((f"{profile}（{db.journal_mode()}）", f"{_timeit(insert, inserts):8.1f} µs"))
+        db.close()
+
+    _report("单行插入+提交延迟（存储配置档）", rows)
+
+
+def bench_bulk(sizes=(10, 1_000, 100_000)):
+    """create_items_bulk（单事务 executemany）vs 逐条 create_item"""
+    rows = []
+    for size in sizes:
+        children = [{"name": f"步骤{i}", "scheduled_at": "2026-01-01"} for i in range(size)]
+
+        with contextlib.redirect_stdout(open(os.devnull, "w")):
+            db = _fresh_db(f"bulk_loop_{size}")
+            start = time.perf_counter()
+            parent_id = db.create_item(name="逐条创建")
+            for child in children:
+                db.create_item(parent_id=parent_id, **child)
+            loop = time.perf_counter() - start
+            db.close()
+
+            db = _fresh_db(f"bulk_{size}")
+            start = time.perf_counter()
+            db.create_items_bulk(parent={"name": "批量创建"}, children=children)
+            bulk = time.perf_counter() - start
+            db.close()
+
+        rows.append((f"{size:>7} 个子计划", f"逐条 {loop * 1000:9.1f} ms   批量 {bulk * 1000:8.1f} ms   "
+                                          f"{loop / bulk:6.1f} x"))
+
+    _report("批量创建（create_items_bulk）", rows)
+
+
+def bench_backends(inserts: int = 1000, repeat: int = 200):
+    """同一工作负载在文件引擎和内存引擎上的耗时"""
+    rows = []
+    for backend in main.STORAGE_BACKENDS:
+        if backend == "memory":
+            db = main.open_store("memory")
+        else:
+            db = _fresh_db(f"backend_{backend}")
+        start = time.perf_counter()
+        root = db.create_item(name="基准计划")
+        for i in range(inserts):
+            db.create_item(name=f"步骤{i}", parent_id=root)
+        insert = (time.perf_counter() - start) / inserts * 1e6
+        db.cache.clear()
+        tree = _timeit(lambda: (db.cache.clear(), db.get_tree(root)), repeat) / 1000
+        db.close()
+        rows.append((backend, f"单行插入 {insert:7.1f} µs   get_tree {tree:6.2f} ms"))
+
+    _report(f"存储后端（{inserts} 个子计划）", rows)
+
+
+def bench_search(rows: int = 200_000, repeat: int = 20):
+    """全文索引搜索 vs LIKE 全表扫描"""
+    db = _fresh_db("search")
+    cities = ["云南", "日本", "欧洲", "新疆", "西藏", "海南", "北京", "上海"]
+    with db.transaction() as conn:
+        conn.executemany(
+            "INSERT INTO plans (name, description) VALUES (?, ?)",
+            ((f"{cities[i % len(cities)]}旅行计划{i}" + ("转山" if i % 1000 == 0 else ""),
+              f"第{i}号计划的详细描述") for i in range(rows)))
+
+    def like_scan():
+        with db.connection() as conn:
+            conn.execute(
+                "SELECT * FROM plans WHERE name LIKE ? OR description LIKE ? "
+                "ORDER BY created_at DESC LIMIT 50", ("%旅行计划1234%", "%旅行计划1234%")).fetchall()
+
+    def like_scan_short(term):
+        with db.connection() as conn:
+            conn.execute(
+                "SELECT * FROM plans WHERE name LIKE ? OR description LIKE ? "
+                "ORDER BY created_at DESC LIMIT 50", (f"%{term}%", f"%{term}%")).fetchall()
+
+    before = _timeit(like_scan, repeat) / 1000
+    after = _timeit(lambda: db.search_items("旅行计划1234"), repeat) / 1000
+    # 两个字的词：索引词表按三字组前缀取候选（少见的词 / 八分之一的行都匹配的常见词）
+    short = []
+    for term in ("转山", "西藏"):
+        short.append((term, _timeit(lambda: like_scan_short(term), repeat) / 1000,
+                      _timeit(lambda: db.search_items(term), repeat) / 1000))
+    db.close()
+
+    _report(f"search_plans（{rows} 行）", [
+        ("LIKE 全表扫描", f"{before:8.2f} ms"),
+        ("FTS5 trigram 索引", f"{after:8.2f} ms"),
+        ("加速比", f"{before / after:8.1f} x"),
+    ] + [(f"两字词“{term}” LIKE 扫描 / 索引词表", f"{scan:8.2f} ms / {indexed:6.2f} ms")
+          for term, scan, indexed in short])
+
+
+def bench_shift(steps: int = 5000, repeat: int = 5):
+    """整体平移计划：逐个 update_item vs 递归CTE上的一条 UPDATE"""
+    db = _fresh_db("shift")
+    ids = db.create_items_bulk({"name": "旅行", "scheduled_at": "2025-01-01"},
+                               [{"name": f"步骤{i}", "scheduled_at": "2025-01-02"}
+                                for i in range(steps)])
+
+    def per_row():
+        for item_id in ids:
+            item = db.get_item(item_id)
+            db.update_item(item_id, scheduled_at=item["scheduled_at"])
+
+    start = time.perf_counter()
+    per_row()
+    before = (time.perf_counter() - start) * 1000
+    after = _timeit(lambda: db.shift_subtree(ids[0], 1), repeat) / 1000
+    db.close()
+
+    _report(f"shift_plan（{steps + 1} 个计划）", [
+        ("逐个 update_item", f"{before:8.1f} ms"),
+        ("一条 UPDATE（递归CTE）", f"{after:8.1f} ms"),
+        ("加速比", f"{before / after:8.1f} x"),
+    ])
+
+
+def bench_agenda(rows: int = 1_000_000, repeat: int = 200):
+    """get_agenda：(scheduled_at, status) 索引上的范围扫描，一周的日程取一页"""
+    db = _fresh_db("agenda")
+    statuses = ["pending", "in_progress", "completed", "cancelled"]
+    with db.transaction() as conn:
+        # 每个顶级计划带 9 个步骤，日期分布在约三年内
+        conn.executemany(
+            "INSERT INTO plans (id, name, parent_id, scheduled_at, status) VALUES (?, ?, ?, ?, ?)",
+            ((i, f"计划{i}", None if i % 10 == 1 else i - (i - 1) % 10,
+              f"{2024 + i % 3}-{1 + i % 12:02d}-{1 + i % 28:02d}", statuses[i // 12 % 4])
+             for i in range(1, rows + 1)))
+        plan = conn.execute(
+            "EXPLAIN QUERY PLAN SELECT * FROM plans "
+            "WHERE scheduled_at >= ? AND scheduled_at < ? AND status = ? "
+            "ORDER BY scheduled_at, status, id LIMIT 51",
+            ("2025-05-01", "2025-05-08", "pending")).fetchall()
+
+    week = db.agenda("2025-05-01", "2025-05-07", page_size=rows)["items"]
+    first = _timeit(lambda: db.agenda("2025-05-01", "2025-05-07"), repeat) / 1000
+    pending = _timeit(lambda: db.agenda("2025-05-01", "2025-05-07", status="pending"), repeat) / 1000
+    cursor = db.agenda("2025-05-01", "2025-05-07", page_size=2000)["next_cursor"]
+    deep = _timeit(lambda: db.agenda("2025-05-01", "2025-05-07", cursor=cursor), repeat) / 1000
+    db.close()
+
+    _report(f"get_agenda（{rows} 行，一周 {len(week)} 条，每页50条）", [
+        ("第一页", f"{first:8.3f} ms"),
+        ("第一页 + status 过滤", f"{pending:8.3f} ms"),
+        ("第 41 页（游标）", f"{deep:8.3f} ms"),
+        ("查询计划", plan[-1][-1]),
+    ])
+
+
+def bench_statistics(rows: int = 200_000, repeat: int = 20):
+    """get_plan_statistics：四次全表聚合 vs 读取触发器维护的计数表"""
+    db = _fresh_db("statistics")
+    statuses = ["pending", "in_progress", "completed", "cancelled"]
+    categories = ["旅行", "学习", "工作", "生活", "general"]
+    start = time.perf_counter()
+    with db.transaction() as conn:
+        conn.executemany(
+            "INSERT INTO plans (name, status, category) VALUES (?, ?, ?)",
+            ((f"计划{i}", statuses[i % 4], categories[i % 5]) for i in range(rows)))
+    insert_ms = (time.perf_counter() - start) * 1000
+
+    def full_scan():
+        with db.connection() as conn:
+            conn.execute("SELECT COUNT(*) FROM plans").fetchone()
+            conn.execute("SELECT status, COUNT(*) FROM plans GROUP BY status").fetchall()
+            conn.execute("SELECT category, COUNT(*) FROM plans GROUP BY category").fetchall()
+            conn.execute("SELECT COUNT(*) FROM plans "
+                         "WHERE created_at >= date('now', 'start of month')").fetchone()
+
+    before = _timeit(full_scan, repeat) / 1000
+    after = _timeit(db.get_statistics, repeat) / 1000
+    start = time.perf_counter()
+    drift = db.reconcile_statistics()["drift"]
+    reconcile_ms = (time.perf_counter() - start) * 1000
+    db.close()
+
+    _report(f"get_plan_statistics（{rows} 行）", [
+        ("全表聚合（四次扫描）", f"{before:8.2f} ms"),
+        ("计数表", f"{after:8.3f} ms"),
+        ("加速比", f"{before / after:8.0f} x"),
+        (f"写入 {rows} 行（含触发器）", f"{insert_ms:8.0f} ms"),
+        (f"全量校对（偏差 {len(drift)} 项）", f"{reconcile_ms:8.0f} ms"),
+    ])
+
+
+def bench_pagination(rows: int = 200_000, page_size: int = 50, repeat: int = 50):
+    """键集分页：第一页与深层页的耗时对比（以及 OFFSET 分页）"""
+    db = _fresh_db("pagination")
+    with db.transaction() as conn:
+        conn.executemany("INSERT INTO plans (name) VALUES (?)",
+                         ((f"计划{i}",) for i in range(rows)))
+        deep_after = conn.execute(
+            "SELECT created_at, id FROM plans ORDER BY created_at, id LIMIT 1 OFFSET ?",
+            (rows - page_size - 1,)).fetchone()
+
+    def offset_page():
+        with db.connection() as conn:
+            conn.execute("SELECT * FROM plans WHERE parent_id IS NULL "
+                         "ORDER BY created_at, id LIMIT ? OFFSET ?",
+                         (page_size, rows - page_size)).fetchall()
+
+    first = _timeit(lambda: db.query_items(limit=page_size), repeat) / 1000
+    deep = _timeit(lambda: db.query_items(after=deep_after, limit=page_size), repeat) / 1000
+    offset = _timeit(offset_page, repeat) / 1000
+    db.close()
+
+    _report(f"list_plans 分页（{rows} 个顶级计划，每页 {page_size}）", [
+        ("键集分页 第一页", f"{first:8.2f} ms"),
+        ("键集分页 最后一页", f"{deep:8.2f} ms"),
+        ("OFFSET 分页 最后一页", f"{offset:8.2f} ms"),
+    ])
+
+
+def bench_cache(steps: int = 500, repeat: int = 200):
+    """get_item / get_tree 缓存命中 vs 关闭缓存"""
+    rows = []
+    for label, cache_size in (("关闭缓存", 0), ("LRU缓存", 1024)):
+        with contextlib.redirect_stdout(open(os.devnull, "w")):
+            db = _fresh_db(f"cache_{cache_size}", cache_size=cache_size)
+            root = db.create_item(name="缓存基准")
+        with db.transaction() as conn:
+            conn.executemany("INSERT INTO plans (name, parent_id) VALUES (?, ?)",
+                             [(f"步骤{i}", root) for i in range(steps)])
+        item = _timeit(lambda: db.get_item(root), repeat)
+        tree = _timeit(lambda: db.get_tree(root), repeat) / 1000
+        rows.append((label, f"get_item {item:7.1f} µs   get_tree({steps}) {tree:6.2f} ms"))
+        if cache_size:
+            rows.append(("缓存统计", str(db.cache.stats())))
+        db.close()
+
+    _report("读缓存", rows)
+
+
+def bench_async(steps: int = 2000, requests: int = 64, workers=(1, 2, 4, 8)):
+    """并发读负载：工作线程数与吞吐量（每个请求统计一棵大计划的子树）"""
+    db = _fresh_db("async", pool_size=max(workers), cache_size=0)
+    with db.transaction() as conn:
+        roots = []
+        for r in range(8):
+            root = conn.execute("INSERT INTO plans (name) VALUES (?)", (f"计划{r}",)).lastrowid
+            conn.executemany("INSERT INTO plans (name, parent_id, description) VALUES (?, ?, ?)",
+                             [(f"步骤{i}", root, "描述" * 20) for i in range(steps)])
+            roots.append(root)
+
+    def read_request(i):
+        # 以 SQL 为主的读请求：sqlite3 执行期间释放 GIL
+        with db.connection() as conn:
+            conn.execute(SUBTREE_CTE + "SELECT COUNT(*), SUM(LENGTH(p.description)) "
+                         "FROM plans p JOIN subtree s ON p.id = s.id",
+                         (roots[i % len(roots)],)).fetchone()
+
+    rows = []
+    baseline = None
+    for count in workers:
+        runner = ToolRunner(max_workers=count)
+
+        async def load():
+            await asyncio.gather(*(runner.run(read_request, i) for i in range(requests)))
+
+        start = time.perf_counter()
+        asyncio.run(load())
+        elapsed = time.perf_counter() - start
+        runner.shutdown()
+
+        throughput = requests / elapsed
+        baseline = baseline or throughput
+        rows.append((f"{count} 个工作线程", f"{throughput:8.1f} 请求/秒   {throughput / baseline:5.2f} x"))
+    db.close()
+
+    _report(f"并发读吞吐（{requests} 个并发请求）", rows)
+
+
+def bench_responses(steps: int = 2000, repeat: int = 20):
+    """get_plan_details 响应：旧的 indent=2 文本（外加 {"result": 文本} 副本）vs 结构化紧凑JSON"""
+    db = main.open_store("memory")
+    db.create_items_bulk({"name": "大型计划"}, [
+        {"name": f"步骤{i}", "description": "准备材料" * 5, "scheduled_at": "2026-01-01",
+         "metadata": {"order": i}} for i in range(steps)])
+    tree = db.get_tree(1)
+    db.close()
+
+    def legacy():
+        text = json.dumps(tree, indent=2, ensure_ascii=False)
+        return text, json.dumps({"result": text}, ensure_ascii=False)
+
+    def structured():
+        result = main._tool_result(tree)
+        return result.content[0].text, main.json_dumps(result.structuredContent)
+
+    sizes = {name: sum(len(part.encode()) for part in func()) for name, func in
+             (("legacy", legacy), ("structured", structured))}
+    before = _timeit(legacy, repeat) / 1000
+    after = _timeit(structured, repeat) / 1000
+
+    _report(f"get_plan_details 响应（{steps} 个步骤，文本 + 结构化内容）", [
+        ("indent=2 文本 + result 副本", f"{before:8.2f} ms   {sizes['legacy'] / 1024:8.1f} KB"),
+        ("紧凑JSON + structuredContent", f"{after:8.2f} ms   {sizes['structured'] / 1024:8.1f} KB"),
+    ])
+
+
+def bench_json(steps: int = 5000, repeat: int = 20):
+    """各JSON编解码器：整棵树编码、逐行解析 metadata，以及跳过 metadata 解析的列表查询"""
+    db = main.open_store("memory")
+    db.create_items_bulk({"name": "大型计划"}, [
+        {"name": f"步骤{i}", "description": "准备材料" * 5,
+         "metadata": {"order": i, "tags": ["室内", "上午"], "budget": 12.5}} for i in range(steps)])
+    tree = db.get_tree(1)
+    raw = [child["metadata"] for child in db.query_items(parent_id=1, decode_metadata=False)]
+
+    rows = []
+    for name in main.JSON_CODECS:
+        try:
+            codec = main.select_json_codec(name)
+        except ValueError:
+            rows.append((name, "未安装"))
+            continue
+        encode = _timeit(lambda: codec.dumps(tree), repeat) / 1000
+        decode = _timeit(lambda: [codec.loads(text) for text in raw], repeat) / 1000
+        rows.append((name, f"编码整棵树 {encode:7.2f} ms   解析 metadata {decode:7.2f} ms"))
+
+    decoded = _timeit(lambda: db.query_items(parent_id=1), repeat) / 1000
+    lazy = _timeit(lambda: db.query_items(parent_id=1, decode_metadata=False), repeat) / 1000
+    rows.append((f"query_items（当前: {main.json_codec.name}）",
+                 f"解析 metadata {decoded:7.2f} ms   跳过 {lazy:7.2f} ms"))
+    db.close()
+
+    _report(f"JSON 编解码（{steps} 个步骤）", rows)
+
+
+def bench_projection(steps: int = 5000, repeat: int = 20):
+    """fields= 投影 vs 全部列（description / metadata 较大时）"""
+    db = main.open_store("memory", cache_size=0)
+    db.create_items_bulk({"name": "大型计划"}, [
+        {"name": f"步骤{i}", "description": "详细说明" * 100,
+         "metadata": {"order": i, "notes": "备注" * 50}} for i in range(steps)])
+    fields = ["name", "status"]
+
+    rows = []
+    for label, full, projected in (
+            ("query_items", lambda: db.query_items(parent_id=1),
+             lambda: db.query_items(parent_id=1, fields=fields)),
+            ("get_tree", lambda: db.get_tree(1), lambda: db.get_tree(1, fields=fields))):
+        before = _timeit(full, repeat) / 1000
+        after = _timeit(projected, repeat) / 1000
+        rows.append((label, f"全部列 {before:7.2f} ms   {fields} {after:7.2f} ms   {before / after:5.1f} x"))
+    db.close()
+
+    _report(f"字段投影（{steps} 个步骤）", rows)
+
+
+def bench_rows(rows: int = 1_000_000):
+    """全部行驻留内存（整棵树缓存、全表处理）：dict vs PlanItem（__slots__）的占用与构造耗时"""
+    db = main.open_store("memory", cache_size=0)
+    with db.transaction() as conn:
+        conn.executemany(
+            "INSERT INTO plans (id, name, parent_id, scheduled_at, metadata) VALUES (?, ?, ?, ?, ?)",
+            ((i, f"步骤{i}", None if i == 1 else 1, f"2025-{1 + i % 12:02d}-{1 + i % 28:02d}",
+              f'{{"order": {i}}}') for i in range(1, rows + 1)))
+
+    def load(build):
+        with db.connection() as conn:
+            return [build(row) for row in conn.execute("SELECT * FROM plans")]
+
+    result = []
+    for label, build in (("dict（解析 metadata）", db._row_to_item),
+                         ("PlanItem（__slots__）", lambda row: main.PlanItem(*row))):
+        start = time.perf_counter()
+        items = load(build)
+        elapsed = time.perf_counter() - start
+        del items
+        # 内存单独测一遍，tracemalloc 本身会显著拖慢执行
+        tracemalloc.start()
+        items = load(build)
+        current = tracemalloc.get_traced_memory()[0]
+        tracemalloc.stop()
+        del items
+        result.append((label, f"{elapsed * 1000:8.0f} ms   驻留内存 {current / 1024 / 1024:7.1f} MB   "
+                              f"{current / rows:5.0f} 字节/行"))
+    db.close()
+
+    _report(f"行对象（{rows} 行全部驻留内存）", result)
+
+
+def bench_backup(rows: int = 50_000):
+    """流式NDJSON备份/恢复 vs 旧的 fetchall + json.dump：耗时与峰值内存"""
+    db = _fresh_db("backup")
+    with db.transaction() as conn:
+        conn.executemany("INSERT INTO plans (name, description, metadata) VALUES (?, ?, ?)",
+                         ((f"计划{i}", "描述" * 30, '{"budget": 100}') for i in range(rows)))
+
+    def legacy_backup():
+        with db.connection() as conn:
+            data = [db._row_to_item(r) for r in conn.execute("SELECT * FROM plans").fetchall()]
+        with open(os.path.join(_TMP_DIR, "legacy.json"), "w", encoding="utf-8") as f:
+            json.dump({"plans": data}, f, indent=2, ensure_ascii=False)
+
+    def streaming_backup():
+        with main.open_backup_file(os.path.join(_TMP_DIR, "stream.ndjson.gz"), "w", "gzip") as f:
+            for row in db.export_rows():
+                f.write(main.json_dumps(dict(zip(db.COLUMNS, row))) + "\n")
+
+    def restore():
+        target = _fresh_db("restore")
+        target.import_rows(main.read_backup_rows(os.path.join(_TMP_DIR, "stream.ndjson.gz")))
+        target.close()
+
+    result = []
+    for label, func in (("旧备份（fetchall + json.dump）", legacy_backup),
+                        ("流式备份（NDJSON + gzip）", streaming_backup),
+                        ("流式恢复（分批事务）", restore)):
+        start = time.perf_counter()
+        func()
+        elapsed = time.perf_counter() - start
+        # 内存单独测一遍，tracemalloc 本身会显著拖慢执行
+        tracemalloc.start()
+        func()
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        result.append((label, f"{elapsed * 1000:8.0f} ms   {rows / elapsed:9,.0f} 行/秒   峰值内存 {peak / 1024 / 1024:6.1f} MB"))
+    db.close()
+
+    _report(f"备份与恢复（{rows} 行）", result)
+
+
+class _SlowHandler(logging.Handler):
+    """模拟阻塞的输出端（对方不读的管道、慢磁盘），每条日志耗时 0.5 ms"""
+
+    def emit(self, record):
+        time.sleep(0.0005)
+
+
+def bench_logging(inserts: int = 2000):
+    """create_item 延迟：同步 handler + print（旧）vs 队列日志（新），以及输出端变慢时"""
+    root = logging.getLogger()
+    saved_handlers, saved_level = root.handlers[:], root.level
+    # ephemeral 配置档不等待 fsync，耗时差异主要来自日志
+    db = _fresh_db("logging", profile="ephemeral")
+    create = lambda: db.create_item(name="日志基准")  # noqa: E731
+    rows = []
+    try:
+        with open(os.devnull, "w") as devnull, \
+                contextlib.redirect_stdout(devnull), contextlib.redirect_stderr(devnull):
+            root.setLevel(logging.WARNING)
+            rows.append(("不记录日志（下限）", f"{_timeit(create, inserts):8.1f} µs"))
+
+            for label, slow in (("", False), ("，输出端阻塞", True)):
+                sinks = [logging.FileHandler(os.path.join(_TMP_DIR, "sync.log"), encoding="utf-8"),
+                         logging.StreamHandler()]
+                root.handlers = sinks + ([_SlowHandler()] if slow else [])
+                root.setLevel(logging.INFO)
+
+                def legacy_create():
+                    item_id = db.create_item(name="日志基准")
+                    print(f"✅ 计划创建成功 - ID:{item_id} 名称:日志基准")
+
+                rows.append((f"同步handler+print（旧{label}）",
+                             f"{_timeit(legacy_create, inserts):8.1f} µs"))
+                for handler in sinks:
+                    handler.close()
+
+                listener = main.setup_logging(os.path.join(_TMP_DIR, "queue.log"), echo=True)
+                if slow:
+                    listener.handlers += (_SlowHandler(),)
+                rows.append((f"队列日志（新{label}）", f"{_timeit(create, inserts):8.1f} µs"))
+                listener.stop()
+    finally:
+        root.handlers = saved_handlers
+        root.setLevel(saved_level)
+        db.close()
+
+    _report("create_item 单次延迟（日志管道）", rows)
+
+
+BENCHMARKS = {
+    "pool": bench_pool,
+    "tree": bench_tree,
+    "profiles": bench_profiles,
+    "bulk": bench_bulk,
+    "backends": bench_backends,
+    "search": bench_search,
+    "statistics": bench_statistics,
+    "shift": bench_shift,
+    "agenda": bench_agenda,
+    "pagination": bench_pagination,
+    "cache": bench_cache,
+    "async": bench_async,
+    "responses": bench_responses,
+    "json": bench_json,
+    "projection": bench_projection,
+    "rows": bench_rows,
+    "backup": bench_backup,
+    "logging": bench_logging,
+}
+
+
+def run(argv=None):
+    parser = argparse.ArgumentParser(description="PlanManager 性能基准测试")
+    parser.add_argument("names", nargs="*",
+                        help=f"要运行的基准（默认全部）：{', '.join(BENCHMARKS)}")
+    args = parser.parse_args(argv)
+
+    names = args.names or list(BENCHMARKS)
+    unknown = [name for name in names if name not in BENCHMARKS]
+    if unknown:
+        parser.error(f"未知的基准: {', '.join(unknown)}")
+    print(f"🚀 基准测试开始（SQLite {sqlite3.sqlite_version}，Python {sys.version.split()[0]}）")
+    for name in names:
+        BENCHMARKS[name]()
+    main.db.close()
+
+
+if __name__ == "__main__":
+    run()
@@ -9,61 +9,1142 @@ FastMCP Plan Manager - 通用计划管理系统
 """
 
 from mcp.server.fastmcp import FastMCP
+from mcp.types import CallToolResult, TextContent
+import pydantic_core
 import json
 import sqlite3
 import os
+import sys
+import atexit
+import gzip
+import time
+import base64
+import bisect
+import queue
+import asyncio
 import logging
-from typing import Dict, Any, Optional
-from datetime import datetime
+import logging.handlers
+import functools
+import itertools
+import threading
+from abc import ABC, abstractmethod
+from concurrent.futures import ThreadPoolExecutor
+from collections import OrderedDict
+from dataclasses import dataclass
+from contextlib import contextmanager, redirect_stdout
+from typing import Dict, Any, List, Optional, TypedDict
+from datetime import datetime, timedelta
 
 # 配置日志系统
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(levelname)s - %(message)s',
-    handlers=[
-        logging.FileHandler('plan_manager.log', encoding='utf-8'),
-        logging.StreamHandler()
-    ],
-    force=True  # 强制重新配置，确保生效
-)
+class DroppingQueueHandler(logging.handlers.QueueHandler):
+    """队列满时丢弃日志并计数，写日志永远不会阻塞请求线程"""
+    
+    def __init__(self, log_queue: queue.Queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+    
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+class LogListener(logging.handlers.QueueListener):
+    """后台写日志的线程；stop() 会等队列腾出位置再发送结束标记，可重复调用"""
+    
+    def enqueue_sentinel(self):
+        self.queue.put(self._sentinel)
+    
+    def stop(self):
+        if self._thread is not None:
+            super().stop()
+
+def setup_logging(log_file: str = 'plan_manager.log', echo: Optional[bool] = None,
+                  queue_size: Optional[int] = None) -> LogListener:
+    """
+    配置异步日志：请求线程只把日志放进有界内存队列，由后台线程写入文件
+    
+    文件按大小轮换，回显输出到 stderr（stdio 传输下 stdout 是协议通道）。
+    
+    Args:
+        log_file: 日志文件路径
+        echo: 是否回显到 stderr，默认读取 PLAN_LOG_ECHO（"0" 关闭）
+        queue_size: 队列容量，默认读取 PLAN_LOG_QUEUE_SIZE
+    
+    Returns:
+        已启动的 LogListener，退出前调用 stop() 写完剩余日志
+    """
+    if echo is None:
+        echo = os.environ.get("PLAN_LOG_ECHO", "1") != "0"
+    if queue_size is None:
+        queue_size = int(os.environ.get("PLAN_LOG_QUEUE_SIZE", "10000"))
+    
+    formatter = logging.Formatter('%(asctime)s - %(levelname)s - %(message)s')
+    sinks = [
+        logging.handlers.RotatingFileHandler(
+            log_file, encoding='utf-8',
+            maxBytes=int(os.environ.get("PLAN_LOG_MAX_BYTES", str(5 * 1024 * 1024))),
+            backupCount=int(os.environ.get("PLAN_LOG_BACKUP_COUNT", "5"))
+        )
+    ]
+    if echo:
+        sinks.append(logging.StreamHandler(sys.stderr))
+    for sink in sinks:
+        sink.setFormatter(formatter)
+    
+    queue_handler = DroppingQueueHandler(queue.Queue(maxsize=queue_size))
+    # 入队前只合并消息参数，时间和级别由输出端的 formatter 添加
+    queue_handler.setFormatter(logging.Formatter('%(message)s'))
+    logging.basicConfig(level=logging.INFO, handlers=[queue_handler],
+                        force=True)  # 强制重新配置，确保生效
+    
+    listener = LogListener(queue_handler.queue, *sinks, respect_handler_level=True)
+    listener.start()
+    atexit.register(listener.stop)
+    return listener
+
+log_listener = setup_logging()
 logger = logging.getLogger(__name__)
 
+# 计划项记录
+@dataclass(slots=True)
+class PlanItem:
+    """
+    plans 表一行的紧凑表示（__slots__，没有逐实例的 __dict__），存储层组装计划树和缓存时使用
+
+    - 字段顺序与 SQLiteDB.COLUMNS 一致，用 PlanItem(*row) 由完整的行构造
+    - metadata 保持数据库中的JSON字符串，转换为字典时才解析，
+      缓存中的记录没有可变的嵌套对象，返回给调用方前不必逐层复制
+    - children 只在组装计划树时设置
+
+    只有要长期驻留内存的行（缓存）才用 PlanItem；查询后立即返回的行
+    直接转换为字典（_row_to_item），省去一次中间对象。
+    """
+    id: int
+    name: str
+    description: Optional[str]
+    category: Optional[str]
+    parent_id: Optional[int]
+    scheduled_at: Optional[str]
+    deadline: Optional[str]
+    status: str
+    metadata: Optional[str]
+    created_at: str
+    updated_at: str
+    children: Optional[List["PlanItem"]] = None
+
+    def to_dict(self, columns: Optional[List[str]] = None) -> Dict[str, Any]:
+        """转换为字典（不含 children，metadata 解析为对象）；columns 指定时只包含这些字段"""
+        if columns is None:
+            item = {'id': self.id, 'name': self.name, 'description': self.description,
+                    'category': self.category, 'parent_id': self.parent_id,
+                    'scheduled_at': self.scheduled_at, 'deadline': self.deadline,
+                    'status': self.status, 'metadata': self.metadata,
+                    'created_at': self.created_at, 'updated_at': self.updated_at}
+        else:
+            item = {column: getattr(self, column) for column in columns}
+        if item.get('metadata'):
+            item['metadata'] = json_loads(item['metadata'])
+        return item
+
+    def tree_to_dict(self, columns: Optional[List[str]] = None) -> Dict[str, Any]:
+        """把以本节点为根的子树逐节点转换为字典（迭代实现），子节点放在 children 中"""
+        root = self.to_dict(columns)
+        stack = [(self, root)]
+        while stack:
+            node, converted = stack.pop()
+            if node.children:
+                converted['children'] = [child.to_dict(columns) for child in node.children]
+                stack.extend(zip(node.children, converted['children']))
+        return root
+
+
+# 计划项/子树缓存
+class ItemCache:
+    """
+    有界LRU缓存，保存单个计划项（"item", id）和组装好的子树（"tree", root_id）
+
+    - 记录每个计划项出现在哪些已缓存的子树中，修改时只失效受影响的子树
+    - 每次失效都会递增 version；读取数据库前记下 version，
+      写回时如果期间发生过失效就放弃写回，避免并发写入时缓存旧数据
+    - 调用方拿到的是缓存对象本身，必须当作只读使用
+      （SQLiteDB 缓存 PlanItem，返回前转换为新的字典）
+    """
+
+    def __init__(self, max_entries: int = 1024):
+        self.max_entries = max_entries
+        self.version = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries: OrderedDict = OrderedDict()
+        self._tree_nodes: Dict[int, set] = {}     # 子树根ID -> 子树内所有ID
+        self._containing: Dict[int, set] = {}     # 计划项ID -> 包含它的已缓存子树根ID
+        self._lock = threading.Lock()
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_entries > 0
+
+    def get(self, key: tuple):
+        with self._lock:
+            value = self._entries.get(key)
+            if value is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def tree_size(self, root_id: int) -> Optional[int]:
+        """已缓存子树的节点数；未缓存时返回 None（不计入命中统计）"""
+        with self._lock:
+            nodes = self._tree_nodes.get(root_id)
+            if nodes is None:
+                return None
+            self._entries.move_to_end(("tree", root_id))
+            self.hits += 1
+            return len(nodes)
+
+    def put(self, key: tuple, value, version: int, nodes: Optional[set] = None):
+        """写入缓存；nodes 为子树包含的全部ID（仅 tree 条目需要）"""
+        if not self.enabled:
+            return
+        with self._lock:
+            if version != self.version:
+                return
+            self._discard(key)
+            self._entries[key] = value
+            if nodes is not None:
+                root_id = key[1]
+                self._tree_nodes[root_id] = nodes
+                for node_id in nodes:
+                    self._containing.setdefault(node_id, set()).add(root_id)
+            while len(self._entries) > self.max_entries:
+                oldest = next(iter(self._entries))
+                self._discard(oldest)
+                self.evictions += 1
+
+    def invalidate_items(self, item_ids):
+        """计划项本身改变（更新/删除）：失效该项及所有包含它的子树"""
+        with self._lock:
+            self.version += 1
+            for item_id in item_ids:
+                self._discard(("item", item_id))
+                self._discard_trees_containing(item_id)
+
+    def invalidate_trees(self, item_ids):
+        """计划项下新增了子项：只失效包含它的子树，计划项本身仍然有效"""
+        with self._lock:
+            self.version += 1
+            for item_id in item_ids:
+                self._discard_trees_containing(item_id)
+
+    def clear(self):
+        with self._lock:
+            self.version += 1
+            self._entries.clear()
+            self._tree_nodes.clear()
+            self._containing.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "max_entries": self.max_entries,
+                "entries": len(self._entries),
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+            }
+
+    def _discard_trees_containing(self, item_id: int):
+        for root_id in list(self._containing.get(item_id, ())):
+            self._discard(("tree", root_id))
+
+    def _discard(self, key: tuple):
+        # 调用方需持有锁
+        if self._entries.pop(key, None) is None or key[0] != "tree":
+            return
+        for node_id in self._tree_nodes.pop(key[1], ()):
+            roots = self._containing.get(node_id)
+            if roots is not None:
+                roots.discard(key[1])
+                if not roots:
+                    del self._containing[node_id]
+
+# 存储配置档：每个连接建立时按顺序执行的PRAGMA
+# - durable:   WAL + synchronous=FULL，每次提交都落盘
+# - balanced:  WAL + synchronous=NORMAL，读写互不阻塞，只在检查点时fsync（默认）
+# - ephemeral: 内存日志 + 不fsync，仅用于测试和基准
+STORAGE_PROFILES = {
+    "durable": {
+        "busy_timeout": 5000,
+        "journal_mode": "WAL",
+        "synchronous": "FULL",
+        "cache_size": -16000,      # 约16MB
+        "mmap_size": 0,
+        "temp_store": "DEFAULT",
+        "wal_autocheckpoint": 1000,
+    },
+    "balanced": {
+        "busy_timeout": 5000,
+        "journal_mode": "WAL",
+        "synchronous": "NORMAL",
+        "cache_size": -64000,      # 约64MB
+        "mmap_size": 268435456,    # 256MB
+        "temp_store": "MEMORY",
+        "wal_autocheckpoint": 1000,
+    },
+    "ephemeral": {
+        "busy_timeout": 1000,
+        "journal_mode": "MEMORY",
+        "synchronous": "OFF",
+        "cache_size": -64000,
+        "mmap_size": 0,
+        "temp_store": "MEMORY",
+    },
+}
+
+# SQLite连接池
+class ConnectionPool:
+    """
+    线程感知的SQLite连接池
+
+    - 连接长期复用，PRAGMA 只在建立连接时执行一次
+    - 同一线程内的嵌套调用复用同一个连接（可见未提交的修改）
+    - 取出连接时做健康检查，失效连接会被替换
+    """
+
+    def __init__(self, db_path: str, size: int = 5,
+                 pragmas: Optional[Dict[str, Any]] = None,
+                 timeout: float = 30.0):
+        if size < 1:
+            raise ValueError("连接池大小必须大于 0")
+        self.db_path = db_path
+        self.size = size
+        self.timeout = timeout
+        self.pragmas = {"foreign_keys": "ON"}
+        if pragmas:
+            self.pragmas.update(pragmas)
+
+        self._idle: queue.LifoQueue = queue.LifoQueue(maxsize=size)
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._created = 0
+        self._closed = False
+
+    def _create_connection(self) -> sqlite3.Connection:
+        """新建连接并应用PRAGMA"""
+        conn = sqlite3.connect(self.db_path, timeout=self.timeout,
+                               check_same_thread=False,
+                               uri=self.db_path.startswith("file:"))
+        for key, value in self.pragmas.items():
+            conn.execute(f"PRAGMA {key} = {value}")
+        return conn
+
+    @staticmethod
+    def _is_healthy(conn: sqlite3.Connection) -> bool:
+        """健康检查：能执行简单查询且没有遗留的事务"""
+        try:
+            if conn.in_transaction:
+                conn.rollback()
+            conn.execute("SELECT 1").fetchone()
+            return True
+        except sqlite3.Error:
+            return False
+
+    def _acquire(self) -> sqlite3.Connection:
+        if self._closed:
+            raise sqlite3.ProgrammingError("连接池已关闭")
+
+        try:
+            conn = self._idle.get_nowait()
+        except queue.Empty:
+            with self._lock:
+                can_create = self._created < self.size
+                if can_create:
+                    self._created += 1
+            if can_create:
+                try:
+                    return self._create_connection()
+                except Exception:
+                    with self._lock:
+                        self._created -= 1
+                    raise
+            try:
+                conn = self._idle.get(timeout=self.timeout)
+            except queue.Empty:
+                raise sqlite3.OperationalError(
+                    f"等待数据库连接超时（{self.timeout}秒，连接池大小 {self.size}）")
+
+        if not self._is_healthy(conn):
+            try:
+                conn.close()
+            except sqlite3.Error:
+                pass
+            conn = self._create_connection()
+        return conn
+
+    def _release(self, conn: sqlite3.Connection):
+        if self._closed:
+            conn.close()
+            return
+        try:
+            self._idle.put_nowait(conn)
+        except queue.Full:
+            conn.close()
+            with self._lock:
+                self._created -= 1
+
+    @contextmanager
+    def connection(self):
+        """借出一个连接；同一线程内可重入"""
+        conn = getattr(self._local, "conn", None)
+        if conn is not None:
+            yield conn
+            return
+
+        conn = self._acquire()
+        self._local.conn = conn
+        try:
+            yield conn
+        finally:
+            self._local.conn = None
+            if conn.in_transaction:
+                # 调用方没有提交的事务一律回滚，避免脏连接回到池中
+                conn.rollback()
+            self._release(conn)
+
+    @contextmanager
+    def transaction(self):
+        """
+        在一个事务中执行；嵌套调用时只有最外层提交
+        
+        最外层显式 BEGIN IMMEDIATE（sqlite3 模块只在DML前隐式开始事务），
+        事务中先读后写的 SELECT 也在写锁之下，读到的数据在提交前不会被其他连接修改。
+        """
+        with self.connection() as conn:
+            tx_depth = getattr(self._local, "tx_depth", 0)
+            if tx_depth == 0 and not conn.in_transaction:
+                conn.execute("BEGIN IMMEDIATE")
+            self._local.tx_depth = tx_depth + 1
+            if tx_depth == 0:
+                self._local.callbacks = []
+            try:
+                yield conn
+                if tx_depth == 0:
+                    conn.commit()
+            except Exception:
+                if tx_depth == 0:
+                    conn.rollback()
+                raise
+            finally:
+                self._local.tx_depth = tx_depth
+                if tx_depth == 0:
+                    callbacks, self._local.callbacks = self._local.callbacks, []
+                    for callback in callbacks:
+                        callback()
+
+    @property
+    def in_transaction(self) -> bool:
+        """当前线程是否处于 transaction() 中"""
+        return getattr(self._local, "tx_depth", 0) > 0
+
+    def after_transaction(self, callback):
+        """注册在当前线程最外层事务结束（提交或回滚）后执行的回调；不在事务中时立即执行"""
+        if self.in_transaction:
+            self._local.callbacks.append(callback)
+        else:
+            callback()
+
+    def close(self):
+        """关闭所有空闲连接，之后归还的连接也会直接关闭"""
+        self._closed = True
+        while True:
+            try:
+                conn = self._idle.get_nowait()
+            except queue.Empty:
+                break
+            conn.close()
+
+    @property
+    def closed(self) -> bool:
+        return self._closed
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "size": self.size,
+            "created": self._created,
+            "idle": self._idle.qsize(),
+        }
+
+# 递归CTE：收集以 {root} 为根的整棵子树的ID（UNION 去重，父子关系成环时也能终止）
+SUBTREE_CTE_TEMPLATE = '''
+    WITH RECURSIVE subtree(id) AS (
+        SELECT id FROM plans WHERE id = {root}
+        UNION
+        SELECT p.id FROM plans p JOIN subtree s ON p.parent_id = s.id
+    )
+'''
+# 根ID用位置参数 ? 传入
+SUBTREE_CTE = SUBTREE_CTE_TEMPLATE.format(root="?")
+# 根ID用命名参数 :root 传入（与其他命名参数一起使用时）
+SUBTREE_CTE_NAMED = SUBTREE_CTE_TEMPLATE.format(root=":root")
+
+class JSONCodec:
+    """
+    JSON 编解码实现
+
+    dumps(obj, default=None) 返回紧凑的 str（不转义非ASCII），无法编码的对象交给 default，
+    没有 default 时抛出 TypeError；loads 接受 str 或 bytes。
+    """
+
+    def __init__(self, name: str, dumps, loads):
+        self.name = name
+        self.dumps = dumps
+        self.loads = loads
+
+def _orjson_codec() -> JSONCodec:
+    import orjson
+    option = orjson.OPT_NON_STR_KEYS
+    return JSONCodec("orjson",
+                     lambda obj, default=None: orjson.dumps(obj, default=default, option=option).decode(),
+                     orjson.loads)
+
+def _msgspec_codec() -> JSONCodec:
+    import msgspec
+    return JSONCodec("msgspec",
+                     lambda obj, default=None: msgspec.json.encode(obj, enc_hook=default).decode(),
+                     msgspec.json.decode)
+
+def _stdlib_codec() -> JSONCodec:
+    return JSONCodec("json",
+                     lambda obj, default=None: json.dumps(obj, ensure_ascii=False, separators=(",", ":"),
+                                                          default=default),
+                     json.loads)
+
+# 可选的JSON编解码器，按优先级排列；orjson / msgspec 为可选依赖
+JSON_CODECS = {
+    "orjson": _orjson_codec,
+    "msgspec": _msgspec_codec,
+    "json": _stdlib_codec,
+}
+
+def select_json_codec(name: Optional[str] = None) -> JSONCodec:
+    """
+    选择JSON编解码器
+
+    Args:
+        name: JSON_CODECS 中的名称；None 时使用第一个已安装的
+    """
+    if name:
+        if name not in JSON_CODECS:
+            raise ValueError(f"未知的JSON编解码器: {name}，可选: {', '.join(JSON_CODECS)}")
+        try:
+            return JSON_CODECS[name]()
+        except ImportError as e:
+            raise ValueError(f"JSON编解码器 {name} 不可用: {e}")
+    for factory in JSON_CODECS.values():
+        try:
+            return factory()
+        except ImportError:
+            continue
+
+json_codec = select_json_codec(os.environ.get("PLAN_JSON_CODEC"))
+
+def json_dumps(obj, default=None) -> str:
+    """用 json_codec 编码；它无法处理的值（如超过64位的整数）退回标准库，标准库也不能编码时抛出 TypeError"""
+    try:
+        return json_codec.dumps(obj, default)
+    except TypeError:
+        if json_codec.name == "json":
+            raise
+        return _stdlib_codec().dumps(obj, default)
+
+def json_loads(data):
+    return json_codec.loads(data)
+
+def encode_cursor(kind: str, values: list) -> str:
+    """将排序键编码为不透明的分页游标"""
+    payload = json.dumps({"k": kind, "v": values}, ensure_ascii=False, separators=(",", ":"))
+    return base64.urlsafe_b64encode(payload.encode("utf-8")).decode("ascii")
+
+def decode_cursor(cursor: str, kind: str, size: int = 2) -> list:
+    """解析分页游标（size 为排序键个数），格式错误或类型不符时抛出 ValueError"""
+    try:
+        payload = json.loads(base64.urlsafe_b64decode(cursor.encode("ascii")))
+        values = payload["v"]
+        valid = payload["k"] == kind and isinstance(values, list) and len(values) == size
+    except (ValueError, TypeError, KeyError):
+        valid = False
+    if not valid:
+        raise ValueError(f"无效的分页游标: {cursor}")
+    return values
+
+class PlanStore(ABC):
+    """
+    存储引擎接口：MCP 工具只通过这些方法读写计划，不直接打开数据库连接
+
+    实现见 SQLiteDB（文件数据库）和 MemoryDB（进程内内存数据库），
+    通过 STORAGE_BACKENDS / open_store 按名称选择。
+    """
+
+    @abstractmethod
+    def transaction(self):
+        """事务上下文管理器：其中的多次写入一起提交或回滚，可嵌套"""
+
+    @abstractmethod
+    def get_item(self, item_id: int) -> Optional[Dict[str, Any]]:
+        """按ID获取单个计划项，不存在时返回 None"""
+
+    @abstractmethod
+    def query_items(self, parent_id: Optional[int] = None, category: Optional[str] = None,
+                    status: Optional[str] = None, **filters) -> list:
+        """按父计划/类别/状态等条件查询计划项"""
+
+    @abstractmethod
+    def get_tree(self, item_id: int) -> Optional[Dict[str, Any]]:
+        """获取以 item_id 为根的完整计划树"""
+
+    @abstractmethod
+    def create_item(self, name: str, **fields) -> int:
+        """创建单个计划项，返回新ID"""
+
+    @abstractmethod
+    def create_items_bulk(self, parent: Dict[str, Any],
+                          children: List[Dict[str, Any]]) -> List[int]:
+        """在一个事务中创建父计划及其子计划，返回 [父ID, 子ID...]"""
+
+    @abstractmethod
+    def update_item(self, item_id: int, **fields) -> bool:
+        """更新单个计划项的字段"""
+
+    @abstractmethod
+    def delete_item(self, item_id: int) -> bool:
+        """删除计划项及其全部子计划"""
+
+    @abstractmethod
+    def delete_tree(self, item_id: int, dry_run: bool = False,
+                    fields: Optional[List[str]] = None) -> Optional[Dict[str, Any]]:
+        """删除（dry_run 时只预览）以 item_id 为根的子树，返回数量和被删除的计划树"""
+
+    @abstractmethod
+    def undo_delete(self, item_id: int) -> Dict[str, Any]:
+        """撤销最近一次对 item_id 的删除，按原ID恢复整棵子树"""
+
+    @abstractmethod
+    def close(self):
+        """释放引擎持有的资源"""
+
 # SQLite数据库管理类
-class SQLiteDB:
-    def __init__(self, db_path: str = "plans.db"):
+class SQLiteDB(PlanStore):
+    COLUMNS = ['id', 'name', 'description', 'category', 'parent_id', 
+               'scheduled_at', 'deadline', 'status', 'metadata', 
+               'created_at', 'updated_at']
+
+    INSERT_SQL = '''
+        INSERT INTO plans (name, description, category, parent_id, 
+                          scheduled_at, deadline, metadata)
+        VALUES (?, ?, ?, ?, ?, ?, ?)
+    '''
+    # INSERT_SQL 参数对应的字段，审计记录里的 after 按这个顺序生成
+    INSERT_FIELDS = ('name', 'description', 'category', 'parent_id',
+                     'scheduled_at', 'deadline', 'metadata')
+
+    def __init__(self, db_path: str = "plans.db", pool_size: int = 5,
+                 profile: str = "balanced", cache_size: int = 1024):
+        if profile not in STORAGE_PROFILES:
+            raise ValueError(
+                f"未知的存储配置档: {profile}，可选: {', '.join(STORAGE_PROFILES)}")
         self.db_path = db_path
+        self.profile = profile
+        self.pool = ConnectionPool(db_path, size=pool_size,
+                                   pragmas=STORAGE_PROFILES[profile])
+        self.cache = ItemCache(max_entries=cache_size)
+        # 每次变更（写审计记录时）递增，供内存中的派生数据判断是否过期
+        self.write_version = 0
         self.init_database()
+
+    def connection(self):
+        """从连接池借出连接（上下文管理器）"""
+        return self.pool.connection()
+
+    def transaction(self):
+        """在事务中执行（上下文管理器），正常退出时提交，异常时回滚"""
+        return self.pool.transaction()
+
+    def invalidate_cache(self, item_ids: Optional[List[int]] = None):
+        """
+        使缓存失效；绕过 SQLiteDB 方法直接写库后需要调用
+        
+        Args:
+            item_ids: 被修改的计划项ID，None 表示清空全部缓存
+        """
+        if item_ids is None:
+            self.cache.clear()
+            self.pool.after_transaction(self.cache.clear)
+        else:
+            self._invalidate(item_ids=item_ids)
+    
+    def _invalidate(self, item_ids=(), parent_ids=()):
+        """失效缓存；在事务中时提交/回滚后再失效一次，防止其他线程在提交前缓存了旧数据"""
+        def invalidate():
+            if item_ids:
+                self.cache.invalidate_items(item_ids)
+            if parent_ids:
+                self.cache.invalidate_trees(parent_ids)
+        
+        invalidate()
+        if self.pool.in_transaction:
+            self.pool.after_transaction(invalidate)
+    
+    def _cacheable(self, conn: sqlite3.Connection) -> bool:
+        """事务中读到的数据可能回滚，不写入缓存"""
+        return self.cache.enabled and not self.pool.in_transaction and not conn.in_transaction
+    
+    def checkpoint(self, mode: str = "PASSIVE") -> Dict[str, int]:
+        """
+        执行WAL检查点，把WAL中的页写回主数据库文件
+        
+        Args:
+            mode: PASSIVE（不阻塞读写）、FULL、RESTART 或 TRUNCATE（同时清空WAL文件）
+        """
+        mode = mode.upper()
+        if mode not in ("PASSIVE", "FULL", "RESTART", "TRUNCATE"):
+            raise ValueError(f"未知的检查点模式: {mode}")
+        
+        with self.connection() as conn:
+            busy, log_frames, checkpointed = conn.execute(
+                f"PRAGMA wal_checkpoint({mode})").fetchone()
+        return {"busy": busy, "log_frames": log_frames, "checkpointed": checkpointed}
+    
+    def journal_mode(self) -> str:
+        """当前连接使用的日志模式"""
+        with self.connection() as conn:
+            return conn.execute("PRAGMA journal_mode").fetchone()[0]
+
+    def close(self):
+        """关闭连接池（WAL模式下先做一次TRUNCATE检查点）"""
+        if self.pool.closed:
+            return
+        if self.journal_mode() == "wal":
+            try:
+                self.checkpoint("TRUNCATE")
+            except sqlite3.Error as e:
+                logger.warning(f"关闭前检查点失败: {e}")
+        self.pool.close()
     
     def init_database(self):
         """初始化数据库表结构"""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
+        with self.transaction() as conn:
+            cursor = conn.cursor()
+            
+            # 创建计划表
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS plans (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    name TEXT NOT NULL,
+                    description TEXT,
+                    category TEXT DEFAULT 'general',
+                    parent_id INTEGER,
+                    scheduled_at DATE,
+                    deadline DATE,
+                    status TEXT DEFAULT 'pending',
+                    metadata TEXT,
+                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                    FOREIGN KEY (parent_id) REFERENCES plans (id) ON DELETE CASCADE
+                )
+            ''')
+            
+            # 审计表：每次变更一行，和变更本身在同一个事务中写入
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS plan_audit (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    ts TEXT NOT NULL DEFAULT (strftime('%Y-%m-%d %H:%M:%f', 'now', 'localtime')),
+                    op TEXT NOT NULL,
+                    item_id INTEGER,
+                    before TEXT,
+                    after TEXT,
+                    detail TEXT
+                )
+            ''')
+            cursor.execute('CREATE INDEX IF NOT EXISTS idx_audit_ts ON plan_audit(ts)')
+            cursor.execute('CREATE INDEX IF NOT EXISTS idx_audit_item ON plan_audit(item_id, id)')
+            cursor.execute('CREATE INDEX IF NOT EXISTS idx_audit_op ON plan_audit(op, id)')
+            
+            self.fts_enabled = self._init_fts(cursor)
+            self._init_counters(cursor)
+            self._init_rollups(cursor)
+            self._migrate_legacy_items(cursor)
+            # 旧 items 表的索引与 plans 的同名，删表之后再建，否则 IF NOT EXISTS 会跳过
+            self._init_indexes(cursor)
+    
+    def _init_indexes(self, cursor):
+        """创建 plans 表的索引（已存在的跳过），并删除被组合索引取代的旧索引"""
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_parent_id ON plans(parent_id)')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_category ON plans(category)')
+        # (status, scheduled_at) 同时服务按状态筛选和按状态过滤的日程
+        cursor.execute('DROP INDEX IF EXISTS idx_status')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_status_scheduled ON plans(status, scheduled_at)')
+        # 键集分页：按父计划列出时按 (created_at, id) 顺序扫描
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_parent_created ON plans(parent_id, created_at, id)')
+        # 按日期范围查找（日程 get_agenda、fix_old_dates）
+        cursor.execute('DROP INDEX IF EXISTS idx_scheduled_at')
+        cursor.execute('DROP INDEX IF EXISTS idx_deadline')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_scheduled_status ON plans(scheduled_at, status)')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_deadline_status ON plans(deadline, status)')
+        # 部分索引：只包含未完成且有截止时间的计划项（到期/逾期扫描）
+        cursor.execute(f'''
+            CREATE INDEX IF NOT EXISTS idx_open_deadline ON plans(deadline)
+            WHERE {self.OPEN_DEADLINE_SQL}
+        ''')
+    
+    def _migrate_legacy_items(self, cursor):
+        """
+        把旧存储层（db.py）的 items 表并入 plans 表后删除
+        
+        items 的列与 plans 相同，ID 重新分配，父子关系按新ID映射。
+        """
+        exists = cursor.execute(
+            "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'items'"
+        ).fetchone()
+        if not exists:
+            return
         
-        # 创建计划表
+        rows = cursor.execute('''
+            SELECT id, parent_id, name, description, status, scheduled_at, deadline,
+                   category, NULLIF(metadata, '{}'), created_at, updated_at
+            FROM items ORDER BY id
+        ''').fetchall()
+        new_ids = {}
+        for old_id, _, *fields in rows:
+            new_ids[old_id] = cursor.execute('''
+                INSERT INTO plans (name, description, status, scheduled_at, deadline,
+                                   category, metadata, created_at, updated_at)
+                VALUES (?, ?, ?, ?, ?, ?, ?,
+                        IFNULL(?, CURRENT_TIMESTAMP), IFNULL(?, CURRENT_TIMESTAMP))
+            ''', fields).lastrowid
+        cursor.executemany("UPDATE plans SET parent_id = ? WHERE id = ?", [
+            (new_ids[parent_id], new_ids[old_id])
+            for old_id, parent_id, *_ in rows if parent_id in new_ids
+        ])
+        cursor.execute("DROP TABLE items")
+        if rows:
+            self._rebuild_rollups(cursor)
+        logger.info(f"📦 旧 items 表已并入 plans 表（{len(rows)} 条）")
+    
+    # 写入全文索引的列值：末尾补一个 char(31)，字段末尾的两个字也是某个三字组的前缀，
+    # 两个字的搜索词可以按前缀在索引词表中查找（见 _search）
+    FTS_VALUES = "{row}.name || char(31), {row}.description || char(31), {row}.metadata || char(31)"
+    
+    def _init_fts(self, cursor) -> bool:
+        """
+        创建全文索引（FTS5 外部内容表 + 同步触发器 + 索引词表）
+        
+        使用 trigram 分词器：按三字符切分，不依赖空格分词，
+        中文名称（如“云南旅行计划”）也能做子串匹配。
+        两个字的词（如“旅行”）通过 fts5vocab 词表按三字组前缀查找。
+        新建索引或触发器是旧版本（列值未补 char(31)）时从 plans 表重建，已有数据库升级后即可搜索。
+        SQLite 不支持 FTS5/trigram 时返回 False，搜索退回 LIKE 扫描。
+        """
+        exists = cursor.execute(
+            "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'plans_fts'"
+        ).fetchone()
+        try:
+            cursor.execute('''
+                CREATE VIRTUAL TABLE IF NOT EXISTS plans_fts USING fts5(
+                    name, description, metadata,
+                    content='plans', content_rowid='id', tokenize='trigram'
+                )
+            ''')
+        except sqlite3.OperationalError as e:
+            logger.warning(f"全文索引不可用，搜索将使用LIKE扫描: {e}")
+            return False
+        cursor.execute(
+            "CREATE VIRTUAL TABLE IF NOT EXISTS plans_fts_terms USING fts5vocab(plans_fts, 'instance')")
+        
+        trigger = cursor.execute(
+            "SELECT sql FROM sqlite_master WHERE type = 'trigger' AND name = 'plans_fts_ai'"
+        ).fetchone()
+        stale = trigger is not None and "char(31)" not in trigger[0]
+        if stale:
+            for name in ("plans_fts_ai", "plans_fts_ad", "plans_fts_au"):
+                cursor.execute(f"DROP TRIGGER {name}")
+        
+        new_values = self.FTS_VALUES.format(row="new")
+        old_values = self.FTS_VALUES.format(row="old")
+        cursor.execute(f'''
+            CREATE TRIGGER IF NOT EXISTS plans_fts_ai AFTER INSERT ON plans BEGIN
+                INSERT INTO plans_fts (rowid, name, description, metadata)
+                VALUES (new.id, {new_values});
+            END
+        ''')
+        cursor.execute(f'''
+            CREATE TRIGGER IF NOT EXISTS plans_fts_ad AFTER DELETE ON plans BEGIN
+                INSERT INTO plans_fts (plans_fts, rowid, name, description, metadata)
+                VALUES ('delete', old.id, {old_values});
+            END
+        ''')
+        cursor.execute(f'''
+            CREATE TRIGGER IF NOT EXISTS plans_fts_au
+            AFTER UPDATE OF name, description, metadata ON plans BEGIN
+                INSERT INTO plans_fts (plans_fts, rowid, name, description, metadata)
+                VALUES ('delete', old.id, {old_values});
+                INSERT INTO plans_fts (rowid, name, description, metadata)
+                VALUES (new.id, {new_values});
+            END
+        ''')
+        
+        if not exists or stale:
+            self._rebuild_fts(cursor)
+            logger.info("🔎 全文索引已创建并从现有数据重建")
+        
+        return True
+    
+    def _rebuild_fts(self, cursor):
+        """清空全文索引后按 FTS_VALUES 重新写入全部计划（不能用 'rebuild'，它读取的是未补位的原始列值）"""
+        cursor.execute("INSERT INTO plans_fts (plans_fts) VALUES ('delete-all')")
+        cursor.execute(f'''
+            INSERT INTO plans_fts (rowid, name, description, metadata)
+            SELECT id, {self.FTS_VALUES.format(row="plans")} FROM plans
+        ''')
+    
+    # 计数维度 -> 计划表上对应的表达式（total 只有一个空键）
+    COUNTER_DIMENSIONS = {
+        'total': "''",
+        'status': "IFNULL({row}.status, '')",
+        'category': "IFNULL({row}.category, '')",
+        'month': "IFNULL(strftime('%Y-%m', {row}.created_at), '')",
+    }
+    
+    def _counter_upsert(self, row: str, delta: int) -> str:
+        """生成按 row（new/old 或表别名）增减全部维度计数的 UPSERT 语句"""
+        values = ", ".join(
+            f"('{dim}', {expr.format(row=row)}, {delta})"
+            for dim, expr in self.COUNTER_DIMENSIONS.items())
+        return f'''
+            INSERT INTO plan_counters (dim, key, count) VALUES {values}
+            ON CONFLICT(dim, key) DO UPDATE SET count = count + excluded.count;
+        '''
+    
+    def _init_counters(self, cursor):
+        """
+        创建统计计数表和维护触发器，get_plan_statistics 直接读取，不再全表聚合
+        
+        触发器覆盖所有写入路径（包括级联删除和直接执行的SQL）。
+        新建计数表时从 plans 表重算一次，已有数据库升级后即可使用。
+        """
+        exists = cursor.execute(
+            "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'plan_counters'"
+        ).fetchone()
         cursor.execute('''
-            CREATE TABLE IF NOT EXISTS plans (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                name TEXT NOT NULL,
-                description TEXT,
-                category TEXT DEFAULT 'general',
-                parent_id INTEGER,
-                scheduled_at DATE,
-                deadline DATE,
-                status TEXT DEFAULT 'pending',
-                metadata TEXT,
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                FOREIGN KEY (parent_id) REFERENCES plans (id) ON DELETE CASCADE
-            )
+            CREATE TABLE IF NOT EXISTS plan_counters (
+                dim TEXT NOT NULL,
+                key TEXT NOT NULL,
+                count INTEGER NOT NULL DEFAULT 0,
+                PRIMARY KEY (dim, key)
+            ) WITHOUT ROWID
+        ''')
+        cursor.execute(f'''
+            CREATE TRIGGER IF NOT EXISTS plan_counters_ai AFTER INSERT ON plans BEGIN
+                {self._counter_upsert("new", 1)}
+            END
+        ''')
+        cursor.execute(f'''
+            CREATE TRIGGER IF NOT EXISTS plan_counters_ad AFTER DELETE ON plans BEGIN
+                {self._counter_upsert("old", -1)}
+            END
+        ''')
+        cursor.execute(f'''
+            CREATE TRIGGER IF NOT EXISTS plan_counters_au
+            AFTER UPDATE OF status, category, created_at ON plans BEGIN
+                {self._counter_upsert("old", -1)}
+                {self._counter_upsert("new", 1)}
+            END
         ''')
         
-        # 创建索引
-        cursor.execute('CREATE INDEX IF NOT EXISTS idx_parent_id ON plans(parent_id)')
-        cursor.execute('CREATE INDEX IF NOT EXISTS idx_category ON plans(category)')
-        cursor.execute('CREATE INDEX IF NOT EXISTS idx_status ON plans(status)')
+        if not exists:
+            self._recount(cursor)
+            logger.info("📊 统计计数表已创建并从现有数据重算")
+    
+    def _count_from_scratch(self, cursor) -> Dict[tuple, int]:
+        """全表聚合得到各维度的真实计数 {(dim, key): count}"""
+        actual = {}
+        for dim, expr in self.COUNTER_DIMENSIONS.items():
+            key_expr = expr.format(row="plans")
+            for key, count in cursor.execute(
+                    f"SELECT {key_expr}, COUNT(*) FROM plans GROUP BY 1"):
+                actual[(dim, key)] = count
+        return actual
+    
+    def _recount(self, cursor) -> Dict[tuple, int]:
+        actual = self._count_from_scratch(cursor)
+        cursor.execute("DELETE FROM plan_counters")
+        cursor.executemany("INSERT INTO plan_counters (dim, key, count) VALUES (?, ?, ?)",
+                           [(dim, key, count) for (dim, key), count in actual.items()])
+        return actual
+    
+    def get_statistics(self) -> Dict[str, Any]:
+        """
+        读取计数表中的统计（与计划总数无关的常数级开销）
         
-        conn.commit()
-        conn.close()
+        Returns:
+            {"total", "by_status", "by_category", "by_month"}，后三项是 {键: 数量}
+        """
+        with self.connection() as conn:
+            rows = conn.execute(
+                "SELECT dim, key, count FROM plan_counters WHERE count != 0").fetchall()
+        stats = {"total": 0, "by_status": {}, "by_category": {}, "by_month": {}}
+        for dim, key, count in rows:
+            if dim == 'total':
+                stats["total"] = count
+            else:
+                stats[f"by_{dim}"][key] = count
+        return stats
+    
+    def reconcile_statistics(self) -> Dict[str, Any]:
+        """
+        全表重算统计计数和进度汇总并与现有值比对，修正并返回偏差
+        
+        Returns:
+            {"checked": 维度键个数, "drift": [{"dim", "key", "stored", "actual"}, ...],
+             "rollup_drift": 进度汇总有偏差的计划ID列表}
+        """
+        with self.transaction() as conn:
+            stored = {(dim, key): count for dim, key, count in conn.execute(
+                "SELECT dim, key, count FROM plan_counters")}
+            actual = self._recount(conn.cursor())
+            stored_rollups = {row[0]: tuple(row[1:]) for row in conn.execute(
+                "SELECT plan_id, total, completed, in_progress, cancelled FROM plan_rollups "
+                "WHERE total != 0 OR completed != 0 OR in_progress != 0 OR cancelled != 0")}
+            actual_rollups = self._rebuild_rollups(conn.cursor())
+        
+        drift = [
+            {"dim": dim, "key": key, "stored": stored.get((dim, key), 0),
+             "actual": actual.get((dim, key), 0)}
+            for dim, key in sorted(set(stored) | set(actual))
+            if stored.get((dim, key), 0) != actual.get((dim, key), 0)
+        ]
+        rollup_drift = sorted(
+            plan_id for plan_id in set(stored_rollups) | set(actual_rollups)
+            if stored_rollups.get(plan_id) != actual_rollups.get(plan_id))
+        if drift or rollup_drift:
+            logger.warning(f"📊 统计计数存在偏差，已修正 - 偏差项:{len(drift)} 进度汇总偏差计划:{len(rollup_drift)}")
+        return {"checked": len(set(stored) | set(actual)), "drift": drift,
+                "rollup_drift": rollup_drift}
+    
+    ROLLUP_FIELDS = ('total', 'completed', 'in_progress', 'cancelled')
+    
+    def _init_rollups(self, cursor):
+        """创建进度汇总表：每个父计划的后代总数及各状态数量（由写入路径沿祖先链增量维护）"""
+        exists = cursor.execute(
+            "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'plan_rollups'"
+        ).fetchone()
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS plan_rollups (
+                plan_id INTEGER PRIMARY KEY,
+                total INTEGER NOT NULL DEFAULT 0,
+                completed INTEGER NOT NULL DEFAULT 0,
+                in_progress INTEGER NOT NULL DEFAULT 0,
+                cancelled INTEGER NOT NULL DEFAULT 0
+            )
+        ''')
+        if not exists:
+            self._rebuild_rollups(cursor)
+            logger.info("📊 进度汇总表已创建并从现有数据重算")
+    
+    def _compute_rollups(self, cursor) -> Dict[int, tuple]:
+        """按祖先展开全部计划，重算每个父计划的 (total, completed, in_progress, cancelled)"""
+        rows = cursor.execute('''
+            WITH RECURSIVE lineage(node, ancestor) AS (
+                SELECT id, parent_id FROM plans WHERE parent_id IS NOT NULL
+                UNION
+                SELECT l.node, p.parent_id FROM lineage l
+                JOIN plans p ON p.id = l.ancestor
+                WHERE p.parent_id IS NOT NULL
+            )
+            SELECT l.ancestor, COUNT(*),
+                   SUM(n.status = 'completed'), SUM(n.status = 'in_progress'),
+                   SUM(n.status = 'cancelled')
+            FROM lineage l JOIN plans n ON n.id = l.node
+            GROUP BY l.ancestor
+        ''').fetchall()
+        return {row[0]: tuple(row[1:]) for row in rows}
+    
+    def _rebuild_rollups(self, cursor) -> Dict[int, tuple]:
+        rollups = self._compute_rollups(cursor)
+        cursor.execute("DELETE FROM plan_rollups")
+        cursor.executemany(
+            "INSERT INTO plan_rollups (plan_id, total, completed, in_progress, cancelled) "
+            "VALUES (?, ?, ?, ?, ?)",
+            [(plan_id, *counts) for plan_id, counts in rollups.items()])
+        return rollups
+    
+    @classmethod
+    def _status_delta(cls, status: Optional[str], sign: int = 1) -> tuple:
+        """单个计划项对汇总的贡献 (total, completed, in_progress, cancelled)"""
+        return (sign,) + tuple(sign if status == field else 0 for field in cls.ROLLUP_FIELDS[1:])
+    
+    def _apply_rollup(self, conn, parent_id: Optional[int], delta: tuple):
+        """把 delta 加到 parent_id 及其所有祖先的汇总上"""
+        if parent_id is None or not any(delta):
+            return
+        conn.execute('''
+            WITH RECURSIVE chain(id) AS (
+                SELECT ?
+                UNION
+                SELECT p.parent_id FROM plans p JOIN chain c ON p.id = c.id
+                WHERE p.parent_id IS NOT NULL
+            )
+            INSERT INTO plan_rollups (plan_id, total, completed, in_progress, cancelled)
+            SELECT id, ?, ?, ?, ? FROM chain WHERE true
+            ON CONFLICT(plan_id) DO UPDATE SET
+                total = total + excluded.total,
+                completed = completed + excluded.completed,
+                in_progress = in_progress + excluded.in_progress,
+                cancelled = cancelled + excluded.cancelled
+        ''', (parent_id, *delta))
+    
+    def _subtree_delta(self, conn, item_id: int, status: Optional[str], sign: int) -> tuple:
+        """整棵子树（计划本身 + 已汇总的后代）对祖先汇总的贡献"""
+        row = conn.execute(
+            "SELECT total, completed, in_progress, cancelled FROM plan_rollups WHERE plan_id = ?",
+            (item_id,)).fetchone() or (0, 0, 0, 0)
+        own = self._status_delta(status)
+        return tuple(sign * (a + b) for a, b in zip(own, row))
+    
+    def get_progress(self, item_ids: List[int]) -> Dict[int, Dict[str, Any]]:
+        """
+        批量读取计划进度（只查汇总表，不遍历子树）
+        
+        Returns:
+            {plan_id: {"total", "completed", "in_progress", "cancelled", "pending", "percent"}}，
+            没有子计划的计划 total 为 0
+        """
+        item_ids = list(item_ids)
+        progress = {item_id: dict.fromkeys(self.ROLLUP_FIELDS, 0) for item_id in item_ids}
+        if item_ids:
+            with self.connection() as conn:
+                rows = conn.execute(
+                    f"SELECT plan_id, total, completed, in_progress, cancelled FROM plan_rollups "
+                    f"WHERE plan_id IN ({', '.join('?' * len(item_ids))})", item_ids).fetchall()
+            for plan_id, *counts in rows:
+                progress[plan_id] = dict(zip(self.ROLLUP_FIELDS, counts))
+        for entry in progress.values():
+            entry['pending'] = (entry['total'] - entry['completed']
+                                - entry['in_progress'] - entry['cancelled'])
+            entry['percent'] = round(entry['completed'] * 100 / entry['total'], 1) if entry['total'] else 0.0
+        return progress
+    
+    def rebuild_search_index(self):
+        """从 plans 表完整重建全文索引"""
+        if not self.fts_enabled:
+            return
+        with self.transaction() as conn:
+            self._rebuild_fts(conn.cursor())
     
     def create_item(self, name: str, description: Optional[str] = None, 
                    category: str = "general", parent_id: Optional[int] = None,
@@ -71,64 +1152,165 @@ class SQLiteDB:
                    deadline: Optional[str] = None,
                    metadata: Optional[Dict[str, Any]] = None) -> int:
         """创建新计划项"""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
+        params = self._insert_params(name, description, category, parent_id,
+                                     scheduled_at, deadline, metadata)
         
-        # 如果没有指定scheduled_at，默认使用当前日期
-        if scheduled_at is None:
-            scheduled_at = datetime.now().strftime("%Y-%m-%d")
+        with self.transaction() as conn:
+            cursor = conn.execute(self.INSERT_SQL, params)
+            item_id = cursor.lastrowid
+            self.audit("create", [(item_id, None, dict(zip(self.INSERT_FIELDS, params)), None)])
+            if parent_id is not None:
+                self._apply_rollup(conn, parent_id, self._status_delta('pending'))
+                self._invalidate(parent_ids=[parent_id])
         
-        metadata_json = json.dumps(metadata) if metadata else None
+        # 记录创建日志
+        log_msg = f"✅ 计划创建成功 - ID:{item_id} 名称:{name} 类别:{category} 父计划:{parent_id} 开始时间:{params[4]}"
+        logger.info(log_msg)
         
-        cursor.execute('''
-            INSERT INTO plans (name, description, category, parent_id, 
-                              scheduled_at, deadline, metadata)
-            VALUES (?, ?, ?, ?, ?, ?, ?)
-        ''', (name, description, category, parent_id, 
-              scheduled_at, deadline, metadata_json))
+        return item_id
+    
+    def create_items_bulk(self, parent: Dict[str, Any], 
+                          children: List[Dict[str, Any]]) -> List[int]:
+        """
+        在一个事务中创建父计划及其全部子计划
         
-        item_id = cursor.lastrowid
-        conn.commit()
-        conn.close()
+        Args:
+            parent: 父计划字段（name 必填，其余同 create_item）
+            children: 子计划字段列表；未指定 category 时继承父计划的类别
         
-        # 记录创建日志
-        log_msg = f"✅ 计划创建成功 - ID:{item_id} 名称:{name} 类别:{category} 父计划:{parent_id} 开始时间:{scheduled_at}"
+        Returns:
+            新建ID列表，第一个是父计划ID，其后按顺序是子计划ID
+        """
+        category = parent.get('category') or 'general'
+        parent_params = self._insert_params(
+            parent['name'], parent.get('description'), category,
+            parent.get('parent_id'), parent.get('scheduled_at'),
+            parent.get('deadline'), parent.get('metadata'))
+        
+        with self.transaction() as conn:
+            parent_id = conn.execute(self.INSERT_SQL, parent_params).lastrowid
+            child_params = [
+                self._insert_params(
+                    child.get('name') or 'Untitled Step', child.get('description'),
+                    child.get('category') or category, parent_id,
+                    child.get('scheduled_at'), child.get('deadline'),
+                    child.get('metadata'))
+                for child in children
+            ]
+            conn.executemany(self.INSERT_SQL, child_params)
+            # 同一写事务内 AUTOINCREMENT 分配的ID是连续的
+            last_id = conn.execute("SELECT last_insert_rowid()").fetchone()[0]
+            child_ids = list(range(last_id - len(children) + 1, last_id + 1)) if children else []
+            self.audit("create", [
+                (item_id, None, dict(zip(self.INSERT_FIELDS, params)), None)
+                for item_id, params in zip([parent_id] + child_ids,
+                                           [parent_params] + child_params)
+            ])
+            self._apply_rollup(conn, parent_id, (len(child_ids), 0, 0, 0))
+            if parent.get('parent_id') is not None:
+                self._apply_rollup(conn, parent['parent_id'],
+                                   (len(child_ids) + 1, 0, 0, 0))
+                self._invalidate(parent_ids=[parent['parent_id']])
+        
+        # 整批只记录一条日志
+        log_msg = f"✅ 批量创建成功 - 父计划ID:{parent_id} 名称:{parent['name']} 类别:{category} 子计划数:{len(child_ids)}"
         logger.info(log_msg)
-        print(log_msg)
         
-        return item_id
+        return [parent_id] + child_ids
     
-    def get_item(self, item_id: int) -> Optional[Dict[str, Any]]:
-        """获取单个计划项"""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
+    @staticmethod
+    def _insert_params(name, description, category, parent_id,
+                       scheduled_at, deadline, metadata) -> tuple:
+        """生成 INSERT_SQL 的参数"""
+        # 如果没有指定scheduled_at，默认使用当前日期
+        if scheduled_at is None:
+            scheduled_at = datetime.now().strftime("%Y-%m-%d")
+        
+        metadata_json = json_dumps(metadata) if metadata else None
         
-        cursor.execute('SELECT * FROM plans WHERE id = ?', (item_id,))
-        row = cursor.fetchone()
+        return (name, description, category, parent_id,
+                scheduled_at, deadline, metadata_json)
+    
+    def get_item(self, item_id: int,
+                 fields: Optional[List[str]] = None) -> Optional[Dict[str, Any]]:
+        """
+        获取单个计划项（优先读缓存）
+        
+        Args:
+            fields: 只返回这些字段（id 总会包含）；投影查询的结果不写入缓存
+        """
+        columns = self._columns(fields)
+        cached = self.cache.get(("item", item_id))
+        if cached is not None:
+            return cached.to_dict(None if fields is None else columns)
         
-        conn.close()
+        version = self.cache.version
+        with self.connection() as conn:
+            row = conn.execute(f'SELECT {", ".join(columns)} FROM plans WHERE id = ?',
+                               (item_id,)).fetchone()
+            cacheable = fields is None and self._cacheable(conn)
         
         if not row:
             return None
-            
-        columns = ['id', 'name', 'description', 'category', 'parent_id', 
-                  'scheduled_at', 'deadline', 'status', 'metadata', 
-                  'created_at', 'updated_at']
         
-        item = dict(zip(columns, row))
-        if item['metadata']:
-            item['metadata'] = json.loads(item['metadata'])
+        if not cacheable:
+            return self._row_to_item(row, columns=columns)
+        item = PlanItem(*row)
+        self.cache.put(("item", item_id), item, version)
+        return item.to_dict()
+    
+    def _columns(self, fields: Optional[List[str]], required=('id',)) -> List[str]:
+        """
+        投影要查询的列（按 COLUMNS 顺序），fields 为 None 时为全部列
         
+        required 中的列总会包含（id，以及组装树、分页需要的列）。
+        """
+        if fields is None:
+            return self.COLUMNS
+        unknown = set(fields) - set(self.COLUMNS)
+        if unknown:
+            raise ValueError(
+                f"未知的字段: {', '.join(sorted(unknown))}，可选: {', '.join(self.COLUMNS)}")
+        wanted = set(fields).union(required)
+        return [column for column in self.COLUMNS if column in wanted]
+    
+    def _row_to_item(self, row, decode_metadata: bool = True,
+                     columns: Optional[List[str]] = None) -> Dict[str, Any]:
+        """
+        将查询结果行转换为字典（columns 为行中各列的名称，默认是 SELECT * 的全部列）
+        
+        decode_metadata=False 时 metadata 保持数据库中的JSON字符串，
+        只用到名称、状态等列的调用方（文本列表、批量删除）省去逐行解析。
+        """
+        item = dict(zip(columns or self.COLUMNS, row))
+        if decode_metadata and item.get('metadata'):
+            item['metadata'] = json_loads(item['metadata'])
         return item
     
     def query_items(self, parent_id: Optional[int] = None, 
                    category: Optional[str] = None,
-                   status: Optional[str] = None) -> list:
-        """查询计划项"""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
+                   status: Optional[str] = None,
+                   after: Optional[tuple] = None,
+                   limit: Optional[int] = None,
+                   name: Optional[str] = None,
+                   name_contains: Optional[str] = None,
+                   date_range: Optional[tuple] = None,
+                   decode_metadata: bool = True,
+                   fields: Optional[List[str]] = None) -> list:
+        """
+        查询计划项（按 created_at, id 排序）
         
-        query = "SELECT * FROM plans WHERE 1=1"
+        Args:
+            after: 键集分页游标 (created_at, id)，只返回排在它之后的记录
+            limit: 最多返回条数，默认不限制
+            name: 名称精确匹配
+            name_contains: 名称包含这个字符串（整体子串匹配，不分词、不做前缀扩展）
+            date_range: (start, end)，只返回 scheduled_at 在该闭区间内的记录
+            decode_metadata: False 时 metadata 保持JSON字符串（见 _row_to_item）
+            fields: 只查询并返回这些字段（id 总会包含）
+        """
+        columns = self._columns(fields)
+        query = f"SELECT {', '.join(columns)} FROM plans WHERE 1=1"
         params = []
         
         if parent_id is None:
@@ -146,140 +1328,1330 @@ class SQLiteDB:
         if status:
             query += " AND status = ?"
             params.append(status)
-            
-        query += " ORDER BY created_at"
         
-        cursor.execute(query, params)
-        rows = cursor.fetchall()
-        conn.close()
+        if name is not None:
+            query += " AND name = ?"
+            params.append(name)
         
-        columns = ['id', 'name', 'description', 'category', 'parent_id', 
-                  'scheduled_at', 'deadline', 'status', 'metadata', 
-                  'created_at', 'updated_at']
+        if name_contains:
+            query += " AND name LIKE ? ESCAPE '\\'"
+            params.append(self._like_pattern(name_contains))
         
-        results = []
-        for row in rows:
-            item = dict(zip(columns, row))
-            if item['metadata']:
-                item['metadata'] = json.loads(item['metadata'])
-            results.append(item)
+        if date_range:
+            query += " AND scheduled_at BETWEEN ? AND ?"
+            params.extend(date_range)
+        
+        if after is not None:
+            # 行值比较可以直接利用 (parent_id, created_at, id) 索引定位，翻到多深都一样快
+            query += " AND (created_at, id) > (?, ?)"
+            params.extend(after)
             
-        return results
+        query += " ORDER BY created_at, id"
+        
+        if limit is not None:
+            query += " LIMIT ?"
+            params.append(limit)
+        
+        with self.connection() as conn:
+            rows = conn.execute(query, params).fetchall()
+        
+        return [self._row_to_item(row, decode_metadata, columns) for row in rows]
     
-    def get_tree(self, item_id: int) -> Optional[Dict[str, Any]]:
-        """获取计划树形结构"""
-        item = self.get_item(item_id)
-        if not item:
-            return None
+    def query_items_page(self, parent_id: Optional[int] = None,
+                         category: Optional[str] = None,
+                         status: Optional[str] = None,
+                         page_size: int = 50,
+                         cursor: Optional[str] = None,
+                         decode_metadata: bool = True,
+                         fields: Optional[List[str]] = None) -> Dict[str, Any]:
+        """
+        分页查询计划项
         
-        # 递归获取子项
-        children = self.query_items(parent_id=item_id)
-        if children:
-            item['children'] = [self.get_tree(child['id']) for child in children]
+        Args:
+            fields: 只返回这些字段（id 总会包含）
         
-        return item
+        Returns:
+            {"items": [...], "next_cursor": 下一页游标，没有更多时为 None}
+        """
+        after = decode_cursor(cursor, "list") if cursor else None
+        # 游标需要 created_at，投影时一并查出，生成游标后再去掉
+        items = self.query_items(parent_id=parent_id, category=category, status=status,
+                                 after=after, limit=page_size + 1,
+                                 decode_metadata=decode_metadata,
+                                 fields=None if fields is None else [*fields, 'created_at'])
+        next_cursor = None
+        if len(items) > page_size:
+            items = items[:page_size]
+            next_cursor = encode_cursor("list", [items[-1]['created_at'], items[-1]['id']])
+        if fields is not None and 'created_at' not in fields:
+            for item in items:
+                del item['created_at']
+        return {"items": items, "next_cursor": next_cursor}
     
-    def update_item(self, item_id: int, **kwargs) -> bool:
-        """更新计划项"""
-        if not self.get_item(item_id):
-            return False
+    # 与 idx_open_deadline 的条件一致，查询带上它才能使用该部分索引
+    OPEN_DEADLINE_SQL = "deadline IS NOT NULL AND status NOT IN ('completed', 'cancelled')"
+    
+    def due_items(self, before: str, start: Optional[str] = None,
+                  limit: Optional[int] = None, decode_metadata: bool = True) -> list:
+        """
+        未完成（非 completed / cancelled）且截止时间在 [start, before) 内的计划项，按截止时间排序
         
-        # 获取更新前的信息用于日志
-        old_info = self.get_item(item_id)
+        只扫描 idx_open_deadline 部分索引，已完成的历史数据再多也不影响速度。
+        每项附带所属顶级计划 root_id / root_name。
+        """
+        query = f"SELECT * FROM plans WHERE {self.OPEN_DEADLINE_SQL} AND deadline < ?"
+        params = [before]
+        if start is not None:
+            query += " AND deadline >= ?"
+            params.append(start)
+        query += " ORDER BY deadline, id"
+        if limit is not None:
+            query += " LIMIT ?"
+            params.append(limit)
         
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
+        with self.connection() as conn:
+            items = [self._row_to_item(row, decode_metadata) for row in conn.execute(query, params)]
+            roots = self._root_names(conn, [item['id'] for item in items])
+        for item in items:
+            item['root_id'], item['root_name'] = roots.get(item['id'], (item['id'], item['name']))
+        return items
+    
+    AGENDA_FIELDS = ('scheduled_at', 'deadline')
+    
+    def agenda(self, start: str, end: str, status: Optional[str] = None,
+               category: Optional[str] = None, date_field: str = "scheduled_at",
+               page_size: int = 50, cursor: Optional[str] = None,
+               decode_metadata: bool = True) -> Dict[str, Any]:
+        """
+        跨所有计划按日期顺序列出 [start, end] 内的计划项，附带所属顶级计划
         
-        # 准备更新字段
-        update_fields = []
-        params = []
-        update_details = []
+        范围扫描走 (date_field, status) 索引（指定状态时走 (status, scheduled_at)），
+        按索引顺序 (日期, 状态, id) 返回，不需要排序，每页只回表 page_size 行。
+        
+        Args:
+            start: 起始日期（含），YYYY-MM-DD
+            end: 结束日期（含），YYYY-MM-DD
+            status: 只看该状态
+            category: 只看该类别
+            date_field: 按 scheduled_at 还是 deadline 排日程
+        
+        Returns:
+            {"items": [...（含 root_id / root_name）], "next_cursor": 下一页游标或 None}
+        """
+        if date_field not in self.AGENDA_FIELDS:
+            raise ValueError(f"date_field 只能是: {', '.join(self.AGENDA_FIELDS)}")
+        try:
+            start_date = datetime.strptime(start, "%Y-%m-%d")
+            end_date = datetime.strptime(end, "%Y-%m-%d")
+        except (TypeError, ValueError):
+            raise ValueError(f"日期格式应为 YYYY-MM-DD: {start} ~ {end}")
+        # 结束日当天带时间的记录（如 "2025-12-25 18:00"）也要包含
+        end_exclusive = (end_date + timedelta(days=1)).strftime("%Y-%m-%d")
+        
+        if cursor:
+            # 游标本身不早于起始日期；只保留行值条件，索引才能直接定位到游标处
+            query = f"SELECT * FROM plans WHERE ({date_field}, status, id) > (?, ?, ?) AND {date_field} < ?"
+            params = decode_cursor(cursor, "agenda", size=3) + [end_exclusive]
+        else:
+            query = f"SELECT * FROM plans WHERE {date_field} >= ? AND {date_field} < ?"
+            params = [start_date.strftime("%Y-%m-%d"), end_exclusive]
+        if status:
+            # 走 (status, scheduled_at) 索引：等值定位后按日期顺序读取
+            query += " AND status = ?"
+            params.append(status)
+        if category:
+            # 一元 + 避免规划器改用 idx_category 后对整个类别排序
+            query += " AND +category = ?"
+            params.append(category)
+        query += f" ORDER BY {date_field}, status, id LIMIT ?"
+        params.append(page_size + 1)
+        
+        with self.connection() as conn:
+            rows = conn.execute(query, params).fetchall()
+            items = [self._row_to_item(row, decode_metadata) for row in rows[:page_size]]
+            roots = self._root_names(conn, [item['id'] for item in items])
+        
+        for item in items:
+            item['root_id'], item['root_name'] = roots.get(item['id'], (item['id'], item['name']))
+        next_cursor = None
+        if len(rows) > page_size:
+            last = items[-1]
+            next_cursor = encode_cursor("agenda", [last[date_field], last['status'], last['id']])
+        return {"items": items, "next_cursor": next_cursor}
+    
+    def _root_names(self, conn, item_ids: List[int]) -> Dict[int, tuple]:
+        """沿父链向上找每个计划项所属的顶级计划 {item_id: (root_id, root_name)}"""
+        if not item_ids:
+            return {}
+        rows = conn.execute('''
+            WITH RECURSIVE up(item, id, parent_id) AS (
+                SELECT id, id, parent_id FROM plans
+                WHERE id IN (SELECT value FROM json_each(?))
+                UNION
+                SELECT up.item, p.id, p.parent_id FROM up JOIN plans p ON p.id = up.parent_id
+            )
+            SELECT up.item, p.id, p.name FROM up JOIN plans p ON p.id = up.id
+            WHERE up.parent_id IS NULL
+        ''', (json.dumps(item_ids),)).fetchall()
+        return {item: (root_id, name) for item, root_id, name in rows}
+    
+    SEARCH_COLUMNS = ('name', 'description', 'metadata')
+    
+    def search_items(self, keyword: str, limit: int = 50, offset: int = 0,
+                     columns: Optional[List[str]] = None,
+                     top_level_only: bool = False,
+                     decode_metadata: bool = True,
+                     fields: Optional[List[str]] = None) -> list:
+        """
+        全文搜索计划项，按相关度排序（name 权重最高）
+        
+        Args:
+            keyword: 关键词，空格分隔的多个词需同时匹配；以 * 结尾表示前缀
+            limit: 返回条数
+            offset: 跳过条数
+            columns: 搜索的列，默认 name/description/metadata
+            top_level_only: 只搜索顶级计划
+            fields: 只返回这些字段（id 总会包含）
+        """
+        rows = self._search(keyword, limit, offset=offset, columns=columns,
+                            top_level_only=top_level_only, decode_metadata=decode_metadata,
+                            fields=fields)
+        return [item for item, _ in rows]
+    
+    def search_items_page(self, keyword: str, page_size: int = 50,
+                          cursor: Optional[str] = None,
+                          columns: Optional[List[str]] = None,
+                          top_level_only: bool = False,
+                          decode_metadata: bool = True,
+                          fields: Optional[List[str]] = None) -> Dict[str, Any]:
+        """
+        分页全文搜索，游标记录上一页最后一条的排序键
+        
+        Returns:
+            {"items": [...], "next_cursor": 下一页游标，没有更多时为 None}
+        """
+        after = decode_cursor(cursor, "search") if cursor else None
+        rows = self._search(keyword, page_size + 1, after=after, columns=columns,
+                            top_level_only=top_level_only, decode_metadata=decode_metadata,
+                            fields=fields)
+        next_cursor = None
+        if len(rows) > page_size:
+            rows = rows[:page_size]
+            next_cursor = encode_cursor("search", rows[-1][1])
+        return {"items": [item for item, _ in rows], "next_cursor": next_cursor}
+    
+    def _search(self, keyword: str, limit: int, offset: int = 0,
+                after: Optional[list] = None,
+                columns: Optional[List[str]] = None,
+                top_level_only: bool = False,
+                decode_metadata: bool = True,
+                fields: Optional[List[str]] = None) -> list:
+        """执行搜索，返回 [(item, 排序键)]；after 为上一页最后一条的排序键"""
+        projection = self._columns(fields)
+        selected = ", ".join(f"p.{column}" for column in projection)
+        columns = list(columns or self.SEARCH_COLUMNS)
+        unknown = set(columns) - set(self.SEARCH_COLUMNS)
+        if unknown:
+            raise ValueError(f"不支持搜索的列: {', '.join(sorted(unknown))}")
         
-        for key, value in kwargs.items():
-            if key in ['name', 'description', 'category', 'parent_id', 
-                      'scheduled_at', 'deadline', 'status']:
-                update_fields.append(f"{key} = ?")
-                params.append(value)
+        # trigram 索引至少需要3个字符；两个字的词先用索引词表按三字组前缀取候选，
+        # 再和单个字的词一样用 LIKE 在候选结果上过滤（单个字的词没有索引可用）
+        fts_terms, bigram_terms, like_terms = [], [], []
+        for term in keyword.split():
+            prefix = term.endswith('*')
+            term = term.rstrip('*')
+            if not term:
+                continue
+            if self.fts_enabled and len(term) >= 3:
+                phrase = '"' + term.replace('"', '""') + '"'
+                fts_terms.append(phrase + ('*' if prefix else ''))
+                continue
+            if self.fts_enabled and len(term) == 2:
+                bigram_terms.append(term)
+            like_terms.append(term)
+        
+        where, params = [], []
+        for term in bigram_terms:
+            # trigram 分词器不区分 ASCII 大小写，词表中是小写；U+10FFFF 是最大的字符
+            column_filter = ""
+            if set(columns) != set(self.SEARCH_COLUMNS):
+                column_filter = f" AND col IN ({', '.join('?' * len(columns))})"
+            where.append("p.id IN (SELECT doc FROM plans_fts_terms "
+                         f"WHERE term >= ? AND term < ?{column_filter})")
+            params.extend([term.lower(), term.lower() + '\U0010ffff'])
+            if column_filter:
+                params.extend(columns)
+        if fts_terms:
+            # bm25 越小越相关；权重顺序与 SEARCH_COLUMNS 一致
+            query = (f"SELECT {selected}, bm25(plans_fts, 10.0, 5.0, 1.0) AS sort_key "
+                     "FROM plans_fts JOIN plans p ON p.id = plans_fts.rowid")
+            where.append("plans_fts MATCH ?")
+            column_filter = "{" + " ".join(columns) + "} : "
+            params.append(column_filter + "(" + " AND ".join(fts_terms) + ")")
+            order = "sort_key, id"
+            after_clause = "(sort_key, id) > (?, ?)"
+        else:
+            # 没有可用的索引词时按创建时间倒序
+            query = f"SELECT {selected}, p.created_at AS sort_key FROM plans p"
+            order = "sort_key DESC, id DESC"
+            after_clause = "(sort_key, id) < (?, ?)"
+        
+        for term in like_terms:
+            where.append("(" + " OR ".join(
+                f"p.{column} LIKE ? ESCAPE '\\'" for column in columns) + ")")
+            params.extend([self._like_pattern(term)] * len(columns))
+        
+        if top_level_only:
+            where.append("p.parent_id IS NULL")
+        
+        if where:
+            query += " WHERE " + " AND ".join(where)
+        query = f"SELECT * FROM ({query})"
+        if after is not None:
+            query += f" WHERE {after_clause}"
+            params.extend(after)
+        query += f" ORDER BY {order} LIMIT ? OFFSET ?"
+        params.extend([limit, offset])
+        
+        with self.connection() as conn:
+            rows = conn.execute(query, params).fetchall()
+        
+        # id 是投影的第一列
+        return [(self._row_to_item(row[:-1], decode_metadata, projection), [row[-1], row[0]])
+                for row in rows]
+    
+    @staticmethod
+    def _like_pattern(term: str) -> str:
+        """把 term 转成 LIKE 子串匹配模式（转义 %、_ 和转义符本身）"""
+        escaped = term.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+        return f"%{escaped}%"
+    
+    def get_tree(self, item_id: int,
+                 fields: Optional[List[str]] = None) -> Optional[Dict[str, Any]]:
+        """
+        获取计划树形结构
+        
+        一次递归CTE查询取出整棵子树，再在内存中单遍组装，
+        不做Python递归，层级再深也不会触发递归深度限制。
+        组装好的子树会被缓存，子树内任一节点变化时失效。
+        
+        Args:
+            fields: 每个节点只返回这些字段（id、parent_id 总会包含）；
+                    缓存中有完整子树时从缓存投影，否则只查这些列且不写入缓存
+        """
+        columns = self._columns(fields, required=('id', 'parent_id'))
+        cached = self.cache.get(("tree", item_id))
+        if cached is not None:
+            return cached.tree_to_dict(None if fields is None else columns)
+        
+        version = self.cache.version
+        with self.connection() as conn:
+            rows = conn.execute(SUBTREE_CTE + f'''
+                SELECT {", ".join(f"p.{column}" for column in columns)}
+                FROM plans p JOIN subtree s ON p.id = s.id
+                ORDER BY p.created_at, p.id
+            ''', (item_id,)).fetchall()
+            cacheable = fields is None and self._cacheable(conn)
+        
+        if not cacheable:
+            return self._assemble_tree(rows, item_id, columns)
+        
+        # 要缓存的子树用 PlanItem 组装
+        nodes = {row[0]: PlanItem(*row) for row in rows}
+        if item_id not in nodes:
+            return None
+        for parent_id, child_nodes in self._children_of(rows, item_id, nodes, columns).items():
+            nodes[parent_id].children = child_nodes
+        root = nodes[item_id]
+        self.cache.put(("tree", item_id), root, version, nodes=set(nodes))
+        return root.tree_to_dict()
+    
+    @staticmethod
+    def _children_of(rows, item_id: int, nodes: Dict[int, Any], columns: List[str]) -> Dict[int, list]:
+        """
+        按 rows 的顺序（创建时间，与 query_items 的子项顺序一致）收集每个父节点的子节点
+        
+        rows 的第一列是 id；nodes 为 id -> 节点，子树外的父ID（根的父计划）被忽略。
+        """
+        parent_index = columns.index('parent_id')
+        children = {}
+        for row in rows:
+            if row[0] != item_id and row[parent_index] in nodes:
+                children.setdefault(row[parent_index], []).append(nodes[row[0]])
+        return children
+    
+    def _assemble_tree(self, rows, item_id: int, columns: List[str]) -> Optional[Dict[str, Any]]:
+        """把子树的查询结果行单遍组装成字典树（迭代实现），根不在结果中时返回 None"""
+        nodes = {row[0]: self._row_to_item(row, columns=columns) for row in rows}
+        root = nodes.get(item_id)
+        if root is None:
+            return None
+        for parent_id, child_nodes in self._children_of(rows, item_id, nodes, columns).items():
+            nodes[parent_id]['children'] = child_nodes
+        return root
+    
+    def update_item(self, item_id: int, **kwargs) -> bool:
+        """
+        更新计划项
+        
+        更新前的值（审计、日志和进度汇总的增量）在同一个 BEGIN IMMEDIATE 事务中从表里读取，
+        不用缓存：并发更新同一计划时增量总是基于已提交的最新状态。
+        """
+        editable = ['name', 'description', 'category', 'parent_id',
+                    'scheduled_at', 'deadline', 'status', 'metadata']
+        
+        with self.transaction() as conn:
+            # 获取更新前的信息（写锁之下读取）
+            row = conn.execute(f"SELECT {', '.join(editable)} FROM plans WHERE id = ?",
+                               (item_id,)).fetchone()
+            if not row:
+                return False
+            old_info = dict(zip(editable, row))
+            if old_info['metadata']:
+                old_info['metadata'] = json_loads(old_info['metadata'])
+            
+            # 准备更新字段
+            update_fields = []
+            params = []
+            update_details = []
+            before, after = {}, {}
+            
+            for key, value in kwargs.items():
+                if key in editable:
+                    before[key] = old_info.get(key)
+                    after[key] = value
                 
-                # 记录更新详情
-                if key == 'status':
-                    update_details.append(f"状态: {old_info.get('status')} → {value}")
-                elif key == 'name':
-                    update_details.append(f"名称: {old_info.get('name')} → {value}")
-                elif key == 'scheduled_at':
-                    update_details.append(f"时间: {old_info.get('scheduled_at')} → {value}")
+                if key in ['name', 'description', 'category', 'parent_id', 
+                          'scheduled_at', 'deadline', 'status']:
+                    update_fields.append(f"{key} = ?")
+                    params.append(value)
                     
-            elif key == 'metadata':
-                update_fields.append("metadata = ?")
-                params.append(json.dumps(value) if value else None)
-        
-        if update_fields:
+                    # 记录更新详情
+                    if key == 'status':
+                        update_details.append(f"状态: {old_info.get('status')} → {value}")
+                    elif key == 'name':
+                        update_details.append(f"名称: {old_info.get('name')} → {value}")
+                    elif key == 'scheduled_at':
+                        update_details.append(f"时间: {old_info.get('scheduled_at')} → {value}")
+                        
+                elif key == 'metadata':
+                    update_fields.append("metadata = ?")
+                    params.append(json_dumps(value) if value else None)
+            
+            if not update_fields:
+                return True
+            
             update_fields.append("updated_at = CURRENT_TIMESTAMP")
             params.append(item_id)
-            
             query = f"UPDATE plans SET {', '.join(update_fields)} WHERE id = ?"
-            cursor.execute(query, params)
-            conn.commit()
             
-            # 记录更新日志
-            update_str = ", ".join(update_details)
-            log_msg = f"✏️ 计划更新成功 - ID:{item_id} {update_str}"
-            logger.info(log_msg)
-            print(log_msg)
+            old_status = old_info.get('status')
+            new_status = kwargs.get('status', old_status)
+            old_parent = old_info.get('parent_id')
+            new_parent = kwargs.get('parent_id', old_parent)
+            # 移动时整棵子树从旧祖先链移到新祖先链，否则只调整一次状态计数
+            if new_parent != old_parent:
+                self._apply_rollup(conn, old_parent,
+                                   self._subtree_delta(conn, item_id, old_status, -1))
+                conn.execute(query, params)
+                self._apply_rollup(conn, new_parent,
+                                   self._subtree_delta(conn, item_id, new_status, 1))
+            else:
+                conn.execute(query, params)
+                if new_status != old_status:
+                    self._apply_rollup(conn, old_parent, tuple(
+                        a + b for a, b in zip(self._status_delta(old_status, -1),
+                                              self._status_delta(new_status))))
+            self.audit("update", [(item_id, before, after, None)])
+            # 移动到新父计划下时，新父计划所在的子树也要失效
+            new_parent = kwargs.get('parent_id')
+            self._invalidate(item_ids=[item_id],
+                             parent_ids=[new_parent] if new_parent is not None else ())
+        
+        # 记录更新日志
+        update_str = ", ".join(update_details)
+        log_msg = f"✏️ 计划更新成功 - ID:{item_id} {update_str}"
+        logger.info(log_msg)
         
-        conn.close()
         return True
     
+    @staticmethod
+    def _shift_expr(column: str, modifier: str = ":shift") -> str:
+        """按 modifier（SQL表达式）平移日期的SQL表达式，保持原有格式（纯日期、T/空格分隔、是否带秒），无法解析的保持原值"""
+        layout = (f"CASE length({column}) WHEN 10 THEN '%Y-%m-%d' "
+                  f"WHEN 16 THEN '%Y-%m-%d' || substr({column}, 11, 1) || '%H:%M' "
+                  f"ELSE '%Y-%m-%d' || substr({column}, 11, 1) || '%H:%M:%S' END")
+        return f"COALESCE(strftime({layout}, {column}, {modifier}), {column})"
+    
+    def shift_subtree(self, root_id: int, days: int, dry_run: bool = False,
+                      preview_limit: int = 20) -> Optional[Dict[str, Any]]:
+        """
+        把计划及其全部子计划的 scheduled_at / deadline 平移 days 天（一条 UPDATE）
+        
+        Args:
+            root_id: 子树根ID
+            days: 平移天数，负数表示提前
+            dry_run: 只预览，不修改
+            preview_limit: 预览返回的条数
+        
+        Returns:
+            {"count": 子树计划数, "changed": 日期有变化的计划数, "preview": [...]}；
+            计划不存在时返回 None
+        """
+        params = {"root": root_id, "shift": f"{days:+d} days"}
+        
+        with self.transaction() as conn:
+            count, changed = conn.execute(
+                SUBTREE_CTE_NAMED + f'''
+                SELECT COUNT(*),
+                       SUM(scheduled_at IS NOT {self._shift_expr("scheduled_at")}
+                           OR deadline IS NOT {self._shift_expr("deadline")})
+                FROM plans WHERE id IN subtree
+                ''', params).fetchone()
+            if not count:
+                return None
+            
+            preview = [
+                dict(zip(("id", "name", "scheduled_at", "new_scheduled_at",
+                          "deadline", "new_deadline"), row))
+                for row in conn.execute(
+                    SUBTREE_CTE_NAMED + f'''
+                    SELECT id, name, scheduled_at, {self._shift_expr("scheduled_at")},
+                           deadline, {self._shift_expr("deadline")}
+                    FROM plans WHERE id IN subtree ORDER BY id LIMIT :limit
+                    ''', dict(params, limit=preview_limit))
+            ]
+            result = {"count": count, "changed": changed or 0, "preview": preview}
+            if dry_run or not days:
+                return result
+            
+            shifted_ids = [row[0] for row in conn.execute(
+                SUBTREE_CTE_NAMED + f'''
+                UPDATE plans SET scheduled_at = {self._shift_expr("scheduled_at")},
+                                 deadline = {self._shift_expr("deadline")},
+                                 updated_at = CURRENT_TIMESTAMP
+                WHERE id IN subtree
+                RETURNING id
+                ''', params)]
+            self.audit("shift", [(root_id, None, None, {"days": days, "count": len(shifted_ids)})])
+            self._invalidate(item_ids=shifted_ids)
+        
+        logger.info(f"📅 计划整体平移 - 根计划ID:{root_id} 天数:{days:+d} 计划数:{count}")
+        return result
+    
+    # 早于 :cutoff 且以四位年份开头的日期
+    OLD_DATE_SQL = "({column} < :cutoff AND {column} GLOB '[0-9][0-9][0-9][0-9]-*')"
+    
+    def fix_old_dates(self, year: str, chunk_size: int = 500, dry_run: bool = False,
+                      detail_limit: int = 10) -> Dict[str, Any]:
+        """
+        把早于 year 年的 scheduled_at / deadline 改到 year 年（月日和时间不变）
+        
+        每 chunk_size 行一个事务（一条 UPDATE），块与块之间其他写入可以穿插执行。
+        2月29日改到非闰年时由 SQLite 日期函数顺延为3月1日。
+        
+        Args:
+            year: 目标年份
+            chunk_size: 每个事务处理的行数
+            dry_run: 只用索引统计数量，不修改
+            detail_limit: 返回的修改明细条数
+        
+        Returns:
+            {"scheduled": 需修复的开始时间数, "deadline": 需修复的截止时间数,
+             "fixed": 修改的计划数, "chunks": 事务数, "details": [...]}
+        """
+        if not (len(str(year)) == 4 and str(year).isdigit()):
+            raise ValueError(f"无效的年份: {year}")
+        params = {"cutoff": f"{year}-01-01", "year": int(year)}
+        scheduled_old = self.OLD_DATE_SQL.format(column="scheduled_at")
+        deadline_old = self.OLD_DATE_SQL.format(column="deadline")
+        
+        with self.connection() as conn:
+            scheduled = conn.execute(f"SELECT COUNT(*) FROM plans WHERE {scheduled_old}", params).fetchone()[0]
+            deadline = conn.execute(f"SELECT COUNT(*) FROM plans WHERE {deadline_old}", params).fetchone()[0]
+        result = {"scheduled": scheduled, "deadline": deadline, "fixed": 0, "chunks": 0, "details": []}
+        if dry_run or not (scheduled or deadline):
+            return result
+        
+        def fixed(column):
+            modifier = f"(:year - CAST(substr({column}, 1, 4) AS INTEGER)) || ' years'"
+            old = self.OLD_DATE_SQL.format(column=column)
+            return f"CASE WHEN {old} THEN {self._shift_expr(column, modifier)} ELSE {column} END"
+        
+        last_id = 0
+        while True:
+            with self.transaction() as conn:
+                rows = conn.execute(
+                    f"SELECT id, name, scheduled_at, deadline FROM plans "
+                    f"WHERE ({scheduled_old} OR {deadline_old}) AND id > :last "
+                    f"ORDER BY id LIMIT :limit",
+                    dict(params, last=last_id, limit=chunk_size)).fetchall()
+                if not rows:
+                    break
+                ids = [row[0] for row in rows]
+                new_values = {row[0]: row[1:] for row in conn.execute(
+                    f"UPDATE plans SET scheduled_at = {fixed('scheduled_at')}, "
+                    f"deadline = {fixed('deadline')}, updated_at = CURRENT_TIMESTAMP "
+                    f"WHERE id IN (SELECT value FROM json_each(:ids)) "
+                    f"RETURNING id, scheduled_at, deadline",
+                    dict(params, ids=json.dumps(ids)))}
+                self.audit("fix_date", [
+                    (item_id, {"scheduled_at": old_s, "deadline": old_d},
+                     dict(zip(("scheduled_at", "deadline"), new_values[item_id])),
+                     {"year": str(year)})
+                    for item_id, _, old_s, old_d in rows
+                ])
+                self._invalidate(item_ids=ids)
+            
+            for item_id, name, old_s, old_d in rows[:detail_limit - len(result["details"])]:
+                new_s, new_d = new_values[item_id]
+                result["details"].append({"id": item_id, "name": name,
+                                          "scheduled_at": old_s, "new_scheduled_at": new_s,
+                                          "deadline": old_d, "new_deadline": new_d})
+            result["fixed"] += len(rows)
+            result["chunks"] += 1
+            last_id = ids[-1]
+        
+        logger.info(f"🔧 日期修复完成 - 修复计划数:{result['fixed']} 目标年份:{year} 事务数:{result['chunks']}")
+        return result
+    
+    BATCH_FIELDS = ('status', 'scheduled_at', 'deadline')
+    
+    def update_items(self, item_ids: Optional[List[int]] = None,
+                     root_id: Optional[int] = None,
+                     where_status: Optional[str] = None,
+                     **fields) -> Dict[int, str]:
+        """
+        在一个事务中批量更新多个计划项（一条 UPDATE，一条审计记录）
+        
+        更新前的状态和父计划在同一个 BEGIN IMMEDIATE 事务中读取，
+        读取时已持有写锁，并发写入不会让进度汇总的增量重复计算。
+        
+        Args:
+            item_ids: 要更新的ID列表
+            root_id: 或者给出子树根，更新整棵子树（含根）
+            where_status: 只更新当前为该状态的计划项
+            fields: 要设置的字段，支持 status / scheduled_at / deadline
+        
+        Returns:
+            {id: "updated" | "not_found" | "skipped"}，skipped 表示不满足 where_status
+        """
+        unknown = set(fields) - set(self.BATCH_FIELDS)
+        if unknown or not fields:
+            raise ValueError(f"批量更新只支持字段: {', '.join(self.BATCH_FIELDS)}")
+        if (item_ids is None) == (root_id is None):
+            raise ValueError("item_ids 和 root_id 必须且只能提供一个")
+        
+        columns = "id, parent_id, status, scheduled_at, deadline"
+        with self.transaction() as conn:
+            if root_id is not None:
+                rows = conn.execute(
+                    SUBTREE_CTE + f"SELECT {columns} FROM plans WHERE id IN subtree ORDER BY id",
+                    (root_id,)).fetchall()
+                requested = [root_id] if not rows else [row[0] for row in rows]
+            else:
+                requested = list(dict.fromkeys(item_ids))
+                # json_each 让任意长度的ID列表只占一个绑定参数
+                rows = conn.execute(
+                    f"SELECT {columns} FROM plans WHERE id IN (SELECT value FROM json_each(?))",
+                    (json.dumps(requested),)).fetchall()
+            
+            found = {row[0]: row for row in rows}
+            targets = [row for row in rows if where_status is None or row[2] == where_status]
+            target_ids = [row[0] for row in targets]
+            results = {
+                item_id: ("not_found" if item_id not in found else
+                          "updated" if where_status is None or found[item_id][2] == where_status
+                          else "skipped")
+                for item_id in requested
+            }
+            if not target_ids:
+                return results
+            
+            assignments = ", ".join(f"{field} = ?" for field in fields)
+            conn.execute(
+                f"UPDATE plans SET {assignments}, updated_at = CURRENT_TIMESTAMP "
+                f"WHERE id IN (SELECT value FROM json_each(?))",
+                (*fields.values(), json.dumps(target_ids)))
+            
+            # 状态变化按父计划合并后沿祖先链各更新一次
+            if 'status' in fields:
+                deltas = {}
+                for item_id, parent_id, old_status, _, _ in targets:
+                    if parent_id is None or old_status == fields['status']:
+                        continue
+                    change = zip(self._status_delta(old_status, -1),
+                                 self._status_delta(fields['status']))
+                    current = deltas.get(parent_id, (0, 0, 0, 0))
+                    deltas[parent_id] = tuple(c + a + b for c, (a, b) in zip(current, change))
+                for parent_id, delta in deltas.items():
+                    self._apply_rollup(conn, parent_id, delta)
+            
+            position = {'status': 2, 'scheduled_at': 3, 'deadline': 4}
+            self.audit("update_batch", [(
+                root_id,
+                {str(row[0]): {field: row[position[field]] for field in fields} for row in targets},
+                fields,
+                {"count": len(target_ids), "ids": target_ids}
+            )])
+            self._invalidate(item_ids=target_ids)
+        
+        changes = ", ".join(f"{field}={value}" for field, value in fields.items())
+        logger.info(f"✏️ 批量更新成功 - 数量:{len(target_ids)} {changes}")
+        return results
+    
     def delete_item(self, item_id: int) -> bool:
-        """删除计划项（级联删除子项）"""
-        # 获取删除前的信息用于日志
-        plan_info = self.get_item(item_id)
-        if not plan_info:
-            return False
+        """删除计划项（级联删除子项），计划不存在时返回 False"""
+        return self.delete_tree(item_id) is not None
+    
+    def delete_tree(self, item_id: int, dry_run: bool = False,
+                    fields: Optional[List[str]] = None) -> Optional[Dict[str, Any]]:
+        """
+        删除计划及其全部子计划；dry_run=True 时只预览（preview_delete_plan）
         
-        # 统计将被删除的计划数量
-        total_count = self.get_plan_tree_count(item_id)
+        一次递归CTE取出整棵子树，同时得到数量和计划树；删除时在同一个事务中
+        按ID集合删除全部行，不依赖外键级联。取快照和删除在同一个 BEGIN IMMEDIATE
+        事务中完成；整棵子树只写一条审计记录（before 为根计划，其余计划放在
+        before["descendants"] 中），它同时是 undo_delete 恢复时使用的墓碑。
         
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
+        Args:
+            fields: 返回的计划树每个节点只包含这些字段（id、parent_id 总会包含）
         
-        # 启用外键约束（确保级联删除生效）
-        cursor.execute("PRAGMA foreign_keys = ON")
+        Returns:
+            {"plan_id", "count", "deleted", "tree"}，计划不存在时为 None
+        """
+        columns = self._columns(fields, required=('id', 'parent_id'))
+        # 删除时要把完整的行写入审计记录，预览只查需要的列
+        selected = columns if dry_run else self.COLUMNS
+        query = SUBTREE_CTE + f'''
+            SELECT {", ".join(f"p.{column}" for column in selected)}
+            FROM plans p JOIN subtree s ON p.id = s.id
+            ORDER BY p.created_at, p.id
+        '''
+        if dry_run:
+            with self.connection() as conn:
+                rows = conn.execute(query, (item_id,)).fetchall()
+            tree = self._assemble_tree(rows, item_id, columns)
+            if tree is None:
+                return None
+            return {"plan_id": item_id, "count": len(rows), "deleted": False, "tree": tree}
         
-        cursor.execute("DELETE FROM plans WHERE id = ?", (item_id,))
-        affected_rows = cursor.rowcount
+        with self.transaction() as conn:
+            rows = conn.execute(query, (item_id,)).fetchall()
+            snapshots = [dict(zip(self.COLUMNS, row)) for row in rows]
+            root = next((snapshot for snapshot in snapshots if snapshot['id'] == item_id), None)
+            if root is None:
+                return None
+            
+            subtree_ids = [row[0] for row in rows]
+            # 整棵子树对祖先汇总的贡献直接由取出的行算出
+            delta = tuple(-sum(values) for values in zip(
+                *(self._status_delta(snapshot['status']) for snapshot in snapshots)))
+            self._apply_rollup(conn, root['parent_id'], delta)
+            
+            id_set = json.dumps(subtree_ids)
+            conn.execute("DELETE FROM plan_rollups WHERE plan_id IN (SELECT value FROM json_each(?))",
+                         (id_set,))
+            conn.execute("DELETE FROM plans WHERE id IN (SELECT value FROM json_each(?))", (id_set,))
+            # 只写根计划一条记录，删除大计划树时不会刷满操作日志
+            descendants = [snapshot for snapshot in snapshots if snapshot['id'] != item_id]
+            self.audit("delete", [(item_id, {**root, "descendants": descendants}, None,
+                                   {"cascade": len(rows)})])
+            self._invalidate(item_ids=subtree_ids)
         
-        conn.commit()
-        conn.close()
+        if fields is not None:
+            positions = [self.COLUMNS.index(column) for column in columns]
+            rows = [tuple(row[position] for position in positions) for row in rows]
+        tree = self._assemble_tree(rows, item_id, columns)
         
-        # 记录删除日志
-        log_msg = f"🗑️ 计划删除成功 - ID:{item_id} 名称:{plan_info['name']} 类别:{plan_info['category']} 共删除:{total_count}个计划"
-        logger.info(log_msg)
-        print(log_msg)
+        logger.info(f"🗑️ 计划删除成功 - ID:{item_id} 名称:{root['name']} "
+                    f"类别:{root['category']} 共删除:{len(rows)}个计划")
+        return {"plan_id": item_id, "count": len(rows), "deleted": True, "tree": tree}
+    
+    def undo_delete(self, item_id: int) -> Dict[str, Any]:
+        """
+        撤销最近一次对 item_id 的删除：用删除时写入的审计记录（墓碑）按原ID恢复整棵子树
+        
+        计划ID是自增且不复用的，恢复后与删除前完全一致（含创建时间、状态和元数据）。
         
-        return affected_rows > 0
+        Returns:
+            {"plan_id", "name", "count", "audit_id"}
+        
+        Raises:
+            ValueError: 没有可撤销的删除记录、计划已存在或父计划已不存在
+        """
+        with self.transaction() as conn:
+            row = conn.execute('''
+                SELECT id, before, detail FROM plan_audit
+                WHERE item_id = ? AND op = 'delete' AND json_extract(detail, '$.cascade') IS NOT NULL
+                ORDER BY id DESC LIMIT 1
+            ''', (item_id,)).fetchone()
+            if row is None:
+                raise ValueError(f"没有计划 {item_id} 的删除记录")
+            audit_id, before, detail = row
+            count = json_loads(detail)['cascade']
+            root = json_loads(before)
+            descendants = root.pop('descendants', [])
+            if len(descendants) != count - 1:
+                raise ValueError(f"计划 {item_id} 的删除记录不完整，无法撤销")
+            snapshots = [root, *descendants]
+            
+            if conn.execute("SELECT 1 FROM plans WHERE id = ?", (item_id,)).fetchone():
+                raise ValueError(f"计划 {item_id} 已存在，不需要撤销删除")
+            parent_id = root['parent_id']
+            if parent_id is not None and not conn.execute(
+                    "SELECT 1 FROM plans WHERE id = ?", (parent_id,)).fetchone():
+                raise ValueError(f"父计划 {parent_id} 已不存在，请先恢复父计划")
+            
+            # 外键检查推迟到提交时，子计划可以先于父计划写入
+            conn.execute("PRAGMA defer_foreign_keys = ON")
+            conn.executemany(
+                f"INSERT INTO plans ({', '.join(self.COLUMNS)}) VALUES ({', '.join('?' * len(self.COLUMNS))})",
+                [tuple(snapshot[column] for column in self.COLUMNS) for snapshot in snapshots])
+            
+            rollups = self._subtree_rollups(snapshots, item_id)
+            conn.executemany(
+                "INSERT INTO plan_rollups (plan_id, total, completed, in_progress, cancelled) "
+                "VALUES (?, ?, ?, ?, ?)",
+                [(plan_id, *counts) for plan_id, counts in rollups.items() if counts[0]])
+            own = self._status_delta(root['status'])
+            self._apply_rollup(conn, parent_id, tuple(a + b for a, b in zip(own, rollups[item_id])))
+            
+            restored_ids = [snapshot['id'] for snapshot in snapshots]
+            self.audit("undo_delete", [(item_id, None, None, {"count": count, "audit_id": audit_id})])
+            self._invalidate(item_ids=restored_ids, parent_ids=[parent_id] if parent_id else ())
+        
+        logger.info(f"♻️ 撤销删除成功 - ID:{item_id} 名称:{root['name']} 共恢复:{count}个计划")
+        return {"plan_id": item_id, "name": root['name'], "count": count, "audit_id": audit_id}
+    
+    def _subtree_rollups(self, snapshots: List[Dict[str, Any]], item_id: int) -> Dict[int, tuple]:
+        """由子树的全部行算出其中每个计划的汇总 (total, completed, in_progress, cancelled)（自底向上单遍）"""
+        children = {}
+        for snapshot in snapshots:
+            if snapshot['id'] != item_id:
+                children.setdefault(snapshot['parent_id'], []).append(snapshot)
+        
+        order = [snapshot for snapshot in snapshots if snapshot['id'] == item_id]
+        for snapshot in order:
+            order.extend(children.get(snapshot['id'], ()))
+        
+        rollups = {snapshot['id']: (0, 0, 0, 0) for snapshot in order}
+        for snapshot in reversed(order[1:]):
+            contribution = self._status_delta(snapshot['status'])
+            parent_rollup = rollups[snapshot['parent_id']]
+            rollups[snapshot['parent_id']] = tuple(
+                a + b + c for a, b, c in zip(parent_rollup, contribution, rollups[snapshot['id']]))
+        return rollups
     
     def get_plan_tree_count(self, item_id: int) -> int:
-        """获取计划及其所有子计划的总数"""
-        item = self.get_item(item_id)
-        if not item:
-            return 0
+        """获取计划及其所有子计划的总数（包括计划本身，不存在时为0）"""
+        cached = self.cache.tree_size(item_id)
+        if cached is not None:
+            return cached
+        
+        with self.connection() as conn:
+            row = conn.execute(SUBTREE_CTE + "SELECT COUNT(*) FROM subtree",
+                               (item_id,)).fetchone()
+        return row[0]
+
+    def snapshot(self, target_path: str, pages: Optional[int] = None,
+                 sleep: float = 0.005, compact: bool = False) -> Dict[str, Any]:
+        """
+        生成数据库的一致性二进制快照，服务可以继续读写
+        
+        先写入临时文件，完成后原子替换为 target_path，中途失败不会留下残缺快照。
+        
+        Args:
+            target_path: 快照文件路径
+            pages: 每步复制的页数；None 时 WAL 模式一次复制（读事务不阻塞写入），
+                   其他日志模式每步 1024 页，步与步之间释放锁
+            sleep: 两步之间的间隔秒数，让写入可以穿插执行
+            compact: 使用 VACUUM INTO 生成整理压缩后的快照（同样只持有读事务）
+        
+        Returns:
+            {"path", "size", "pages", "elapsed", "method"}
+        """
+        tmp_path = target_path + ".tmp"
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        
+        started = time.perf_counter()
+        copied = {"pages": 0}
+        try:
+            with self.connection() as conn:
+                if compact:
+                    conn.execute("VACUUM INTO ?", (tmp_path,))
+                    method = "vacuum_into"
+                else:
+                    if pages is None:
+                        wal = conn.execute("PRAGMA journal_mode").fetchone()[0] == "wal"
+                        pages = -1 if wal else 1024
+                    
+                    def progress(status, remaining, total):
+                        copied["pages"] = total
+                    
+                    target = sqlite3.connect(tmp_path)
+                    try:
+                        conn.backup(target, pages=pages, progress=progress, sleep=sleep)
+                    finally:
+                        target.close()
+                    method = "backup_api"
+            os.replace(tmp_path, target_path)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+        
+        return {
+            "path": target_path,
+            "size": os.path.getsize(target_path),
+            "pages": copied["pages"],
+            "elapsed": time.perf_counter() - started,
+            "method": method,
+        }
+    
+    def export_rows(self, batch_size: int = 1000):
+        """
+        按ID顺序逐批读取 plans 表的原始行（生成器），内存占用与表大小无关
+        
+        整个遍历在同一个读事务中完成，WAL模式下得到一致的快照且不阻塞写入。
+        """
+        with self.connection() as conn:
+            cursor = conn.execute('''
+                SELECT id, name, description, category, parent_id, scheduled_at,
+                       deadline, status, metadata, created_at, updated_at
+                FROM plans ORDER BY id
+            ''')
+            while True:
+                rows = cursor.fetchmany(batch_size)
+                if not rows:
+                    break
+                yield from rows
+    
+    def import_rows(self, rows, batch_size: int = 1000, replace: bool = False) -> Dict[str, int]:
+        """
+        按原ID批量导入计划（用于恢复备份），每 batch_size 行一个事务
+        
+        导入期间关闭外键检查，子计划可以先于父计划写入；全部导入后再检查
+        父子关系，找不到父计划的记录会被统计为 orphans。
+        
+        Args:
+            rows: 可迭代的行，每行是 COLUMNS 顺序的元组或包含这些键的字典
+            replace: True 时先清空现有计划；False 时跳过ID已存在的记录
         
-        count = 1  # 包括父计划本身
-        children = self.query_items(parent_id=item_id)
+        Returns:
+            {"read": 读取行数, "inserted": 写入行数, "skipped": 跳过行数, "orphans": 孤立行数}
+        """
+        verb = "INSERT" if replace else "INSERT OR IGNORE"
+        sql = f"{verb} INTO plans ({', '.join(self.COLUMNS)}) VALUES ({', '.join('?' * len(self.COLUMNS))})"
+        stats = {"read": 0, "inserted": 0, "skipped": 0, "orphans": 0}
         
-        for child in children:
-            count += self.get_plan_tree_count(child['id'])
+        def flush(conn, batch):
+            with self.transaction():
+                # executemany 的 rowcount 是各行变更数之和，不含触发器的写入
+                inserted = conn.executemany(sql, batch).rowcount
+            stats["inserted"] += inserted
+            stats["skipped"] += len(batch) - inserted
+        
+        with self.connection() as conn:
+            conn.execute("PRAGMA foreign_keys = OFF")
+            try:
+                if replace:
+                    with self.transaction():
+                        conn.execute("DELETE FROM plans")
+                
+                batch = []
+                for row in rows:
+                    if isinstance(row, dict):
+                        row = tuple(row.get(column) for column in self.COLUMNS)
+                    batch.append(row)
+                    stats["read"] += 1
+                    if len(batch) >= batch_size:
+                        flush(conn, batch)
+                        batch = []
+                if batch:
+                    flush(conn, batch)
+                
+                stats["orphans"] = len(conn.execute("PRAGMA foreign_key_check(plans)").fetchall())
+                with self.transaction():
+                    self._rebuild_rollups(conn.cursor())
+            finally:
+                conn.execute("PRAGMA foreign_keys = ON")
+        
+        self.audit("restore", [(None, None, None, dict(stats, replace=replace))])
+        self.invalidate_cache()
+        return stats
+    
+    @staticmethod
+    def _audit_json(value) -> Optional[str]:
+        return json_dumps(value, default=str) if value is not None else None
+    
+    def audit(self, op: str, entries):
+        """
+        批量写入审计记录（一次 executemany）
         
-        return count
+        在事务中调用时随外层事务一起提交或回滚，变更和审计记录不会不一致。
+        
+        Args:
+            op: 操作类型，如 create、update、delete、cancel_travel、fix_date
+            entries: 可迭代的 (item_id, before, after, detail)，后三项是字典或 None
+        """
+        rows = [
+            (op, item_id, self._audit_json(before), self._audit_json(after),
+             self._audit_json(detail))
+            for item_id, before, after, detail in entries
+        ]
+        if not rows:
+            return
+        with self.transaction() as conn:
+            conn.executemany(
+                "INSERT INTO plan_audit (op, item_id, before, after, detail) VALUES (?, ?, ?, ?, ?)",
+                rows)
+            # 提交后再递增一次，提交前读到旧数据的计算结果不会被当作最新
+            self._bump_write_version()
+            self.pool.after_transaction(self._bump_write_version)
+    
+    def _bump_write_version(self):
+        self.write_version += 1
+    
+    def query_audit(self, item_id: Optional[int] = None, op: Optional[str] = None,
+                    since: Optional[str] = None, until: Optional[str] = None,
+                    page_size: int = 50, cursor: Optional[str] = None) -> Dict[str, Any]:
+        """
+        按条件分页查询审计记录，最新的在前
+        
+        Args:
+            item_id: 只看某个计划项
+            op: 只看某类操作
+            since: 起始时间（含），如 "2025-01-01" 或 "2025-01-01 08:00"
+            until: 截止时间（不含）
+            cursor: 上一页返回的 next_cursor
+        
+        Returns:
+            {"entries": [...], "next_cursor": 下一页游标，没有更多时为 None}
+        """
+        query = "SELECT id, ts, op, item_id, before, after, detail FROM plan_audit WHERE 1=1"
+        params = []
+        
+        if item_id is not None:
+            query += " AND item_id = ?"
+            params.append(item_id)
+        if op:
+            query += " AND op = ?"
+            params.append(op)
+        if since:
+            query += " AND ts >= ?"
+            params.append(since)
+        if until:
+            query += " AND ts < ?"
+            params.append(until)
+        if cursor:
+            query += " AND id < ?"
+            params.append(decode_cursor(cursor, "audit", size=1)[0])
+        
+        query += " ORDER BY id DESC LIMIT ?"
+        params.append(page_size + 1)
+        
+        with self.connection() as conn:
+            rows = conn.execute(query, params).fetchall()
+        
+        entries = []
+        for audit_id, ts, entry_op, entry_item, before, after, detail in rows[:page_size]:
+            entries.append({
+                "id": audit_id, "ts": ts, "op": entry_op, "item_id": entry_item,
+                "before": json_loads(before) if before else None,
+                "after": json_loads(after) if after else None,
+                "detail": json_loads(detail) if detail else None,
+            })
+        next_cursor = encode_cursor("audit", [entries[-1]["id"]]) if len(rows) > page_size else None
+        return {"entries": entries, "next_cursor": next_cursor}
+
+class MemoryDB(SQLiteDB):
+    """
+    进程内内存存储引擎（测试和基准用），关闭后数据即丢弃
+
+    使用共享缓存的命名内存数据库，连接池中的连接看到同一份数据；
+    另外保留一个空闲连接，避免连接全部关闭时内存数据库被释放。
+    共享缓存按表加锁，锁冲突不会走 busy_timeout 等待，所以默认只用一个连接。
+    """
+
+    _names = itertools.count(1)
+
+    def __init__(self, name: Optional[str] = None, pool_size: int = 1,
+                 profile: str = "ephemeral", cache_size: int = 1024):
+        name = name or f"plans-{os.getpid()}-{next(self._names)}"
+        uri = f"file:{name}?mode=memory&cache=shared"
+        self._keeper = sqlite3.connect(uri, uri=True, check_same_thread=False)
+        super().__init__(uri, pool_size=pool_size, profile=profile, cache_size=cache_size)
+
+    def close(self):
+        super().close()
+        self._keeper.close()
+
+# 存储后端：名称 -> 引擎类
+STORAGE_BACKENDS = {
+    "sqlite": SQLiteDB,
+    "memory": MemoryDB,
+}
+
+def open_store(backend: str = "sqlite", **kwargs) -> PlanStore:
+    """
+    按名称创建存储引擎
+
+    Args:
+        backend: STORAGE_BACKENDS 中的名称
+        kwargs: 传给引擎构造函数；memory 后端忽略 db_path
+    """
+    if backend not in STORAGE_BACKENDS:
+        raise ValueError(
+            f"未知的存储后端: {backend}，可选: {', '.join(STORAGE_BACKENDS)}")
+    if backend == "memory":
+        kwargs.pop("db_path", None)
+    return STORAGE_BACKENDS[backend](**kwargs)
 
 # 创建数据库实例
-db = SQLiteDB()
+db = open_store(
+    os.environ.get("PLAN_DB_BACKEND", "sqlite"),
+    db_path=os.environ.get("PLAN_DB_PATH", "plans.db"),
+    pool_size=int(os.environ.get("PLAN_DB_POOL_SIZE", "5")),
+    profile=os.environ.get("PLAN_DB_PROFILE", "balanced"),
+    cache_size=int(os.environ.get("PLAN_DB_CACHE_SIZE", "1024"))
+)
 
 # 创建 MCP server
 mcp = FastMCP("PlanManager", json_response=True)
 
-@mcp.tool()
+# 工具执行线程池
+class ToolRunner:
+    """
+    在有界线程池中执行阻塞的工具函数
+    
+    SQLite 和文件读写都是阻塞调用，直接在事件循环里执行会让一个慢请求
+    （例如大计划的 get_plan_details 或 backup_plans）卡住所有其他请求。
+    sqlite3 在执行SQL时会释放GIL，WAL模式下多个读请求可以真正并行。
+    """
+    
+    def __init__(self, max_workers: int):
+        if max_workers < 1:
+            raise ValueError("工作线程数必须大于 0")
+        self.max_workers = max_workers
+        self.executor = ThreadPoolExecutor(max_workers=max_workers,
+                                           thread_name_prefix="plan-tool")
+    
+    async def run(self, func, /, *args, **kwargs):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(
+            self.executor, functools.partial(func, *args, **kwargs))
+    
+    def shutdown(self):
+        self.executor.shutdown(wait=True)
+
+# 默认与连接池一样大，每个工作线程都能拿到自己的连接
+tool_runner = ToolRunner(
+    max_workers=int(os.environ.get("PLAN_TOOL_WORKERS", str(db.pool.size)))
+)
+
+class DueQueue:
+    """
+    后台定时预计算的到期队列：逾期计划项和 horizon_days 天内到期的计划项
+    
+    快照记录计算时的日期和 db.write_version；之后有任何变更或跨天就视为过期，
+    工具改为直接查询数据库，所以不会返回过期的结果。
+    """
+    
+    MAX_ITEMS = 500
+    
+    def __init__(self, db: "SQLiteDB", interval: float, horizon_days: int = 7):
+        self.db = db
+        self.interval = interval
+        self.horizon_days = horizon_days
+        self.refreshes = 0
+        self._snapshot = None
+        self._stop = threading.Event()
+        self._thread = None
+    
+    @staticmethod
+    def _today() -> str:
+        return datetime.now().strftime("%Y-%m-%d")
+    
+    def refresh(self):
+        """重新计算快照"""
+        version = self.db.write_version
+        today = self._today()
+        horizon = (datetime.now() + timedelta(days=self.horizon_days + 1)).strftime("%Y-%m-%d")
+        upcoming = self.db.due_items(before=horizon, start=today, limit=self.MAX_ITEMS)
+        self._snapshot = {
+            "version": version,
+            "day": today,
+            "computed_at": datetime.now().strftime("%H:%M:%S"),
+            "overdue": self.db.due_items(before=today, limit=self.MAX_ITEMS),
+            "upcoming": upcoming,
+            "deadlines": [item['deadline'] for item in upcoming],
+        }
+        self.refreshes += 1
+    
+    def _fresh_snapshot(self):
+        snapshot = self._snapshot
+        if (snapshot is None or snapshot["version"] != self.db.write_version
+                or snapshot["day"] != self._today()):
+            return None
+        return snapshot
+    
+    def overdue(self, limit: int):
+        """逾期计划项；快照不可用时返回 None"""
+        snapshot = self._fresh_snapshot()
+        if snapshot is None:
+            return None
+        return snapshot["overdue"][:limit], snapshot["computed_at"]
+    
+    def due_soon(self, days: int, limit: int):
+        """days 天内到期的计划项；超出预计算范围或快照不可用时返回 None"""
+        snapshot = self._fresh_snapshot()
+        if snapshot is None or days > self.horizon_days:
+            return None
+        cutoff = (datetime.now() + timedelta(days=days + 1)).strftime("%Y-%m-%d")
+        end = bisect.bisect_left(snapshot["deadlines"], cutoff)
+        return snapshot["upcoming"][:min(end, limit)], snapshot["computed_at"]
+    
+    def start(self):
+        if self.interval <= 0 or self._thread is not None:
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="plan-due-queue", daemon=True)
+        self._thread.start()
+    
+    def _run(self):
+        while True:
+            # 快照仍然有效时跳过，空闲时不反复查询数据库
+            if self._fresh_snapshot() is None:
+                try:
+                    self.refresh()
+                except Exception as e:
+                    logger.warning(f"到期队列刷新失败: {e}")
+            if self._stop.wait(self.interval):
+                break
+    
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+# PLAN_DUE_REFRESH_SECONDS > 0 时在后台定时预计算到期队列
+due_queue = DueQueue(
+    db,
+    interval=float(os.environ.get("PLAN_DUE_REFRESH_SECONDS", "0")),
+    horizon_days=int(os.environ.get("PLAN_DUE_HORIZON_DAYS", "7"))
+)
+
+# 结构化返回类型：format="json"（默认）时工具返回这些字典，format="text" 时返回给人看的文本
+RESPONSE_FORMATS = ("json", "text")
+
+class Progress(TypedDict):
+    total: int
+    completed: int
+    in_progress: int
+    cancelled: int
+    pending: int
+    percent: float
+
+class PlanRecord(TypedDict, total=False):
+    id: int
+    name: str
+    description: Optional[str]
+    category: Optional[str]
+    parent_id: Optional[int]
+    scheduled_at: Optional[str]
+    deadline: Optional[str]
+    status: str
+    metadata: Optional[Dict[str, Any]]
+    created_at: str
+    updated_at: str
+    progress: Progress             # list_plans / get_plan_details
+    root_id: int                   # get_agenda / overdue_items / due_soon：所属顶级计划
+    root_name: str
+    children: List["PlanRecord"]   # 计划树
+
+class PlanPage(TypedDict):
+    items: List[PlanRecord]
+    next_cursor: Optional[str]
+
+class DueList(TypedDict):
+    items: List[PlanRecord]
+    source: str                    # "queue" 预计算队列 / "live" 实时查询
+    computed_at: Optional[str]
+
+class DeleteResult(TypedDict):
+    plan_id: int
+    count: int                     # 删除（预览时为将删除）的计划数，含主计划
+    deleted: bool
+    tree: PlanRecord
+
+def _tool_result(result):
+    """
+    工具返回字典时作为结构化结果：structuredContent 直接使用该字典，文本内容为紧凑JSON
+    
+    不声明 outputSchema：出错时工具返回文本，且逐次按模型校验整棵树的开销和编码本身相当。
+    协议层用 pydantic_core 发送 structuredContent，嵌套超过约 255 层（约 127 层计划）会失败；
+    这时只发送标准库编码的文本。orjson 的嵌套上限与之相同，编码出错即可判断，
+    其他编码器再用 pydantic_core 确认一次。
+    """
+    if not isinstance(result, dict):
+        return result
+    try:
+        text = json_codec.dumps(result, str)
+        if json_codec.name != "orjson":
+            pydantic_core.to_json(result, fallback=str)
+    except (TypeError, ValueError):
+        text = _stdlib_codec().dumps(result, str)
+        return CallToolResult(content=[TextContent(type="text", text=text)])
+    return CallToolResult(content=[TextContent(type="text", text=text)],
+                          structuredContent=result)
+
+def offloaded_tool(func):
+    """
+    注册为MCP工具，由 tool_runner 在工作线程中执行
+    
+    注册的是异步包装函数（参数和文档通过 functools.wraps 继承），
+    模块中的名字仍然指向原来的同步函数，方便脚本和测试直接调用。
+    返回字符串的工具只发送文本，不再重复一份 {"result": 文本} 结构化内容。
+    """
+    @functools.wraps(func)
+    async def run_in_worker(**kwargs):
+        return _tool_result(await tool_runner.run(func, **kwargs))
+    
+    mcp.tool(structured_output=False)(run_in_worker)
+    return func
+
+STATUS_ICONS = {"pending": "⏳", "in_progress": "🔄", "completed": "✅", "cancelled": "❌"}
+
+# _format_tree 用到的字段，文本输出时 get_tree 只查这些列
+TREE_TEXT_FIELDS = ['name', 'status', 'scheduled_at']
+
+def _format_tree(root: Dict[str, Any]) -> str:
+    """计划树的缩进文本视图"""
+    # 用显式栈代替递归，深层级的计划也不会超出递归深度限制
+    lines = []
+    stack = [(root, 0)]
+    while stack:
+        item, level = stack.pop()
+        indent = "  " * level
+        status_icon = STATUS_ICONS.get(item.get('status', 'pending'), "📋")
+        
+        line = f"{indent}{status_icon} [{item['id']}] {item['name']}"
+        
+        if item.get('scheduled_at'):
+            line += f" 📅 {item['scheduled_at']}"
+        
+        line += f" ({item.get('status', 'pending')})"
+        lines.append(line)
+        
+        for child in reversed(item.get('children', [])):
+            stack.append((child, level + 1))
+    
+    return "\n".join(lines)
+
+@offloaded_tool
 def create_plan(
     name: str,
     description: str | None = None,
@@ -344,7 +2716,7 @@ def create_plan(
     )
     return f"Plan created successfully. ID: {item_id}"
 
-@mcp.tool()
+@offloaded_tool
 def add_step(
     plan_id: int,
     name: str,
@@ -363,7 +2735,7 @@ def add_step(
         元数据：用于额外数据的JSON字符串。
     """
     # Verify parent exists
-    parent = db.get_item(plan_id)
+    parent = db.get_item(plan_id, fields=['category'])
     if not parent:
         return f"Error: Plan with ID {plan_id} not found."
 
@@ -386,7 +2758,7 @@ def add_step(
     
     
 
-@mcp.tool()
+@offloaded_tool
 def create_plan_batch(
     name: str,
     children: str,
@@ -410,57 +2782,118 @@ def create_plan_batch(
     except json.JSONDecodeError:
         return "Error: 'children' must be a valid JSON string."
 
-    # Create parent
-    parent_id = db.create_item(name=name, description=description, category=category)
-    
-    # Create children
-    created_count = 0
-    for step in steps:
-        db.create_item(
-            name=step.get('name', 'Untitled Step'),
-            parent_id=parent_id,
-            description=step.get('description'),
-            category=category,
-            scheduled_at=step.get('scheduled_at'),
-            metadata=step.get('metadata', {})
-        )
-        created_count += 1
+    if not all(isinstance(step, dict) for step in steps):
+        return "Error: 'children' must be a JSON list of objects."
+
+    # Create parent and children in one transaction
+    ids = db.create_items_bulk(
+        parent={"name": name, "description": description, "category": category},
+        children=[
+            {
+                "name": step.get('name', 'Untitled Step'),
+                "description": step.get('description'),
+                "category": category,
+                "scheduled_at": step.get('scheduled_at'),
+                "metadata": step.get('metadata', {})
+            }
+            for step in steps
+        ]
+    )
+    parent_id = ids[0]
+    created_count = len(ids) - 1
         
     return f"Plan '{name}' created with {created_count} steps. Parent ID: {parent_id}"
 
-@mcp.tool()
+@offloaded_tool
 def list_plans(
     category: str | None = None,
-    status: str | None = None
-) -> str:
+    status: str | None = None,
+    page_size: int = 50,
+    cursor: str | None = None,
+    format: str = "json",
+    fields: List[str] | None = None
+) -> PlanPage | str:
     """
-    List top-level plans (items without a parent).
+    List top-level plans (items without a parent), one page at a time.
     
     Args:
         category: Filter by category (e.g., "travel", "study").
         status: Filter by status (e.g., "pending", "completed").
+        page_size: Maximum number of plans to return (1-500, default 50).
+        cursor: The next_cursor value from a previous call, to fetch the next page.
+        format: "json" (default) for structured {items, next_cursor}; "text" for a readable list.
+        fields: JSON only - return just these plan fields (e.g. ["name", "status"]); id and progress are always included.
     """
-    items = db.query_items(parent_id=None, category=category, status=status) # parent_id=None means top-level
+    if format not in RESPONSE_FORMATS:
+        return f"Error: format must be one of: {', '.join(RESPONSE_FORMATS)}."
+    if not 1 <= page_size <= 500:
+        return "Error: page_size must be between 1 and 500."
+    try:
+        # parent_id=None means top-level
+        if format == "text":
+            fields = ['name', 'status', 'scheduled_at']
+        page = db.query_items_page(parent_id=None, category=category, status=status,
+                                   page_size=page_size, cursor=cursor, fields=fields)
+    except ValueError as e:
+        return f"Error: {e}"
+    
+    items = page['items']
+    progress = db.get_progress([item['id'] for item in items])
+    if format == "json":
+        for item in items:
+            item['progress'] = progress[item['id']]
+        return page
     if not items:
         return "No plans found matching criteria."
         
     result = "Found plans:\n"
     for item in items:
-        result += f"- [{item['id']}] {item['name']} ({item['status']}) - {item['scheduled_at'] or 'No date'}\n"
+        result += f"- [{item['id']}] {item['name']} ({item['status']}) - {item['scheduled_at'] or 'No date'}"
+        done = progress[item['id']]
+        if done['total']:
+            result += f" - {done['completed']}/{done['total']} steps done ({done['percent']:g}%)"
+        result += "\n"
+    if page['next_cursor']:
+        result += f"next_cursor: {page['next_cursor']}\n"
     return result
 
-@mcp.tool()
-def get_plan_details(plan_id: int) -> str:
+@offloaded_tool
+def get_plan_details(plan_id: int, format: str = "json",
+                     fields: List[str] | None = None) -> PlanRecord | str:
     """
     Get the full details and structure of a plan, including all its steps.
+    
+    Args:
+        plan_id: The plan ID.
+        format: "json" (default) for the structured plan tree; "text" for a readable outline.
+        fields: JSON only - return just these fields for every node (e.g. ["name", "status"]); id, parent_id and progress are always included.
     """
-    tree = db.get_tree(plan_id)
+    if format not in RESPONSE_FORMATS:
+        return f"Error: format must be one of: {', '.join(RESPONSE_FORMATS)}."
+    try:
+        tree = db.get_tree(plan_id, fields=TREE_TEXT_FIELDS if format == "text" else fields)
+    except ValueError as e:
+        return f"Error: {e}"
     if not tree:
         return f"Plan with ID {plan_id} not found."
     
-    return json.dumps(tree, indent=2, ensure_ascii=False)
+    tree['progress'] = db.get_progress([plan_id])[plan_id]
+    if format == "json":
+        return tree
+    
+    # 子节点只需要 TREE_TEXT_FIELDS，描述等字段只读根节点的
+    root = db.get_item(plan_id, fields=['category', 'description', 'deadline'])
+    done = tree['progress']
+    result = f"[{tree['id']}] {tree['name']} ({root['category']}, {tree['status']})\n"
+    if root['description']:
+        result += f"{root['description']}\n"
+    if root['deadline']:
+        result += f"Deadline: {root['deadline']}\n"
+    if done['total']:
+        result += f"Progress: {done['completed']}/{done['total']} steps done ({done['percent']:g}%)\n"
+    return result + "\n" + _format_tree(tree)
 
-@mcp.tool()
+@offloaded_tool
 def update_plan_status(plan_id: int, status: str) -> str:
     """
     Update the status of a plan or step.
@@ -478,7 +2911,7 @@ def update_plan_status(plan_id: int, status: str) -> str:
         return f"Item {plan_id} status updated to '{status}'."
     return f"Item {plan_id} not found."
 
-@mcp.tool()
+@offloaded_tool
 def reschedule_plan(plan_id: int, new_time: str) -> str:
     """
     Change the scheduled time for a plan or step.
@@ -487,12 +2920,70 @@ def reschedule_plan(plan_id: int, new_time: str) -> str:
         plan_id: The ID of the item.
         new_time: New ISO 8601 date string (e.g., "2025-12-25").
     """
-    success = db.update_item(plan_id, scheduled_at=new_time)
-    if success:
-        return f"Item {plan_id} rescheduled to {new_time}."
-    return f"Item {plan_id} not found."
+    success = db.update_item(plan_id, scheduled_at=new_time)
+    if success:
+        return f"Item {plan_id} rescheduled to {new_time}."
+    return f"Item {plan_id} not found."
+
+def _format_batch_results(action: str, results: Dict[int, str]) -> str:
+    """批量工具的逐ID结果"""
+    updated = sum(1 for outcome in results.values() if outcome == "updated")
+    lines = [f"{action}: {updated} of {len(results)} items updated."]
+    icons = {"updated": "✅", "not_found": "❌", "skipped": "⏭️"}
+    for item_id, outcome in results.items():
+        lines.append(f"- {icons[outcome]} [{item_id}] {outcome}")
+    return "\n".join(lines)
+
+@offloaded_tool
+def update_plan_status_batch(
+    status: str,
+    plan_ids: List[int] | None = None,
+    root_id: int | None = None,
+    only_status: str | None = None
+) -> str:
+    """
+    Update the status of many items at once, in a single transaction.
+    
+    Args:
+        status: New status ('pending', 'in_progress', 'completed', 'cancelled').
+        plan_ids: IDs of the items to update.
+        root_id: Alternatively, a plan ID; the plan and all its steps are updated.
+        only_status: Only update items currently in this status (e.g. 'pending').
+    """
+    valid_statuses = {'pending', 'in_progress', 'completed', 'cancelled'}
+    if status not in valid_statuses:
+        return f"Error: Invalid status. Must be one of {valid_statuses}"
+    try:
+        results = db.update_items(item_ids=plan_ids, root_id=root_id,
+                                  where_status=only_status, status=status)
+    except ValueError as e:
+        return f"Error: {e}"
+    return _format_batch_results(f"Status set to '{status}'", results)
+
+@offloaded_tool
+def reschedule_batch(
+    new_time: str,
+    plan_ids: List[int] | None = None,
+    root_id: int | None = None,
+    only_status: str | None = None
+) -> str:
+    """
+    Set the scheduled time of many items at once, in a single transaction.
+    
+    Args:
+        new_time: New ISO 8601 date string (e.g., "2025-12-25").
+        plan_ids: IDs of the items to reschedule.
+        root_id: Alternatively, a plan ID; the plan and all its steps are rescheduled.
+        only_status: Only reschedule items currently in this status (e.g. 'pending').
+    """
+    try:
+        results = db.update_items(item_ids=plan_ids, root_id=root_id,
+                                  where_status=only_status, scheduled_at=new_time)
+    except ValueError as e:
+        return f"Error: {e}"
+    return _format_batch_results(f"Rescheduled to {new_time}", results)
 
-@mcp.tool()
+@offloaded_tool
 def delete_plan_by_name(plan_name: str) -> str:
     """
     按名称删除计划（级联删除所有子计划）- 适合语音交互
@@ -501,33 +2992,25 @@ def delete_plan_by_name(plan_name: str) -> str:
         plan_name: 要删除的计划名称（支持模糊匹配）
     """
     try:
-        # 搜索匹配的计划
-        conn = sqlite3.connect(db.db_path)
-        cursor = conn.cursor()
-        
-        # 首先尝试精确匹配
-        cursor.execute('SELECT id, name FROM plans WHERE name = ? AND parent_id IS NULL', (plan_name,))
-        exact_matches = cursor.fetchall()
+        # 首先尝试精确匹配（只匹配顶级计划）
+        exact_matches = [(item['id'], item['name'])
+                         for item in db.query_items(name=plan_name, fields=['name'])]
         
         if len(exact_matches) == 1:
             # 精确匹配到一个计划
             plan_id = exact_matches[0][0]
             exact_name = exact_matches[0][1]
-            conn.close()
             
             # 调用原有的删除函数
-            result = delete_plan(plan_id)
+            result = delete_plan(plan_id, format="text")
             return f"✅ 精确匹配并删除计划: '{exact_name}'\n\n{result}"
         
-        # 如果没有精确匹配，尝试模糊匹配
-        cursor.execute('''
-            SELECT id, name, category, status FROM plans 
-            WHERE name LIKE ? AND parent_id IS NULL 
-            ORDER BY name
-        ''', (f'%{plan_name}%',))
-        
-        fuzzy_matches = cursor.fetchall()
-        conn.close()
+        # 如果没有精确匹配，按整个名称做子串匹配：这里会直接删除，不能用分词/前缀的全文搜索
+        fuzzy_matches = [
+            (item['id'], item['name'], item['category'], item['status'])
+            for item in db.query_items(name_contains=plan_name, limit=20,
+                                       fields=['name', 'category', 'status'])
+        ]
         
         if not exact_matches and not fuzzy_matches:
             return f"""
@@ -547,15 +3030,10 @@ def delete_plan_by_name(plan_name: str) -> str:
             # 模糊匹配只有一个结果，直接删除
             plan_id = fuzzy_matches[0][0]
             matched_name = fuzzy_matches[0][1]
-            conn = sqlite3.connect(db.db_path)
-            cursor = conn.cursor()
-            cursor.execute("DELETE FROM plans WHERE id = ?", (plan_id,))
-            conn.commit()
-            conn.close()
+            db.delete_item(plan_id)
             
             log_msg = f"✅ 按名称删除成功 - 名称:{matched_name} ID:{plan_id}"
             logger.info(log_msg)
-            print(log_msg)
             
             return f"""
 ✅ 模糊匹配并删除计划: '{matched_name}'
@@ -566,6 +3044,7 @@ def delete_plan_by_name(plan_name: str) -> str:
   • 实际删除名称: '{matched_name}'
 
 💾 数据已从SQLite数据库删除
+♻️ 误删可使用 undo_delete_plan({plan_id}) 恢复
 📝 操作日志已记录
             """.strip()
         
@@ -604,58 +3083,83 @@ def delete_plan_by_name(plan_name: str) -> str:
     except Exception as e:
         log_msg = f"❌ 按名称删除失败 - 关键词:{plan_name} 错误:{str(e)}"
         logger.error(log_msg)
-        print(log_msg)
         return f"❌ 删除过程中发生错误: {str(e)}"
 
-@mcp.tool()
-def delete_plan(plan_id: int) -> str:
+@offloaded_tool
+def delete_plan(plan_id: int, format: str = "json") -> DeleteResult | str:
     """
     删除计划（级联删除所有子计划）
+    
+    Args:
+        plan_id: 要删除的计划ID
+        format: "json"（默认）返回结构化结果（含被删除的计划树）；"text" 返回文本说明
     """
-    # 先检查计划是否存在
-    plan = db.get_item(plan_id)
-    if not plan:
-        return f"❌ 计划 {plan_id} 不存在。"
+    if format not in RESPONSE_FORMATS:
+        return f"❌ format 只能是: {', '.join(RESPONSE_FORMATS)}"
     
-    # 统计将要删除的计划数量
-    total_count = db.get_plan_tree_count(plan_id)
+    try:
+        # 一次子树查询得到数量和计划树，并在同一个事务中删除
+        result = db.delete_tree(plan_id, fields=TREE_TEXT_FIELDS if format == "text" else None)
+    except Exception as e:
+        log_msg = f"❌ 删除过程异常 - ID:{plan_id} 错误:{str(e)}"
+        logger.error(log_msg)
+        return f"❌ 删除过程中发生错误: {str(e)}"
     
-    # 获取计划树用于预览
-    plan_tree = db.get_tree(plan_id)
+    if result is None:
+        return f"❌ 计划 {plan_id} 不存在。"
     
-    try:
-        success = db.delete_item(plan_id)
-        if success:
-            log_msg = f"✅ 计划删除成功 - 主计划ID:{plan_id} 名称:{plan['name']} 总删除数量:{total_count}"
-            logger.info(log_msg)
-            print(log_msg)
-            return f"""
+    plan_tree = result['tree']
+    total_count = result['count']
+    log_msg = f"✅ 计划删除成功 - 主计划ID:{plan_id} 名称:{plan_tree['name']} 总删除数量:{total_count}"
+    logger.info(log_msg)
+    if format == "json":
+        return result
+    return f"""
 ✅ 计划删除成功！
 
 📋 删除详情:
   • 主计划ID: {plan_id}
-  • 主计划名称: {plan['name']}
+  • 主计划名称: {plan_tree['name']}
   • 总删除数量: {total_count} 个计划
   • 包含子计划: {total_count - 1} 个
 
 🌳 被删除的计划结构:
-{json.dumps(plan_tree, indent=2, ensure_ascii=False)}
+{_format_tree(plan_tree)}
 
-💾 已从SQLite数据库中永久删除
+💾 已从SQLite数据库中删除
+♻️ 误删可使用 undo_delete_plan({plan_id}) 恢复
 📝 日志已记录到 plan_manager.log
-            """.strip()
-        else:
-            log_msg = f"❌ 删除计划失败 - ID:{plan_id}"
-            logger.error(log_msg)
-            print(log_msg)
-            return f"❌ 删除计划 {plan_id} 失败。"
+    """.strip()
+
+@offloaded_tool
+def undo_delete_plan(plan_id: int) -> str:
+    """
+    撤销删除 - 按原ID恢复最近一次被删除的计划及其全部子计划
+    
+    Args:
+        plan_id: 被删除的主计划ID（delete_plan 时使用的ID）
+    """
+    try:
+        result = db.undo_delete(plan_id)
+    except ValueError as e:
+        return f"❌ 无法撤销删除: {e}"
     except Exception as e:
-        log_msg = f"❌ 删除过程异常 - ID:{plan_id} 错误:{str(e)}"
+        log_msg = f"❌ 撤销删除失败 - ID:{plan_id} 错误:{str(e)}"
         logger.error(log_msg)
-        print(log_msg)
-        return f"❌ 删除过程中发生错误: {str(e)}"
+        return f"❌ 撤销删除时发生错误: {str(e)}"
+    
+    return f"""
+♻️ 已撤销删除！
 
-@mcp.tool()
+📋 恢复详情:
+  • 主计划ID: {plan_id}
+  • 主计划名称: {result['name']}
+  • 恢复数量: {result['count']} 个计划（含子计划）
+
+💡 使用 get_plan_details({plan_id}) 查看恢复后的计划
+    """.strip()
+
+@offloaded_tool
 def cancel_travel_plan(reason: str = "时间变动", keyword: str = None) -> str:
     """
     取消旅行计划 - 当用户时间变动时批量删除所有旅行相关计划
@@ -668,7 +3172,7 @@ def cancel_travel_plan(reason: str = "时间变动", keyword: str = None) -> str
     
     try:
         # 搜索旅行相关计划
-        travel_plans = db.query_items(category="旅行")
+        travel_plans = db.query_items(category="旅行", fields=['name'])
         
         if not travel_plans:
             return f"""
@@ -681,41 +3185,31 @@ def cancel_travel_plan(reason: str = "时间变动", keyword: str = None) -> str
 💡 当前没有符合条件的旅行计划需要取消
             """.strip()
         
-        # 统计即将删除的计划
+        # 逐个删除（删除引擎同时返回每个计划连同子计划的数量）
         total_plans = 0
-        plans_details = []
-        
-        for plan in travel_plans:
-            plan_count = db.get_plan_tree_count(plan['id'])
-            total_plans += plan_count
-            plans_details.append({
-                'id': plan['id'],
-                'name': plan['name'],
-                'count': plan_count
-            })
-        
-        # 开始批量删除
         deleted_count = 0
         deleted_plans = []
         
-        for plan_detail in plans_details:
+        for plan in travel_plans:
             try:
-                success = db.delete_item(plan_detail['id'])
-                if success:
+                with db.transaction():
+                    result = db.delete_tree(plan['id'], fields=['name'])
+                    if result is not None:
+                        db.audit("cancel_travel", [(plan['id'], None, None,
+                                                    {"reason": reason, "count": result['count']})])
+                if result is not None:
+                    total_plans += result['count']
                     deleted_count += 1
-                    deleted_plans.append(plan_detail['name'])
-                    log_msg = f"✈️ 旅行计划已取消 - ID:{plan_detail['id']} 名称:{plan_detail['name']} 原因:{reason}"
+                    deleted_plans.append(plan['name'])
+                    log_msg = f"✈️ 旅行计划已取消 - ID:{plan['id']} 名称:{plan['name']} 原因:{reason}"
                     logger.info(log_msg)
-                    print(log_msg)
             except Exception as e:
-                log_msg = f"❌ 旅行计划取消失败 - ID:{plan_detail['id']} 错误:{str(e)}"
+                log_msg = f"❌ 旅行计划取消失败 - ID:{plan['id']} 错误:{str(e)}"
                 logger.error(log_msg)
-                print(log_msg)
         
         # 记录批量取消操作
         log_msg = f"🚫 批量取消旅行计划完成 - 原因:{reason} 删除计划数:{total_plans} 成功数:{deleted_count}"
         logger.info(log_msg)
-        print(log_msg)
         
         return f"""
 🚫 旅行计划批量取消完成！
@@ -739,85 +3233,139 @@ def cancel_travel_plan(reason: str = "时间变动", keyword: str = None) -> str
     except Exception as e:
         log_msg = f"❌ 批量取消旅行计划失败 - 错误:{str(e)}"
         logger.error(log_msg)
-        print(log_msg)
         return f"❌ 取消旅行计划时发生错误: {str(e)}"
 
-@mcp.tool()
-def get_operation_logs(limit: int = 20) -> str:
+AUDIT_ICONS = {
+    "create": "✅", "update": "✏️", "update_batch": "✏️", "delete": "🗑️", "cancel_travel": "✈️",
+    "fix_date": "🔧", "restore": "♻️", "undo_delete": "♻️",
+}
+
+def _format_audit_entry(entry: Dict[str, Any]) -> str:
+    """把一条审计记录格式化为一行文本"""
+    icon = AUDIT_ICONS.get(entry['op'], "📝")
+    line = f"{icon} {entry['ts']} {entry['op']}"
+    if entry['item_id'] is not None:
+        line += f" [{entry['item_id']}]"
+    
+    before = entry['before'] or {}
+    after = entry['after'] or {}
+    if entry['op'] == "create":
+        line += f" {after.get('name')}"
+    elif entry['op'] == "delete":
+        line += f" {before.get('name')}"
+    if entry['op'] == "update_batch":
+        # before 按ID记录各自的旧值，这里只显示新值
+        changes = [f"{key} → {value}" for key, value in after.items()]
+    else:
+        changes = [f"{key}: {before.get(key)} → {value}"
+                   for key, value in after.items() if entry['op'] != "create"]
+    if changes:
+        line += " " + ", ".join(changes)
+    if entry['detail']:
+        line += " " + ", ".join(
+            f"{key}={value[:10] + ['...'] if isinstance(value, list) and len(value) > 10 else value}"
+            for key, value in entry['detail'].items())
+    return line
+
+@offloaded_tool
+def get_operation_logs(limit: int = 20, plan_id: int | None = None, op: str | None = None,
+                       since: str | None = None, until: str | None = None,
+                       cursor: str | None = None) -> str:
     """
-    获取操作日志记录
+    获取操作日志记录（按时间倒序，支持筛选和分页）
     
     Args:
-        limit: 显示最近的日志条数（默认20条）
+        limit: 每页显示的记录条数（默认20条）
+        plan_id: 只看某个计划的操作
+        op: 操作类型（create / update / delete / cancel_travel / fix_date / restore）
+        since: 起始时间（含），如 "2025-01-01"
+        until: 截止时间（不含）
+        cursor: 上一页返回的游标，用于翻页
     """
     try:
-        with open('plan_manager.log', 'r', encoding='utf-8') as f:
-            lines = f.readlines()
-            
-        if not lines:
-            return "📝 暂无操作日志"
-        
-        # 获取最近的日志
-        recent_lines = lines[-limit:] if len(lines) > limit else lines
-        
-        log_content = "📋 最近操作日志:\n"
-        log_content += "=" * 50 + "\n"
-        
-        for line in recent_lines:
-            if any(keyword in line for keyword in ['✅', '❌', '✏️', '🗑️', '🚫', '✈️']):
-                log_content += line.strip() + "\n"
-        
-        log_content += "=" * 50 + "\n"
-        log_content += f"📄 显示最近 {len(recent_lines)} 条记录\n"
-        log_content += f"📁 完整日志文件: plan_manager.log"
-        
-        return log_content.strip()
-        
-    except FileNotFoundError:
-        return "📝 日志文件不存在"
+        page = db.query_audit(item_id=plan_id, op=op, since=since, until=until,
+                              page_size=max(1, limit), cursor=cursor)
+    except ValueError as e:
+        return f"❌ {str(e)}"
     except Exception as e:
         return f"❌ 读取日志失败: {str(e)}"
+    
+    if not page['entries']:
+        return "📝 暂无操作日志"
+    
+    log_content = "📋 最近操作日志:\n"
+    log_content += "=" * 50 + "\n"
+    log_content += "\n".join(_format_audit_entry(entry) for entry in page['entries']) + "\n"
+    log_content += "=" * 50 + "\n"
+    log_content += f"📄 显示 {len(page['entries'])} 条记录\n"
+    if page['next_cursor']:
+        log_content += f"➡️ 下一页: cursor=\"{page['next_cursor']}\"\n"
+    log_content += f"📁 文本日志: plan_manager.log（按大小轮换）"
+    
+    return log_content.strip()
+
+@offloaded_tool
+def shift_plan(plan_id: int, days: int, dry_run: bool = False) -> str:
+    """
+    整体平移计划时间 - 计划及其所有子计划的开始时间和截止时间一起推迟或提前
+    
+    Args:
+        plan_id: 计划ID
+        days: 平移天数（正数推迟，负数提前）
+        dry_run: 只预览变化，不修改数据
+    """
+    try:
+        result = db.shift_subtree(plan_id, days, dry_run=dry_run)
+    except Exception as e:
+        logger.error(f"❌ 计划平移失败 - ID:{plan_id} 错误:{str(e)}")
+        return f"❌ 平移计划时发生错误: {str(e)}"
+    if result is None:
+        return f"❌ 计划 {plan_id} 不存在。"
+    
+    preview = "\n".join(
+        f"  • [{item['id']}] {item['name']}: 📅 {item['scheduled_at']} → {item['new_scheduled_at']}"
+        + (f"，⏰ {item['deadline']} → {item['new_deadline']}" if item['deadline'] else "")
+        for item in result['preview'])
+    more = f"\n  ...以及更多（共{result['count']}个）" if result['count'] > len(result['preview']) else ""
+    direction = "推迟" if days >= 0 else "提前"
+    
+    return f"""
+{"🔍 平移预览（未修改数据）" if dry_run else "✅ 计划平移完成！"}
+
+📊 平移统计:
+  • 计划: {plan_id}
+  • {direction}: {abs(days)} 天
+  • 涉及计划数: {result['count']} 个（日期有变化: {result['changed']} 个）
+
+📋 日期变化:
+{preview}{more}
+{f"{chr(10)}💡 使用 shift_plan({plan_id}, {days}) 确认平移" if dry_run else ""}
+    """.strip()
 
-@mcp.tool()
-def preview_delete_plan(plan_id: int) -> str:
+@offloaded_tool
+def preview_delete_plan(plan_id: int, format: str = "json") -> DeleteResult | str:
     """
     预览删除计划的影响（不实际删除）
     
     Args:
         plan_id: 要预览的计划ID
+        format: "json"（默认）返回结构化结果（含将被删除的计划树）；"text" 返回文本预览
     """
-    # 检查计划是否存在
-    plan = db.get_item(plan_id)
-    if not plan:
+    if format not in RESPONSE_FORMATS:
+        return f"❌ format 只能是: {', '.join(RESPONSE_FORMATS)}"
+    # 与 delete_plan 共用删除引擎，只预览不删除
+    result = db.delete_tree(plan_id, dry_run=True,
+                            fields=TREE_TEXT_FIELDS + ['category', 'created_at']
+                            if format == "text" else None)
+    if result is None:
         return f"❌ 计划 {plan_id} 不存在。"
     
-    # 获取计划树
-    plan_tree = db.get_tree(plan_id)
-    total_count = db.get_plan_tree_count(plan_id)
-    
-    def format_tree(item, level=0):
-        indent = "  " * level
-        status_icon = {
-            "pending": "⏳",
-            "in_progress": "🔄", 
-            "completed": "✅",
-            "cancelled": "❌"
-        }.get(item.get('status', 'pending'), "📋")
-        
-        result = f"{indent}{status_icon} [{item['id']}] {item['name']}"
-        
-        if item.get('scheduled_at'):
-            result += f" 📅 {item['scheduled_at']}"
-        
-        result += f" ({item.get('status', 'pending')})"
-        
-        if 'children' in item:
-            for child in item['children']:
-                result += "\n" + format_tree(child, level + 1)
-        
+    if format == "json":
         return result
     
-    tree_view = format_tree(plan_tree)
+    plan = plan_tree = result['tree']
+    total_count = result['count']
+    tree_view = _format_tree(plan_tree)
     
     return f"""
 🔍 删除预览 - 计划 {plan_id}
@@ -837,11 +3385,11 @@ def preview_delete_plan(plan_id: int) -> str:
 🌳 计划层级结构:
 {tree_view}
 
-⚠️  注意: 删除后将无法恢复，建议先备份数据
+⚠️  注意: 删除后只能用 undo_delete_plan({plan_id}) 撤销，建议先备份数据
 💡 使用 delete_plan({plan_id}) 确认删除
     """.strip()
 
-@mcp.tool()
+@offloaded_tool
 def create_travel_plan(
     destination: str,
     start_date: str,
@@ -910,16 +3458,7 @@ def create_travel_plan(
     if budget:
         metadata["budget"] = budget
     
-    parent_id = db.create_item(
-        name=f"{destination}旅行计划",
-        description=description or f"前往{destination}的精彩旅程",
-        category="旅行",
-        scheduled_at=processed_start_date,
-        deadline=processed_end_date,
-        metadata=metadata
-    )
-    
-    # 添加默认步骤
+    # 默认步骤
     default_steps = [
         {"name": "行前准备", "description": "办理签证、预订机票酒店"},
         {"name": "行程规划", "description": "制定详细行程安排"},
@@ -928,20 +3467,24 @@ def create_travel_plan(
         {"name": "返程", "scheduled_at": processed_end_date}
     ]
     
-    created_count = 0
-    for step in default_steps:
-        db.create_item(
-            name=step["name"],
-            description=step.get("description"),
-            parent_id=parent_id,
-            category="旅行",
-            scheduled_at=step.get("scheduled_at")
-        )
-        created_count += 1
+    # 主计划和默认步骤在同一个事务中创建
+    ids = db.create_items_bulk(
+        parent={
+            "name": f"{destination}旅行计划",
+            "description": description or f"前往{destination}的精彩旅程",
+            "category": "旅行",
+            "scheduled_at": processed_start_date,
+            "deadline": processed_end_date,
+            "metadata": metadata
+        },
+        children=default_steps
+    )
+    parent_id = ids[0]
+    created_count = len(ids) - 1
     
     return f"✈️ 旅行计划创建成功！目的地: {destination}, ID: {parent_id}, 包含 {created_count} 个步骤"
 
-@mcp.tool()
+@offloaded_tool
 def create_study_plan(
     subject: str,
     duration_weeks: int,
@@ -989,94 +3532,231 @@ def create_study_plan(
     except ValueError as e:
         return f"❌ 日期格式错误：{start_date}，请使用 YYYY-MM-DD 格式，例如 2025-01-01。错误详情：{str(e)}"
     
-    parent_id = db.create_item(
-        name=f"{subject}学习计划",
-        description=description or f"系统学习{subject}，计划{duration_weeks}周完成",
-        category="学习",
-        scheduled_at=processed_date,
-        metadata={"subject": subject, "duration_weeks": duration_weeks}
-    )
+    # 按周生成学习步骤，和主计划在同一个事务中创建
+    weekly_steps = [
+        {
+            "name": f"第{week}周学习",
+            "description": f"{subject}第{week}周学习内容",
+            "scheduled_at": (start_dt + timedelta(weeks=week-1)).strftime("%Y-%m-%d")
+        }
+        for week in range(1, duration_weeks + 1)
+    ]
     
-    # 按周创建学习步骤
-    created_count = 0
-    
-    for week in range(1, duration_weeks + 1):
-        week_date = (start_dt + timedelta(weeks=week-1)).strftime("%Y-%m-%d")
-        db.create_item(
-            name=f"第{week}周学习",
-            description=f"{subject}第{week}周学习内容",
-            parent_id=parent_id,
-            category="学习",
-            scheduled_at=week_date
-        )
-        created_count += 1
+    ids = db.create_items_bulk(
+        parent={
+            "name": f"{subject}学习计划",
+            "description": description or f"系统学习{subject}，计划{duration_weeks}周完成",
+            "category": "学习",
+            "scheduled_at": processed_date,
+            "metadata": {"subject": subject, "duration_weeks": duration_weeks}
+        },
+        children=weekly_steps
+    )
+    parent_id = ids[0]
+    created_count = len(ids) - 1
     
     return f"📚 学习计划创建成功！主题: {subject}, ID: {parent_id}, 共{duration_weeks}周, {created_count}个步骤"
 
-@mcp.tool()
-def search_plans(keyword: str) -> str:
+@offloaded_tool
+def search_plans(keyword: str, page_size: int = 50, cursor: str | None = None,
+                 format: str = "json", fields: List[str] | None = None) -> PlanPage | str:
     """
-    搜索计划（按名称或描述）.
+    搜索计划（按名称、描述或元数据，结果按相关度排序）.
     
     Args:
-        keyword: 搜索关键词
+        keyword: 搜索关键词（多个词用空格分隔；以 * 结尾表示前缀匹配）。
+                 三个字及以上的词按相关度排序；两个字的词（如“旅行”）也走索引，
+                 只有两字词时按创建时间倒序；单个字的词需要扫描全表，尽量与其他词组合使用
+        page_size: 每页最多返回的条数（1-500，默认50）
+        cursor: 上一次调用返回的 next_cursor，用于获取下一页
+        format: "json"（默认）返回结构化的 {items, next_cursor}；"text" 返回文本列表
+        fields: 仅 json：只返回这些字段（如 ["name", "status"]），id 总会包含
     """
-    conn = sqlite3.connect(db.db_path)
-    cursor = conn.cursor()
-    
-    cursor.execute('''
-        SELECT * FROM plans 
-        WHERE name LIKE ? OR description LIKE ?
-        ORDER BY created_at DESC
-    ''', (f'%{keyword}%', f'%{keyword}%'))
-    
-    rows = cursor.fetchall()
-    conn.close()
+    if format not in RESPONSE_FORMATS:
+        return f"❌ format 只能是: {', '.join(RESPONSE_FORMATS)}"
+    if not 1 <= page_size <= 500:
+        return "❌ page_size 必须在 1-500 之间"
+    if format == "text":
+        fields = ['name', 'category', 'status', 'description']
+    try:
+        page = db.search_items_page(keyword, page_size=page_size, cursor=cursor, fields=fields)
+    except ValueError as e:
+        return f"❌ {e}"
     
-    if not rows:
+    if format == "json":
+        return page
+    items = page['items']
+    if not items:
         return f"未找到包含关键词 '{keyword}' 的计划。"
     
-    columns = ['id', 'name', 'description', 'category', 'parent_id', 
-              'scheduled_at', 'deadline', 'status', 'metadata', 
-              'created_at', 'updated_at']
-    
-    result = f"🔍 搜索结果 ({len(rows)}个):\n"
-    for row in rows:
-        item = dict(zip(columns, row))
+    result = f"🔍 搜索结果 ({len(items)}个):\n"
+    for item in items:
         result += f"- [{item['id']}] {item['name']} ({item['category']}) - {item['status']}\n"
         if item['description']:
             result += f"  📝 {item['description'][:100]}...\n"
+    if page['next_cursor']:
+        result += f"➡️ 下一页: cursor=\"{page['next_cursor']}\"\n"
     
     return result
 
-@mcp.tool()
-def get_plan_statistics() -> str:
+def _format_due_items(items: List[Dict[str, Any]], today: str, icon: str) -> str:
+    lines = []
+    for item in items:
+        try:
+            days = (datetime.strptime(item['deadline'][:10], "%Y-%m-%d")
+                    - datetime.strptime(today, "%Y-%m-%d")).days
+            when = f"逾期 {-days} 天，" if days < 0 else "今天到期，" if days == 0 else f"还剩 {days} 天，"
+        except ValueError:
+            # 非标准日期格式（如"10月1日"）只按字符串比较，不计算天数
+            when = ""
+        line = f"  {icon} [{item['id']}] {item['name']} ⏰ {item['deadline']}（{when}{item['status']}）"
+        if item['root_id'] != item['id']:
+            line += f" — 🗂️ {item['root_name']}"
+        lines.append(line)
+    return "\n".join(lines)
+
+@offloaded_tool
+def overdue_items(limit: int = 50, format: str = "json") -> DueList | str:
     """
-    获取计划统计信息.
+    列出已逾期的计划（截止时间早于今天且未完成/未取消），最早到期的在前
+    
+    Args:
+        limit: 最多返回的条数（1-500，默认50）
+        format: "json"（默认）返回结构化的 {items, source, computed_at}；"text" 返回文本列表
+    """
+    if format not in RESPONSE_FORMATS:
+        return f"❌ format 只能是: {', '.join(RESPONSE_FORMATS)}"
+    if not 1 <= limit <= DueQueue.MAX_ITEMS:
+        return f"❌ limit 必须在 1-{DueQueue.MAX_ITEMS} 之间"
+    today = datetime.now().strftime("%Y-%m-%d")
+    cached = due_queue.overdue(limit)
+    if format == "json":
+        if cached is not None:
+            return {"items": cached[0], "source": "queue", "computed_at": cached[1]}
+        return {"items": db.due_items(before=today, limit=limit), "source": "live", "computed_at": None}
+    if cached is not None:
+        items, source = cached[0], f"⚡ 预计算队列（{cached[1]}）"
+    else:
+        items, source = db.due_items(before=today, limit=limit), "🔎 实时查询"
+    
+    if not items:
+        return "✅ 没有逾期的计划"
+    return f"""
+🔴 逾期计划（{len(items)}个{"，仅显示前" + str(limit) + "个" if len(items) == limit else ""}）:
+{_format_due_items(items, today, "🔴")}
+
+📡 数据来源: {source}
+    """.strip()
+
+@offloaded_tool
+def due_soon(days: int = 7, limit: int = 50, format: str = "json") -> DueList | str:
+    """
+    列出即将到期的计划（今天起 days 天内截止且未完成/未取消），最早到期的在前
+    
+    Args:
+        days: 未来多少天内（默认7天，0 表示只看今天）
+        limit: 最多返回的条数（1-500，默认50）
+        format: "json"（默认）返回结构化的 {items, source, computed_at}；"text" 返回文本列表
+    """
+    if format not in RESPONSE_FORMATS:
+        return f"❌ format 只能是: {', '.join(RESPONSE_FORMATS)}"
+    if days < 0:
+        return "❌ days 不能为负数"
+    if not 1 <= limit <= DueQueue.MAX_ITEMS:
+        return f"❌ limit 必须在 1-{DueQueue.MAX_ITEMS} 之间"
+    today = datetime.now().strftime("%Y-%m-%d")
+    cached = due_queue.due_soon(days, limit)
+    if cached is not None:
+        items, source, computed_at = cached[0], f"⚡ 预计算队列（{cached[1]}）", cached[1]
+    else:
+        cutoff = (datetime.now() + timedelta(days=days + 1)).strftime("%Y-%m-%d")
+        items, source, computed_at = db.due_items(before=cutoff, start=today, limit=limit), "🔎 实时查询", None
+    if format == "json":
+        return {"items": items, "source": "queue" if computed_at else "live", "computed_at": computed_at}
+    
+    if not items:
+        return f"✅ 未来 {days} 天内没有到期的计划"
+    return f"""
+🟡 未来 {days} 天内到期（{len(items)}个{"，仅显示前" + str(limit) + "个" if len(items) == limit else ""}）:
+{_format_due_items(items, today, "🟡")}
+
+📡 数据来源: {source}
+    """.strip()
+
+@offloaded_tool
+def get_agenda(
+    start: str,
+    end: str,
+    status: str | None = None,
+    category: str | None = None,
+    by_deadline: bool = False,
+    page_size: int = 50,
+    cursor: str | None = None,
+    format: str = "json"
+) -> PlanPage | str:
     """
-    conn = sqlite3.connect(db.db_path)
-    cursor = conn.cursor()
+    日程视图：跨所有计划按日期列出某段时间内的安排（如"这周有什么安排"）
     
-    # 总计划数
-    cursor.execute("SELECT COUNT(*) FROM plans")
-    total_plans = cursor.fetchone()[0]
+    Args:
+        start: 起始日期（含），如 "2025-12-22"
+        end: 结束日期（含），如 "2025-12-28"
+        status: 只看该状态（如 "pending"）
+        category: 只看该类别（如 "旅行"）
+        by_deadline: 按截止时间而不是开始时间列出
+        page_size: 每页最多返回的条数（1-500，默认50）
+        cursor: 上一次调用返回的 next_cursor，用于获取下一页
+        format: "json"（默认）返回结构化的 {items, next_cursor}；"text" 返回按天分组的文本
+    """
+    if format not in RESPONSE_FORMATS:
+        return f"❌ format 只能是: {', '.join(RESPONSE_FORMATS)}"
+    if not 1 <= page_size <= 500:
+        return "❌ page_size 必须在 1-500 之间"
+    date_field = "deadline" if by_deadline else "scheduled_at"
+    try:
+        page = db.agenda(start, end, status=status, category=category,
+                         date_field=date_field, page_size=page_size, cursor=cursor,
+                         decode_metadata=format == "json")
+    except ValueError as e:
+        return f"❌ {e}"
     
-    # 按状态统计
-    cursor.execute("SELECT status, COUNT(*) FROM plans GROUP BY status")
-    status_stats = dict(cursor.fetchall())
+    if format == "json":
+        return page
+    items = page['items']
+    if not items:
+        return f"📅 {start} ~ {end} 没有{'截止' if by_deadline else ''}安排。"
     
-    # 按类别统计
-    cursor.execute("SELECT category, COUNT(*) FROM plans GROUP BY category")
-    category_stats = dict(cursor.fetchall())
+    result = f"📅 日程 {start} ~ {end}（{'按截止时间' if by_deadline else '按开始时间'}，{len(items)}项）:\n"
+    current_day = None
+    for item in items:
+        day = item[date_field][:10]
+        if day != current_day:
+            result += f"\n🗓️ {day}\n"
+            current_day = day
+        result += f"  {STATUS_ICONS.get(item['status'], '📋')} [{item['id']}] {item['name']}"
+        if len(item[date_field]) > 10:
+            result += f" 🕐 {item[date_field][11:]}"
+        if item['root_id'] != item['id']:
+            result += f" — 🗂️ {item['root_name']}"
+        result += "\n"
+    if page['next_cursor']:
+        result += f"➡️ 下一页: cursor=\"{page['next_cursor']}\"\n"
     
-    # 本月创建的计划
-    cursor.execute('''
-        SELECT COUNT(*) FROM plans 
-        WHERE created_at >= date('now', 'start of month')
-    ''')
-    monthly_plans = cursor.fetchone()[0]
+    return result
+
+@offloaded_tool
+def get_plan_statistics() -> str:
+    """
+    获取计划统计信息.
+    """
+    # 计数表由触发器维护，读取时不扫描 plans 表
+    counters = db.get_statistics()
+    total_plans = counters['total']
+    status_stats = counters['by_status']
+    category_stats = counters['by_category']
+    # created_at 是 UTC 时间（CURRENT_TIMESTAMP），本月也按 UTC 计算
+    monthly_plans = counters['by_month'].get(time.strftime("%Y-%m", time.gmtime()), 0)
     
-    conn.close()
+    cache_stats = db.cache.stats()
     
     stats = f"""
 📊 计划统计信息
@@ -1089,12 +3769,42 @@ def get_plan_statistics() -> str:
 
 📂 类别分布:
 {chr(10).join([f"  • {category}: {count}" for category, count in category_stats.items()])}
+
+🧠 缓存命中: {cache_stats['hits']} / 未命中: {cache_stats['misses']} (命中率 {cache_stats['hit_rate']:.1%})
+  • 条目: {cache_stats['entries']}/{cache_stats['max_entries']}，淘汰: {cache_stats['evictions']}
     """.strip()
     
     return stats
 
+@offloaded_tool
+def reconcile_statistics() -> str:
+    """
+    校对统计计数和进度汇总：全表重算并比对，发现偏差时自动修正
+    """
+    try:
+        result = db.reconcile_statistics()
+    except Exception as e:
+        logger.error(f"❌ 统计校对失败 - 错误:{str(e)}")
+        return f"❌ 统计校对失败: {str(e)}"
+    
+    if not result['drift'] and not result['rollup_drift']:
+        return f"✅ 统计计数一致（校对 {result['checked']} 项），进度汇总一致"
+    
+    details = "\n".join(
+        f"  • {entry['dim']}/{entry['key'] or '(空)'}: {entry['stored']} → {entry['actual']}"
+        for entry in result['drift']) or "  • 无"
+    rollups = ", ".join(str(plan_id) for plan_id in result['rollup_drift'][:20]) or "无"
+    return f"""
+⚠️ 发现 {len(result['drift'])} 项统计偏差、{len(result['rollup_drift'])} 个计划的进度汇总偏差，已修正（校对 {result['checked']} 项）
+
+📋 偏差详情（记录值 → 实际值）:
+{details}
+
+📊 进度汇总已修正的计划: {rollups}
+    """.strip()
+
 # 引导式创建功能
-@mcp.tool()
+@offloaded_tool
 def guided_plan_creation(plan_type: str = "general") -> str:
     """
     引导式创建计划 - 一步步帮助用户创建完整计划
@@ -1185,7 +3895,7 @@ def guided_plan_creation(plan_type: str = "general") -> str:
     
     return guide_info
 
-@mcp.tool()
+@offloaded_tool
 def validate_and_save_plan(
     name: str,
     plan_data: str,
@@ -1263,79 +3973,39 @@ def validate_and_save_plan(
     except Exception as e:
         return f"❌ 验证错误: {str(e)}"
 
-@mcp.tool()
-def fix_old_dates(year: str = "2025") -> str:
+@offloaded_tool
+def fix_old_dates(year: str = "2025", dry_run: bool = False, chunk_size: int = 500) -> str:
     """
     修复过去的日期 - 将指定年份之前的计划日期更新为指定年份
     
     Args:
         year: 目标年份（默认为"2025"）
+        dry_run: 只统计需要修复的数量，不修改数据
+        chunk_size: 每个事务修复的计划数（默认500），分批提交不长时间占用写锁
     """
     try:
-        from datetime import datetime
-        
-        # 获取所有scheduled_at或deadline为过去的计划
-        conn = sqlite3.connect(db.db_path)
-        cursor = conn.cursor()
-        
-        current_year = str(datetime.now().year)
-        target_year = year or current_year
-        
-        # 查找有2023年或更早日期的计划
-        cursor.execute('''
-            SELECT id, name, scheduled_at, deadline 
-            FROM plans 
-            WHERE scheduled_at < ? OR deadline < ?
-        ''', (f"{target_year}-01-01", f"{target_year}-01-01"))
-        
-        old_plans = cursor.fetchall()
+        target_year = year or str(datetime.now().year)
+        result = db.fix_old_dates(target_year, chunk_size=max(1, chunk_size), dry_run=dry_run)
         
-        if not old_plans:
+        if not (result['scheduled'] or result['deadline']):
             return f"✅ 没有找到需要修复的日期数据（{target_year}年之前的日期）"
         
-        fixed_count = 0
-        fixed_details = []
-        
-        for plan_id, name, scheduled_at, deadline in old_plans:
-            new_scheduled_at = None
-            new_deadline = None
-            
-            # 修复scheduled_at
-            if scheduled_at and scheduled_at < f"{target_year}-01-01":
-                new_scheduled_at = scheduled_at.replace(scheduled_at.split('-')[0], target_year)
-                
-            # 修复deadline  
-            if deadline and deadline < f"{target_year}-01-01":
-                new_deadline = deadline.replace(deadline.split('-')[0], target_year)
-            
-            # 更新数据库
-            if new_scheduled_at or new_deadline:
-                update_fields = []
-                params = []
-                
-                if new_scheduled_at:
-                    update_fields.append("scheduled_at = ?")
-                    params.append(new_scheduled_at)
-                    
-                if new_deadline:
-                    update_fields.append("deadline = ?")
-                    params.append(new_deadline)
-                
-                params.append(plan_id)
-                
-                query = f"UPDATE plans SET {', '.join(update_fields)} WHERE id = ?"
-                cursor.execute(query, params)
-                
-                fixed_count += 1
-                fixed_details.append(f"• [{plan_id}] {name}: {scheduled_at}→{new_scheduled_at or scheduled_at}, {deadline}→{new_deadline or deadline}")
-        
-        conn.commit()
-        conn.close()
+        if dry_run:
+            return f"""
+🔍 日期修复预览（未修改数据）
+
+📊 需要修复:
+  • 开始时间早于 {target_year} 年: {result['scheduled']} 个
+  • 截止时间早于 {target_year} 年: {result['deadline']} 个
+
+💡 使用 fix_old_dates("{target_year}") 执行修复
+            """.strip()
         
-        # 记录修复日志
-        log_msg = f"🔧 日期修复完成 - 修复计划数:{fixed_count} 目标年份:{target_year}"
-        logger.info(log_msg)
-        print(log_msg)
+        fixed_count = result['fixed']
+        fixed_details = [
+            f"• [{item['id']}] {item['name']}: {item['scheduled_at']}→{item['new_scheduled_at']}, {item['deadline']}→{item['new_deadline']}"
+            for item in result['details']
+        ]
         
         return f"""
 🔧 日期修复完成！
@@ -1344,13 +4014,14 @@ def fix_old_dates(year: str = "2025") -> str:
   • 修复计划数: {fixed_count}
   • 目标年份: {target_year}
   • 修复规则: 将 {target_year} 年之前的日期替换为 {target_year} 年
+  • 分批事务: {result['chunks']} 个（每批最多 {max(1, chunk_size)} 个）
 
 📋 修复详情:
-{chr(10).join(fixed_details[:10])}
-{f"...以及更多（共{fixed_count}个）" if fixed_count > 10 else ""}
+{chr(10).join(fixed_details)}
+{f"...以及更多（共{fixed_count}个）" if fixed_count > len(fixed_details) else ""}
 
 💾 数据已更新到SQLite数据库
-📝 修复日志已记录到 plan_manager.log
+📝 修复记录可通过 get_operation_logs(op="fix_date") 查看
 
 💡 提示: 如果有误，可以重新运行此函数或使用备份恢复
         """.strip()
@@ -1358,109 +4029,331 @@ def fix_old_dates(year: str = "2025") -> str:
     except Exception as e:
         log_msg = f"❌ 日期修复失败 - 错误:{str(e)}"
         logger.error(log_msg)
-        print(log_msg)
         return f"❌ 修复过程中发生错误: {str(e)}"
 
-@mcp.tool()
-def backup_plans() -> str:
+# 备份文件格式：第一行是 {"backup": {...}} 头信息，之后每行一个计划（NDJSON）
+BACKUP_SUFFIXES = {"none": ".ndjson", "gzip": ".ndjson.gz", "zstd": ".ndjson.zst"}
+
+def _zstd_module():
+    """zstd 为可选依赖：优先使用 Python 3.14 标准库 compression.zstd，其次 zstandard 包"""
+    try:
+        from compression import zstd
+        return zstd
+    except ImportError:
+        pass
+    try:
+        import zstandard
+        return zstandard
+    except ImportError:
+        return None
+
+def open_backup_file(path: str, mode: str, compression: str | None = None):
+    """
+    以文本方式流式打开备份文件
+    
+    Args:
+        mode: "r" 或 "w"
+        compression: none/gzip/zstd，为 None 时按扩展名判断
+    """
+    if compression is None:
+        if path.endswith(".gz"):
+            compression = "gzip"
+        elif path.endswith(".zst"):
+            compression = "zstd"
+        else:
+            compression = "none"
+    
+    if compression == "gzip":
+        return gzip.open(path, mode + "t", encoding="utf-8")
+    if compression == "zstd":
+        module = _zstd_module()
+        if module is None:
+            raise RuntimeError("zstd 压缩需要 Python 3.14+ 或安装 zstandard 包")
+        return module.open(path, mode + "t", encoding="utf-8")
+    return open(path, mode, encoding="utf-8")
+
+def read_backup_rows(path: str):
+    """逐行读取备份中的计划（生成器）；兼容旧版整体 JSON 格式的备份"""
+    if path.endswith(".json"):
+        # 旧版 backup_plans 生成的单个JSON文档，只能整体读取
+        with open(path, 'r', encoding='utf-8') as f:
+            records = json.load(f).get("plans", [])
+    else:
+        records = None
+    
+    def normalize(record):
+        metadata = record.get("metadata")
+        if metadata is not None and not isinstance(metadata, str):
+            record["metadata"] = json_dumps(metadata)
+        return record
+    
+    if records is not None:
+        for record in records:
+            yield normalize(record)
+        return
+    
+    with open_backup_file(path, "r") as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            record = json_loads(line)
+            if "backup" in record:
+                continue
+            yield normalize(record)
+
+def _throughput(rows: int, size_bytes: int, elapsed: float) -> str:
+    elapsed = max(elapsed, 1e-6)
+    return f"{rows / elapsed:,.0f} 行/秒, {size_bytes / elapsed / 1024 / 1024:.1f} MB/秒"
+
+@offloaded_tool
+def backup_plans(compression: str = "none") -> str:
     """
-    备份所有计划数据
+    备份所有计划数据（流式写入NDJSON，内存占用与数据量无关）
+    
+    Args:
+        compression: 压缩方式："none"（默认）、"gzip" 或 "zstd"
     """
+    if compression not in BACKUP_SUFFIXES:
+        return f"❌ 不支持的压缩方式: {compression}，可选: {', '.join(BACKUP_SUFFIXES)}"
+    
+    backup_file = f"plans_backup_{datetime.now().strftime('%Y%m%d_%H%M%S')}{BACKUP_SUFFIXES[compression]}"
+    
     try:
-        # 获取所有计划
-        conn = sqlite3.connect(db.db_path)
-        cursor = conn.cursor()
-        
-        cursor.execute('SELECT * FROM plans ORDER BY created_at')
-        rows = cursor.fetchall()
-        
-        if not rows:
-            return "📭 没有计划数据需要备份"
-        
-        # 转换为JSON格式
-        columns = ['id', 'name', 'description', 'category', 'parent_id', 
-                  'scheduled_at', 'deadline', 'status', 'metadata', 
-                  'created_at', 'updated_at']
-        
-        plans_data = []
-        for row in rows:
-            item = dict(zip(columns, row))
-            if item['metadata']:
-                try:
-                    item['metadata'] = json.loads(item['metadata'])
-                except:
-                    pass
-            plans_data.append(item)
-        
-        # 创建备份文件
-        backup_file = f"plans_backup_{datetime.now().strftime('%Y%m%d_%H%M%S')}.json"
-        
-        with open(backup_file, 'w', encoding='utf-8') as f:
-            json.dump({
+        started = time.perf_counter()
+        total = 0
+        with open_backup_file(backup_file, "w", compression) as f:
+            f.write(json_dumps({"backup": {
+                "format": "plans-ndjson",
+                "version": 1,
                 "backup_time": datetime.now().isoformat(),
-                "total_plans": len(plans_data),
                 "database_path": os.path.abspath(db.db_path),
-                "plans": plans_data
-            }, f, indent=2, ensure_ascii=False)
+                "columns": db.COLUMNS
+            }}) + "\n")
+            
+            # 逐行写出，metadata 保持数据库中的原始JSON字符串
+            for row in db.export_rows():
+                f.write(json_dumps(dict(zip(db.COLUMNS, row))) + "\n")
+                total += 1
+        elapsed = time.perf_counter() - started
         
-        conn.close()
+        if total == 0:
+            os.remove(backup_file)
+            return "📭 没有计划数据需要备份"
+        
+        size = os.path.getsize(backup_file)
+        log_msg = f"💾 备份完成 - 文件:{backup_file} 计划数:{total} 耗时:{elapsed:.2f}秒"
+        logger.info(log_msg)
         
         return f"""
 ✅ 备份完成！
 
 📁 备份文件: {backup_file}
-📊 备份计划数: {len(plans_data)}
+📊 备份计划数: {total}
+📦 文件大小: {size / 1024:.1f} KB（压缩: {compression}）
+⚡ 吞吐量: {_throughput(total, size, elapsed)}
 💾 原数据库: {os.path.abspath(db.db_path)}
 🕒 备份时间: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}
 
-💡 恢复方法: 将备份文件内容导入到新的 plans.db 中
+💡 恢复方法: restore_plans("{backup_file}")
         """.strip()
         
     except Exception as e:
+        if os.path.exists(backup_file):
+            os.remove(backup_file)
         return f"❌ 备份失败: {str(e)}"
 
+@offloaded_tool
+def restore_plans(backup_file: str, replace: bool = False, batch_size: int = 1000) -> str:
+    """
+    从备份文件恢复计划数据（保留原ID和父子关系，分批事务导入）
+    
+    Args:
+        backup_file: backup_plans 生成的备份文件（.ndjson / .ndjson.gz / .ndjson.zst，兼容旧版 .json）
+        replace: True 时先清空现有计划再恢复；False（默认）时跳过ID已存在的计划
+        batch_size: 每个事务导入的行数（默认1000）
+    """
+    if not os.path.exists(backup_file):
+        return f"❌ 备份文件不存在: {backup_file}"
+    if batch_size < 1:
+        return "❌ batch_size 必须大于 0"
+    
+    try:
+        started = time.perf_counter()
+        stats = db.import_rows(read_backup_rows(backup_file), batch_size=batch_size,
+                               replace=replace)
+        elapsed = time.perf_counter() - started
+    except Exception as e:
+        log_msg = f"❌ 恢复失败 - 文件:{backup_file} 错误:{str(e)}"
+        logger.error(log_msg)
+        return f"❌ 恢复失败: {str(e)}"
+    
+    log_msg = (f"♻️ 恢复完成 - 文件:{backup_file} 读取:{stats['read']} 写入:{stats['inserted']} "
+               f"跳过:{stats['skipped']} 耗时:{elapsed:.2f}秒")
+    logger.info(log_msg)
+    
+    orphan_note = (f"\n⚠️ {stats['orphans']} 个计划的父计划不存在，请检查备份是否完整"
+                   if stats['orphans'] else "")
+    
+    return f"""
+✅ 恢复完成！
+
+📁 备份文件: {backup_file}
+📊 读取: {stats['read']} 个，写入: {stats['inserted']} 个，跳过（ID已存在）: {stats['skipped']} 个
+⚡ 吞吐量: {_throughput(stats['read'], os.path.getsize(backup_file), elapsed)}
+🗄️ 模式: {"清空后恢复" if replace else "合并（保留现有数据）"}{orphan_note}
+    """.strip()
+
+SNAPSHOT_PREFIX = "plans_snapshot_"
+
+def create_snapshot(directory: str = "snapshots", keep: int = 7,
+                    compact: bool = False) -> Dict[str, Any]:
+    """
+    在 directory 下生成带时间戳的快照，并只保留最新的 keep 个
+    
+    Returns:
+        SQLiteDB.snapshot 的结果，外加 removed（被轮换删除的旧快照路径列表）
+    """
+    if keep < 1:
+        raise ValueError("keep 必须大于 0")
+    os.makedirs(directory, exist_ok=True)
+    
+    filename = f"{SNAPSHOT_PREFIX}{datetime.now().strftime('%Y%m%d_%H%M%S_%f')}.db"
+    result = db.snapshot(os.path.join(directory, filename), compact=compact)
+    
+    # 时间戳格式保证文件名按字典序即按时间排序
+    snapshots = sorted(
+        name for name in os.listdir(directory)
+        if name.startswith(SNAPSHOT_PREFIX) and name.endswith(".db")
+    )
+    removed = []
+    for name in snapshots[:-keep]:
+        path = os.path.join(directory, name)
+        os.remove(path)
+        removed.append(path)
+    result["removed"] = removed
+    
+    log_msg = (f"📸 快照完成 - 文件:{result['path']} 大小:{result['size']} "
+               f"方式:{result['method']} 轮换删除:{len(removed)}")
+    logger.info(log_msg)
+    return result
+
+@offloaded_tool
+def snapshot_database(keep: int = 7, compact: bool = False, directory: str = "snapshots") -> str:
+    """
+    生成数据库的二进制快照（SQLite 在线备份API，不中断服务），用于灾难恢复
+    
+    Args:
+        keep: 保留最近的快照个数，更早的会被删除（默认7）
+        compact: 是否用 VACUUM INTO 生成整理压缩后的快照
+        directory: 快照目录（默认 snapshots）
+    """
+    try:
+        result = create_snapshot(directory=directory, keep=keep, compact=compact)
+    except Exception as e:
+        log_msg = f"❌ 快照失败 - 错误:{str(e)}"
+        logger.error(log_msg)
+        return f"❌ 快照失败: {str(e)}"
+    
+    removed = "\n".join(f"  • {path}" for path in result['removed']) or "  • 无"
+    return f"""
+✅ 快照完成！
+
+📁 快照文件: {result['path']}
+📦 文件大小: {result['size'] / 1024:.1f} KB（{result['pages']} 页）
+⚙️ 方式: {"VACUUM INTO 压缩" if result['method'] == "vacuum_into" else "在线备份API"}
+⏱️ 耗时: {result['elapsed'] * 1000:.0f} ms
+
+🗑️ 轮换删除的旧快照（保留最近 {keep} 个）:
+{removed}
+
+💡 恢复方法: 停止服务后用快照文件替换 {os.path.abspath(db.db_path)}
+    """.strip()
+
+def snapshot_cli(argv=None) -> int:
+    """命令行生成快照: python main.py snapshot [--dir DIR] [--keep N] [--compact]"""
+    import argparse
+    
+    parser = argparse.ArgumentParser(prog="main.py snapshot", description="生成数据库快照")
+    parser.add_argument("--dir", default="snapshots", help="快照目录（默认 snapshots）")
+    parser.add_argument("--keep", type=int, default=7, help="保留最近的快照个数（默认7）")
+    parser.add_argument("--compact", action="store_true", help="使用 VACUUM INTO 压缩")
+    args = parser.parse_args(argv)
+    
+    try:
+        result = create_snapshot(directory=args.dir, keep=args.keep, compact=args.compact)
+    except Exception as e:
+        print(f"❌ 快照失败: {e}", file=sys.stderr)
+        return 1
+    finally:
+        db.close()
+    
+    print(f"✅ {result['path']} ({result['size']} 字节, {result['elapsed'] * 1000:.0f} ms)")
+    for path in result['removed']:
+        print(f"🗑️ {path}")
+    return 0
+
 # 运行服务器
 if __name__ == "__main__":
-    print("🚀 PlanManager MCP Server 启动中...")
-    print("💾 数据库位置:", os.path.abspath(db.db_path))
-    print("🛠️  可用功能:")
-    print("  📋 基础功能:")
-    print("    • 创建通用计划 (create_plan)")
-    print("    • 添加子计划 (add_step)")
-    print("    • 批量创建计划 (create_plan_batch)")
-    print("    • 删除计划 (delete_plan)")
-    print("")
-    print("  🎯 快速模板:")
-    print("    • 旅行计划模板 (create_travel_plan)")
-    print("    • 学习计划模板 (create_study_plan)")
-    print("")
-    print("  🔍 查询功能:")
-    print("    • 列出计划 (list_plans)")
-    print("    • 查看计划详情 (get_plan_details)")
-    print("    • 搜索计划 (search_plans)")
-    print("    • 获取统计 (get_plan_statistics)")
-    print("")
-    print("  🛠️  管理功能:")
-    print("    • 更新状态 (update_plan_status)")
-    print("    • 重新安排时间 (reschedule_plan)")
-    print("    • 预览删除 (preview_delete_plan)")
-    print("    • 删除计划 (delete_plan)")
-    print("    • 按名称删除 (delete_plan_by_name) 🗣️ 语音友好")
-    print("    • 取消旅行计划 (cancel_travel_plan)")
-    print("    • 修复旧日期 (fix_old_dates)")
-    print("    • 引导式创建 (guided_plan_creation)")
-    print("    • 验证保存 (validate_and_save_plan)")
-    print("    • 数据备份 (backup_plans)")
-    print("")
-    print("  📝 日志功能:")
-    print("    • 查看操作日志 (get_operation_logs)")
-    print("    • 自动记录所有操作")
-    print("")
-    print("  💾 数据功能:")
-    print("    • 自动保存到SQLite数据库")
-    print("    • 支持数据持久化")
-    print("    • 支持备份和恢复")
-    print("=" * 60)
-    
-    
-    mcp.run(transport="stdio")
\ No newline at end of file
+    if len(sys.argv) > 1 and sys.argv[1] == "snapshot":
+        sys.exit(snapshot_cli(sys.argv[2:]))
+    
+    # stdio 传输下 stdout 是协议通道，启动信息输出到 stderr
+    with redirect_stdout(sys.stderr):
+        print("🚀 PlanManager MCP Server 启动中...")
+        print("💾 数据库位置:", os.path.abspath(db.db_path))
+        print("🛠️  可用功能:")
+        print("  📋 基础功能:")
+        print("    • 创建通用计划 (create_plan)")
+        print("    • 添加子计划 (add_step)")
+        print("    • 批量创建计划 (create_plan_batch)")
+        print("    • 删除计划 (delete_plan)")
+        print("")
+        print("  🎯 快速模板:")
+        print("    • 旅行计划模板 (create_travel_plan)")
+        print("    • 学习计划模板 (create_study_plan)")
+        print("")
+        print("  🔍 查询功能:")
+        print("    • 列出计划 (list_plans)")
+        print("    • 查看计划详情 (get_plan_details)")
+        print("    • 搜索计划 (search_plans)")
+        print("    • 日程视图 (get_agenda)")
+        print("    • 逾期计划 (overdue_items)")
+        print("    • 即将到期 (due_soon)")
+        print("    • 获取统计 (get_plan_statistics)")
+        print("    • 校对统计 (reconcile_statistics)")
+        print("")
+        print("  🛠️  管理功能:")
+        print("    • 更新状态 (update_plan_status)")
+        print("    • 重新安排时间 (reschedule_plan)")
+        print("    • 批量更新状态 (update_plan_status_batch)")
+        print("    • 批量重新安排 (reschedule_batch)")
+        print("    • 整体平移计划 (shift_plan)")
+        print("    • 预览删除 (preview_delete_plan)")
+        print("    • 删除计划 (delete_plan)")
+        print("    • 按名称删除 (delete_plan_by_name) 🗣️ 语音友好")
+        print("    • 取消旅行计划 (cancel_travel_plan)")
+        print("    • 修复旧日期 (fix_old_dates)")
+        print("    • 引导式创建 (guided_plan_creation)")
+        print("    • 验证保存 (validate_and_save_plan)")
+        print("    • 数据备份 (backup_plans)")
+        print("    • 恢复备份 (restore_plans)")
+        print("    • 数据库快照 (snapshot_database)")
+        print("")
+        print("  📝 日志功能:")
+        print("    • 查看操作日志 (get_operation_logs)")
+        print("    • 自动记录所有操作")
+        print("")
+        print("  💾 数据功能:")
+        print("    • 自动保存到SQLite数据库")
+        print("    • 支持数据持久化")
+        print("    • 支持备份和恢复")
+        print("=" * 60)
+    
+    due_queue.start()
+    try:
+        mcp.run(transport="stdio")
+    finally:
+        due_queue.stop()
+        tool_runner.shutdown()
+        db.close()
\ No newline at end of file
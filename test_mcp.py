@@ -6,8 +6,27 @@ MCP 服务器测试脚本
 
 import sys
 import json
+import asyncio
+
+import pytest
+
+import main
 from main import list_plans, create_plan, get_plan_details
 
+@pytest.fixture
+def store(monkeypatch):
+    """内存存储引擎，替换 main.db 供 MCP 工具使用，测试结束后关闭"""
+    store = main.open_store("memory")
+    monkeypatch.setattr(main, "db", store)
+    yield store
+    store.close()
+
+def call_tools(*calls):
+    """在事件循环中依次调用 MCP 工具，calls 为 (工具名, 参数)，返回各自的结果"""
+    async def scenario():
+        return [await main.mcp.call_tool(name, arguments) for name, arguments in calls]
+    return asyncio.run(scenario())
+
 def test_list_plans():
     """测试 list_plans 函数"""
     print("=" * 50)
@@ -69,6 +88,109 @@ def test_database_connection():
     
     return len(items) > 0
 
+def test_tools_run_in_worker_threads(store):
+    """测试 MCP 工具在工作线程中执行，慢调用不阻塞事件循环"""
+    import threading
+    import time as _time
+    
+    runner = main.ToolRunner(max_workers=2)
+    
+    async def scenario():
+        slow = asyncio.ensure_future(runner.run(_time.sleep, 0.3))
+        started = _time.perf_counter()
+        thread_name = await runner.run(lambda: threading.current_thread().name)
+        elapsed = _time.perf_counter() - started
+        await slow
+        result = await main.mcp.call_tool("list_plans", {"page_size": 1})
+        return thread_name, elapsed, result
+    
+    thread_name, elapsed, result = asyncio.run(scenario())
+    runner.shutdown()
+    
+    assert thread_name.startswith("plan-tool")
+    assert elapsed < 0.3
+    assert result
+
+def test_tools_return_structured_content(store):
+    """测试默认返回结构化内容（紧凑JSON），format="text" 返回文本"""
+    root, *steps = store.create_items_bulk({"name": "结构化计划"}, [{"name": "步骤1"}, {"name": "步骤2"}])
+    # 130 层深的链超过协议层编码的嵌套上限
+    deep = root
+    for i in range(130):
+        deep = store.create_item(name=f"第{i}层", parent_id=deep)
+    
+    details, text, plans, deep_tree = call_tools(
+        ("get_plan_details", {"plan_id": steps[0]}),
+        ("get_plan_details", {"plan_id": steps[0], "format": "text"}),
+        ("list_plans", {}),
+        ("get_plan_details", {"plan_id": root}))
+    
+    assert details.structuredContent["name"] == "步骤1"
+    assert json.loads(details.content[0].text) == details.structuredContent
+    assert ": " not in details.content[0].text
+    assert "[" + str(steps[0]) + "] 步骤1" in text[0].text
+    assert [p["id"] for p in plans.structuredContent["items"]] == [root]
+    assert plans.structuredContent["items"][0]["progress"]["total"] == 132
+    assert deep_tree.structuredContent is None
+    assert json.loads(deep_tree.content[0].text)["id"] == root
+
+def test_add_step_inherits_category(store):
+    """测试 add_step 创建的步骤继承父计划的类别"""
+    plan_id = store.create_item(name="东京旅行", category="旅行")
+    
+    added, missing = call_tools(
+        ("add_step", {"plan_id": plan_id, "name": "订酒店"}),
+        ("add_step", {"plan_id": 9999, "name": "无效"}))
+    
+    step_id = int(added[0].text.rsplit(":", 1)[1])
+    assert store.get_item(step_id, fields=["category", "parent_id"]) == {
+        "id": step_id, "category": "旅行", "parent_id": plan_id}
+    assert "not found" in missing[0].text
+
+def test_delete_tools_share_one_engine(store):
+    """测试删除预览、按名称删除（级联）和撤销删除"""
+    root, step = store.create_items_bulk({"name": "云南旅行"}, [{"name": "订机票"}])
+    store.create_item(name="比价", parent_id=step)
+    other = store.create_item(name="云南美食")
+    
+    unmatched, preview, deleted, undone = call_tools(
+        ("delete_plan_by_name", {"plan_name": "云南 美食*"}),
+        ("preview_delete_plan", {"plan_id": root}),
+        ("delete_plan_by_name", {"plan_name": "云南旅行"}),
+        ("undo_delete_plan", {"plan_id": root}))
+    
+    # 按名称删除是整体子串匹配，不会按词拆分后误删其他计划
+    assert "未找到名称包含" in unmatched[0].text
+    assert store.get_item(other) is not None
+    assert (preview.structuredContent["count"], preview.structuredContent["deleted"]) == (3, False)
+    assert "总删除数量: 3 个计划" in deleted[0].text
+    assert "恢复数量: 3 个计划" in undone[0].text
+    assert store.get_plan_tree_count(root) == 3
+
+def test_logging_goes_through_bounded_queue(tmp_path):
+    """测试日志经队列异步写入文件，队列满时丢弃而不阻塞"""
+    import logging
+    
+    root = logging.getLogger()
+    saved_handlers, saved_level = root.handlers[:], root.level
+    log_file = tmp_path / "plan_manager.log"
+    try:
+        listener = main.setup_logging(str(log_file), echo=False, queue_size=1)
+        queue_handler = root.handlers[0]
+        assert isinstance(queue_handler, main.DroppingQueueHandler)
+        
+        for i in range(200):
+            logging.getLogger("main").info("✅ 队列日志 %s", i)
+        listener.stop()
+        listener.stop()  # 重复调用无副作用
+        
+        lines = log_file.read_text(encoding="utf-8").splitlines()
+        assert lines and all(" - INFO - ✅ 队列日志 " in line for line in lines)
+        assert len(lines) + queue_handler.dropped == 200
+    finally:
+        root.handlers = saved_handlers
+        root.setLevel(saved_level)
+
 if __name__ == "__main__":
     import time
     
@@ -0,0 +1,821 @@
+#!/usr/bin/env python3
+"""
+SQLiteDB 存储层测试
+
+所有测试都使用临时数据库，运行方式:
+    python -m pytest -q test_sqlite_db.py
+"""
+
+import os
+import sqlite3
+import threading
+
+import pytest
+
+import main
+from main import SQLiteDB, ConnectionPool
+
+
+@pytest.fixture
+def db(tmp_path):
+    database = SQLiteDB(str(tmp_path / "plans.db"), pool_size=2)
+    yield database
+    database.close()
+
+
+def test_pool_reuses_connections(db):
+    """连续调用复用同一个连接，且外键约束已启用"""
+    item_id = db.create_item(name="测试计划")
+    assert db.get_item(item_id)["name"] == "测试计划"
+
+    with db.connection() as first:
+        assert first.execute("PRAGMA foreign_keys").fetchone()[0] == 1
+    with db.connection() as second:
+        assert second is first
+    assert db.pool.stats()["created"] == 1
+
+
+def test_pool_is_reentrant_within_thread(db):
+    """嵌套调用共用连接，能看到外层未提交的修改"""
+    with db.transaction() as conn:
+        cursor = conn.execute("INSERT INTO plans (name) VALUES ('嵌套')")
+        assert db.get_item(cursor.lastrowid)["name"] == "嵌套"
+    assert db.query_items()[0]["name"] == "嵌套"
+
+
+def test_transaction_rolls_back_on_error(db):
+    with pytest.raises(RuntimeError):
+        with db.transaction() as conn:
+            conn.execute("INSERT INTO plans (name) VALUES ('回滚')")
+            raise RuntimeError("boom")
+    assert db.query_items() == []
+
+
+def test_transaction_holds_write_lock_before_first_write(db):
+    """事务开始即持有写锁：只做了 SELECT 时其他连接也不能写入"""
+    with db.transaction() as conn:
+        conn.execute("SELECT COUNT(*) FROM plans").fetchone()
+        assert conn.in_transaction
+        writer = sqlite3.connect(db.db_path, timeout=0)
+        with pytest.raises(sqlite3.OperationalError, match="locked"):
+            writer.execute("INSERT INTO plans (name) VALUES ('并发写入')")
+        writer.close()
+
+
+def test_pool_replaces_broken_connection(db):
+    with db.connection() as conn:
+        pass
+    conn.close()
+    item_id = db.create_item(name="恢复")
+    assert db.get_item(item_id)["name"] == "恢复"
+
+
+def test_pool_is_bounded_across_threads(tmp_path):
+    pool = ConnectionPool(str(tmp_path / "pool.db"), size=2, timeout=0.1)
+    holding = threading.Event()
+    release = threading.Event()
+
+    def hold():
+        with pool.connection():
+            holding.set()
+            release.wait()
+
+    workers = [threading.Thread(target=hold) for _ in range(2)]
+    for worker in workers:
+        worker.start()
+        holding.wait()
+        holding.clear()
+
+    with pytest.raises(sqlite3.OperationalError):
+        with pool.connection():
+            pass
+
+    release.set()
+    for worker in workers:
+        worker.join()
+    assert pool.stats() == {"size": 2, "created": 2, "idle": 2}
+    pool.close()
+
+
+def test_get_tree_loads_subtree_in_order(db):
+    root = db.create_item(name="旅行")
+    first = db.create_item(name="准备", parent_id=root)
+    db.create_item(name="出发", parent_id=root)
+    db.create_item(name="订票", parent_id=first)
+    other = db.create_item(name="无关计划")
+
+    tree = db.get_tree(root)
+    assert [child["name"] for child in tree["children"]] == ["准备", "出发"]
+    assert [child["name"] for child in tree["children"][0]["children"]] == ["订票"]
+    assert "children" not in tree["children"][1]
+    assert db.get_plan_tree_count(root) == 4
+    assert db.get_plan_tree_count(other) == 1
+    assert db.get_tree(999) is None
+    assert db.get_plan_tree_count(999) == 0
+
+
+def test_get_tree_handles_deep_hierarchy(db):
+    parent_id = root = db.create_item(name="第0层")
+    with db.transaction() as conn:
+        for level in range(1, 3000):
+            parent_id = conn.execute(
+                "INSERT INTO plans (name, parent_id) VALUES (?, ?)",
+                (f"第{level}层", parent_id)).lastrowid
+
+    assert db.get_plan_tree_count(root) == 3000
+    node, depth = db.get_tree(root), 1
+    while "children" in node:
+        node, depth = node["children"][0], depth + 1
+    assert depth == 3000
+
+
+@pytest.mark.parametrize("profile, journal_mode, synchronous", [
+    ("durable", "wal", 2),
+    ("balanced", "wal", 1),
+    ("ephemeral", "memory", 0),
+])
+def test_storage_profiles(tmp_path, profile, journal_mode, synchronous):
+    database = SQLiteDB(str(tmp_path / "plans.db"), profile=profile)
+    assert database.journal_mode() == journal_mode
+    with database.connection() as conn:
+        assert conn.execute("PRAGMA synchronous").fetchone()[0] == synchronous
+        assert conn.execute("PRAGMA foreign_keys").fetchone()[0] == 1
+    database.create_item(name="配置档")
+    database.close()
+    database.close()
+
+
+def test_unknown_profile_is_rejected(tmp_path):
+    with pytest.raises(ValueError):
+        SQLiteDB(str(tmp_path / "plans.db"), profile="fast")
+
+
+def test_wal_readers_do_not_block_on_writer(db):
+    item_id = db.create_item(name="读写并发")
+    with db.transaction() as conn:
+        conn.execute("UPDATE plans SET name = '写入中' WHERE id = ?", (item_id,))
+        reader = sqlite3.connect(db.db_path, timeout=0)
+        assert reader.execute("SELECT name FROM plans WHERE id = ?",
+                              (item_id,)).fetchone()[0] == "读写并发"
+        reader.close()
+    assert db.checkpoint()["busy"] == 0
+
+
+def test_create_items_bulk_returns_ids_in_order(db):
+    db.create_item(name="已有计划")
+    ids = db.create_items_bulk(
+        parent={"name": "批量计划", "category": "学习", "metadata": {"weeks": 2}},
+        children=[{"name": "第1周"}, {"name": "第2周", "category": "复习"}])
+
+    assert len(ids) == 3
+    tree = db.get_tree(ids[0])
+    assert tree["metadata"] == {"weeks": 2}
+    assert [(c["id"], c["name"], c["category"]) for c in tree["children"]] == [
+        (ids[1], "第1周", "学习"), (ids[2], "第2周", "复习")]
+
+
+def test_create_items_bulk_is_atomic(db):
+    with pytest.raises(TypeError):
+        db.create_items_bulk(parent={"name": "失败的计划"},
+                             children=[{"name": "好的"}, {"metadata": {"x": object()}}])
+    assert db.query_items() == []
+
+
+def test_search_items_uses_full_text_index(db):
+    yunnan = db.create_item(name="云南旅行计划", description="昆明、大理、丽江")
+    db.create_item(name="日本旅行计划", metadata={"城市": "东京"})
+    step = db.create_item(name="云南美食清单", parent_id=yunnan)
+
+    assert db.fts_enabled
+    assert [i["id"] for i in db.search_items("云南旅行")] == [yunnan]
+    assert {i["name"] for i in db.search_items("旅行计划")} == {"云南旅行计划", "日本旅行计划"}
+    assert [i["name"] for i in db.search_items("东京")] == ["日本旅行计划"]
+    assert [i["id"] for i in db.search_items("云南", top_level_only=True)] == [yunnan]
+    assert [i["id"] for i in db.search_items("大理丽", columns=["name"])] == []
+    assert len(db.search_items("旅行", limit=1)) == 1
+    assert len(db.search_items("旅行", limit=1, offset=1)) == 1
+    # 两个字的词走索引词表，出现在字段末尾时也能匹配
+    assert [i["id"] for i in db.search_items("清单")] == [step]
+    assert [i["id"] for i in db.search_items("丽江", columns=["name"])] == []
+    assert [i["id"] for i in db.search_items("丽江 旅行计划")] == [yunnan]
+    with db.connection() as conn:
+        plan = conn.execute(
+            "EXPLAIN QUERY PLAN SELECT p.id FROM plans p WHERE p.id IN "
+            "(SELECT doc FROM plans_fts_terms WHERE term >= ? AND term < ?)", ("清单", "清单\U0010ffff")).fetchall()
+    assert any(row[-1].startswith("SEARCH p USING INTEGER PRIMARY KEY") for row in plan)
+
+    db.update_item(step, name="云南小吃清单")
+    assert db.search_items("美食清单") == []
+    db.delete_item(yunnan)
+    assert db.search_items("云南") == []
+
+
+def test_search_index_is_rebuilt_for_existing_database(tmp_path):
+    path = str(tmp_path / "old.db")
+    conn = sqlite3.connect(path)
+    conn.execute("CREATE TABLE plans (id INTEGER PRIMARY KEY AUTOINCREMENT, name TEXT NOT NULL, "
+                 "description TEXT, category TEXT DEFAULT 'general', parent_id INTEGER, "
+                 "scheduled_at DATE, deadline DATE, status TEXT DEFAULT 'pending', metadata TEXT, "
+                 "created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP, "
+                 "updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP)")
+    conn.execute("INSERT INTO plans (name) VALUES ('云南旅行计划')")
+    conn.commit()
+    conn.close()
+
+    database = SQLiteDB(path)
+    assert [i["name"] for i in database.search_items("南旅行")] == ["云南旅行计划"]
+    # 旧版触发器写入的列值没有补 char(31)：重新打开时换成新触发器并重建索引
+    with database.transaction() as conn:
+        conn.execute("DROP TRIGGER plans_fts_ai")
+        conn.execute("CREATE TRIGGER plans_fts_ai AFTER INSERT ON plans BEGIN "
+                     "INSERT INTO plans_fts (rowid, name, description, metadata) "
+                     "VALUES (new.id, new.name, new.description, new.metadata); END")
+        conn.execute("INSERT INTO plans_fts (plans_fts) VALUES ('rebuild')")
+    database.close()
+    database = SQLiteDB(path)
+    with database.connection() as conn:
+        trigger = conn.execute("SELECT sql FROM sqlite_master WHERE name = 'plans_fts_ai'").fetchone()[0]
+        terms = {row[0] for row in conn.execute("SELECT term FROM plans_fts_terms")}
+    assert "char(31)" in trigger and "计划\x1f" in terms
+    assert database.search_items("计划")[0]["name"] == "云南旅行计划"
+    database.close()
+
+
+def test_query_items_page_walks_all_pages(db):
+    with db.transaction() as conn:
+        conn.executemany("INSERT INTO plans (name, created_at) VALUES (?, ?)",
+                         [(f"计划{i}", f"2026-01-0{i % 3 + 1} 00:00:00") for i in range(7)])
+    expected = [item["id"] for item in db.query_items()]
+
+    seen, cursor = [], None
+    while True:
+        page = db.query_items_page(page_size=3, cursor=cursor)
+        seen.extend(item["id"] for item in page["items"])
+        cursor = page["next_cursor"]
+        if cursor is None:
+            break
+    assert seen == expected and len(seen) == 7
+
+
+def test_search_items_page_walks_all_pages(db):
+    for i in range(5):
+        db.create_item(name=f"云南旅行计划{i}")
+    for keyword in ("旅行计划", "旅行"):
+        seen, cursor = [], None
+        while True:
+            page = db.search_items_page(keyword, page_size=2, cursor=cursor)
+            seen.extend(item["id"] for item in page["items"])
+            cursor = page["next_cursor"]
+            if cursor is None:
+                break
+        assert sorted(seen) == [1, 2, 3, 4, 5]
+
+
+def test_invalid_cursor_is_rejected(db):
+    with pytest.raises(ValueError):
+        db.query_items_page(cursor="不是游标")
+    search_cursor = main.encode_cursor("search", [0.5, 1])
+    with pytest.raises(ValueError):
+        db.query_items_page(cursor=search_cursor)
+
+
+def test_cache_serves_repeat_reads(db):
+    root = db.create_item(name="缓存计划")
+    db.create_item(name="步骤", parent_id=root)
+
+    db.get_item(root)
+    db.get_tree(root)
+    hits = db.cache.hits
+    item = db.get_item(root)
+    tree = db.get_tree(root)
+    assert db.get_plan_tree_count(root) == 2
+    assert db.cache.hits == hits + 3
+
+    # 返回的是副本，修改不会污染缓存
+    item["name"] = "被修改"
+    tree["children"].clear()
+    assert db.get_item(root)["name"] == "缓存计划"
+    assert len(db.get_tree(root)["children"]) == 1
+
+
+def test_cache_invalidates_ancestors_on_writes(db):
+    root = db.create_item(name="根")
+    middle = db.create_item(name="中间", parent_id=root)
+    leaf = db.create_item(name="叶子", parent_id=middle)
+    other = db.create_item(name="无关")
+    db.get_tree(root)
+    db.get_tree(other)
+
+    db.update_item(leaf, status="completed")
+    assert db.get_tree(root)["children"][0]["children"][0]["status"] == "completed"
+
+    db.create_item(name="新叶子", parent_id=middle)
+    assert db.get_plan_tree_count(root) == 4
+
+    db.delete_item(middle)
+    assert db.get_item(leaf) is None
+    assert "children" not in db.get_tree(root)
+    assert db.get_plan_tree_count(root) == 1
+
+    # 无关的子树没有被失效
+    hits = db.cache.hits
+    db.get_tree(other)
+    assert db.cache.hits == hits + 1
+
+
+def test_cache_ignores_rolled_back_reads(db):
+    with pytest.raises(RuntimeError):
+        with db.transaction():
+            item_id = db.create_item(name="回滚")
+            assert db.get_item(item_id)["name"] == "回滚"
+            raise RuntimeError("boom")
+    assert db.get_item(item_id) is None
+
+
+def test_cache_is_bounded(tmp_path):
+    database = SQLiteDB(str(tmp_path / "plans.db"), cache_size=2)
+    ids = [database.create_item(name=f"计划{i}") for i in range(3)]
+    for item_id in ids:
+        database.get_item(item_id)
+    stats = database.cache.stats()
+    assert stats["entries"] == 2 and stats["evictions"] == 1
+    database.close()
+
+
+@pytest.mark.parametrize("compression", ["none", "gzip"])
+def test_backup_and_restore_round_trip(db, tmp_path, monkeypatch, compression):
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(main, "db", db)
+    root = db.create_item(name="云南旅行计划", metadata={"预算": 5000})
+    child = db.create_item(name="出发", parent_id=root)
+    # 子计划挂到ID更大的父计划下，恢复时父计划晚于子计划写入
+    late_parent = db.create_item(name="后建的父计划")
+    db.update_item(child, parent_id=late_parent)
+
+    result = main.backup_plans(compression=compression)
+    assert "✅ 备份完成" in result
+    backup_file = next(tmp_path.glob("plans_backup_*"))
+
+    restored = SQLiteDB(str(tmp_path / "restored.db"))
+    monkeypatch.setattr(main, "db", restored)
+    assert "写入: 3 个" in main.restore_plans(str(backup_file), batch_size=2)
+    assert restored.get_item(root)["metadata"] == {"预算": 5000}
+    assert restored.get_item(child)["parent_id"] == late_parent
+    assert [i["id"] for i in restored.search_items("云南旅行")] == [root]
+
+    # 再次恢复时已存在的ID被跳过
+    assert "跳过（ID已存在）: 3 个" in main.restore_plans(str(backup_file))
+    restored.close()
+
+
+def test_statistics_counters_follow_writes(db):
+    root = db.create_item(name="旅行", category="旅行")
+    child = db.create_item(name="出发", category="旅行", parent_id=root)
+    db.create_item(name="读书", category="学习")
+    db.update_item(child, status="completed")
+    with db.transaction() as conn:
+        conn.execute("UPDATE plans SET category = '出行' WHERE id = ?", (root,))
+
+    stats = db.get_statistics()
+    assert stats["total"] == 3
+    assert stats["by_status"] == {"pending": 2, "completed": 1}
+    assert stats["by_category"] == {"出行": 1, "旅行": 1, "学习": 1}
+    assert sum(stats["by_month"].values()) == 3
+
+    # 级联删除的子计划同样被扣减
+    db.delete_item(root)
+    stats = db.get_statistics()
+    assert stats["total"] == 1
+    assert stats["by_category"] == {"学习": 1}
+    assert db.reconcile_statistics()["drift"] == []
+
+
+def test_reconcile_statistics_repairs_drift(db):
+    db.create_item(name="计划", category="工作")
+    with db.transaction() as conn:
+        conn.execute("UPDATE plan_counters SET count = 5 WHERE dim = 'category'")
+
+    drift = db.reconcile_statistics()["drift"]
+    assert drift == [{"dim": "category", "key": "工作", "stored": 5, "actual": 1}]
+    assert db.get_statistics()["by_category"] == {"工作": 1}
+
+
+def test_progress_rollups_follow_writes(db):
+    trip, day1, day2 = db.create_items_bulk({"name": "旅行"}, [{"name": "第一天"}, {"name": "第二天"}])
+    visit = db.create_item(name="参观", parent_id=day1)
+    db.update_item(visit, status="completed")
+    db.update_item(day2, status="in_progress")
+
+    progress = db.get_progress([trip, day1, visit])
+    assert progress[trip] == {"total": 3, "completed": 1, "in_progress": 1, "cancelled": 0,
+                              "pending": 1, "percent": 33.3}
+    assert progress[day1]["total"] == 1 and progress[day1]["completed"] == 1
+    assert progress[visit]["total"] == 0
+
+    # 移动子树：旧祖先链减去、新祖先链加上整棵子树
+    other = db.create_item(name="备选")
+    db.update_item(day1, parent_id=other)
+    progress = db.get_progress([trip, other])
+    assert (progress[trip]["total"], progress[trip]["completed"]) == (1, 0)
+    assert (progress[other]["total"], progress[other]["completed"]) == (2, 1)
+
+    db.delete_item(day1)
+    assert db.get_progress([other])[other]["total"] == 0
+    assert db.reconcile_statistics()["rollup_drift"] == []
+
+
+def test_update_item_rollups_ignore_stale_cache(db):
+    """另一个连接（进程）先改了状态：增量按表中已提交的状态计算，不按缓存"""
+    plan, step = db.create_items_bulk({"name": "并发计划"}, [{"name": "步骤"}])
+    assert db.get_item(step)["status"] == "pending"   # 缓存中是旧状态
+    other = SQLiteDB(db.db_path)
+    other.update_item(step, status="completed")
+    other.close()
+
+    db.update_item(step, status="completed")
+    progress = db.get_progress([plan])[plan]
+    assert (progress["total"], progress["completed"]) == (1, 1)
+    assert db.reconcile_statistics()["rollup_drift"] == []
+
+
+def test_update_items_in_one_transaction(db):
+    trip, day1, day2 = db.create_items_bulk({"name": "旅行"}, [{"name": "第一天"}, {"name": "第二天"}])
+    db.update_item(day2, status="cancelled")
+    assert db.get_tree(trip)  # 预热缓存，批量更新后应失效
+
+    results = db.update_items(item_ids=[day1, day2, 999], status="completed")
+    assert results == {day1: "updated", day2: "updated", 999: "not_found"}
+    assert db.get_tree(trip)["children"][0]["status"] == "completed"
+    assert db.get_progress([trip])[trip]["completed"] == 2
+
+    # 子树 + 状态过滤
+    results = db.update_items(root_id=trip, where_status="pending", scheduled_at="2030-01-01")
+    assert results == {trip: "updated", day1: "skipped", day2: "skipped"}
+    assert db.get_item(trip)["scheduled_at"] == "2030-01-01"
+    assert db.get_item(day1)["scheduled_at"] != "2030-01-01"
+    assert db.update_items(root_id=999, status="completed") == {999: "not_found"}
+
+    batches = db.query_audit(op="update_batch")["entries"]
+    assert len(batches) == 2
+    assert batches[-1]["before"] == {str(day1): {"status": "pending"}, str(day2): {"status": "cancelled"}}
+    assert db.reconcile_statistics()["rollup_drift"] == []
+
+    with pytest.raises(ValueError):
+        db.update_items(item_ids=[trip], name="不支持")
+
+
+def test_update_items_reads_under_write_lock(db):
+    """读取更新前状态时已持有写锁：其他连接此时的写入被拒绝，汇总不会重复计算"""
+    plan, step = db.create_items_bulk({"name": "批量计划"}, [{"name": "步骤"}])
+    outcomes = []
+
+    def interfere(statement):
+        if statement.startswith("SELECT id, parent_id, status"):
+            writer = sqlite3.connect(db.db_path, timeout=0)
+            try:
+                writer.execute("UPDATE plans SET status = 'completed' WHERE id = ?", (step,))
+                writer.commit()
+                outcomes.append("written")
+            except sqlite3.OperationalError:
+                outcomes.append("locked")
+            writer.close()
+
+    with db.connection() as conn:
+        conn.set_trace_callback(interfere)
+        try:
+            assert db.update_items([step], status="completed") == {step: "updated"}
+        finally:
+            conn.set_trace_callback(None)
+    assert outcomes == ["locked"]
+    assert db.get_progress([plan])[plan]["completed"] == 1
+    assert db.reconcile_statistics()["rollup_drift"] == []
+
+
+def test_shift_subtree_moves_all_dates(db):
+    trip, day1, day2 = db.create_items_bulk(
+        {"name": "旅行", "scheduled_at": "2025-12-30", "deadline": "2026-01-02 18:00"},
+        [{"name": "第一天", "scheduled_at": "2025-12-31T09:00"},
+         {"name": "第二天", "scheduled_at": "待定"}])
+    other = db.create_item(name="无关计划", scheduled_at="2025-12-30")
+    assert db.get_tree(trip)
+
+    preview = db.shift_subtree(trip, 7, dry_run=True)
+    assert (preview["count"], preview["changed"]) == (3, 2)
+    assert preview["preview"][0]["new_deadline"] == "2026-01-09 18:00"
+    assert db.get_item(trip)["scheduled_at"] == "2025-12-30"
+
+    db.shift_subtree(trip, 7)
+    tree = db.get_tree(trip)
+    assert (tree["scheduled_at"], tree["deadline"]) == ("2026-01-06", "2026-01-09 18:00")
+    assert [child["scheduled_at"] for child in tree["children"]] == ["2026-01-07T09:00", "待定"]
+    assert db.get_item(other)["scheduled_at"] == "2025-12-30"
+    assert db.query_audit(op="shift")["entries"][0]["detail"] == {"days": 7, "count": 3}
+    assert db.shift_subtree(999, 1) is None
+
+
+def test_fix_old_dates_is_set_based_and_chunked(db):
+    tricky = db.create_item(name="时间含年份", scheduled_at="2023-10-20 20:23")
+    leap = db.create_item(name="闰日", scheduled_at="2024-02-29", deadline="2026-01-01")
+    text = db.create_item(name="非日期", scheduled_at="10月1日")
+    current = db.create_item(name="无需修复", scheduled_at="2025-06-01")
+
+    preview = db.fix_old_dates("2025", dry_run=True)
+    assert (preview["scheduled"], preview["deadline"], preview["fixed"]) == (2, 0, 0)
+    assert db.get_item(tricky)["scheduled_at"] == "2023-10-20 20:23"
+
+    result = db.fix_old_dates("2025", chunk_size=1)
+    assert (result["fixed"], result["chunks"]) == (2, 2)
+    # 只改年份，时间里的 "2023" 不受影响；2月29日顺延
+    assert db.get_item(tricky)["scheduled_at"] == "2025-10-20 20:23"
+    assert db.get_item(leap)["scheduled_at"] == "2025-03-01"
+    assert db.get_item(leap)["deadline"] == "2026-01-01"
+    assert db.get_item(text)["scheduled_at"] == "10月1日"
+    assert db.get_item(current)["scheduled_at"] == "2025-06-01"
+    assert len(db.query_audit(op="fix_date")["entries"]) == 2
+    with pytest.raises(ValueError):
+        db.fix_old_dates("25")
+
+
+def test_agenda_lists_items_across_plans_in_date_order(db):
+    trip, day1, day2 = db.create_items_bulk(
+        {"name": "北京旅行", "scheduled_at": "2025-12-20"},
+        [{"name": "故宫", "scheduled_at": "2025-12-22 09:00"},
+         {"name": "长城", "scheduled_at": "2025-12-28T20:00"}])
+    deep = db.create_item(name="买票", parent_id=day1, scheduled_at="2025-12-21", deadline="2025-12-22")
+    book = db.create_item(name="读书", category="学习", scheduled_at="2025-12-22")
+    db.update_item(book, status="completed")
+
+    page = db.agenda("2025-12-21", "2025-12-28")
+    assert [item["id"] for item in page["items"]] == [deep, book, day1, day2]
+    assert [item["root_name"] for item in page["items"]] == ["北京旅行", "读书", "北京旅行", "北京旅行"]
+    assert page["next_cursor"] is None
+
+    # 游标翻页结果与一次取完一致
+    seen, cursor = [], None
+    while True:
+        page = db.agenda("2025-12-21", "2025-12-28", page_size=1, cursor=cursor)
+        seen += [item["id"] for item in page["items"]]
+        cursor = page["next_cursor"]
+        if not cursor:
+            break
+    assert seen == [deep, book, day1, day2]
+
+    assert [i["id"] for i in db.agenda("2025-12-21", "2025-12-28", status="pending")["items"]] == [deep, day1, day2]
+    assert [i["id"] for i in db.agenda("2025-12-01", "2025-12-31", category="学习")["items"]] == [book]
+    assert [i["id"] for i in db.agenda("2025-12-22", "2025-12-22", date_field="deadline")["items"]] == [deep]
+    with pytest.raises(ValueError):
+        db.agenda("2025-12", "2025-12-31")
+
+
+def test_due_items_and_due_queue(db):
+    from datetime import datetime, timedelta
+
+    def day(offset):
+        return (datetime.now() + timedelta(days=offset)).strftime("%Y-%m-%d")
+
+    trip = db.create_item(name="旅行")
+    late = db.create_item(name="订酒店", parent_id=trip, deadline=day(-2))
+    done = db.create_item(name="买机票", parent_id=trip, deadline=day(-3))
+    db.update_item(done, status="completed")
+    soon = db.create_item(name="收拾行李", deadline=day(2))
+    db.create_item(name="远期", deadline=day(30))
+
+    assert [(i["id"], i["root_name"]) for i in db.due_items(before=day(0))] == [(late, "旅行")]
+    assert [i["id"] for i in db.due_items(before=day(8), start=day(0))] == [soon]
+
+    queue = main.DueQueue(db, interval=0, horizon_days=7)
+    assert queue.overdue(10) is None
+    queue.refresh()
+    assert [i["id"] for i in queue.overdue(10)[0]] == [late]
+    assert [i["id"] for i in queue.due_soon(7, 10)[0]] == [soon]
+    assert queue.due_soon(1, 10)[0] == []
+    assert queue.due_soon(30, 10) is None  # 超出预计算范围
+
+    # 任何写入都会让快照失效
+    db.update_item(late, status="completed")
+    assert queue.overdue(10) is None
+
+
+def test_mutations_write_audit_rows(db):
+    root = db.create_item(name="审计计划")
+    child = db.create_item(name="步骤", parent_id=root)
+    db.update_item(child, status="completed")
+    db.delete_item(root)
+
+    entries = db.query_audit()["entries"]
+    assert [(e["op"], e["item_id"]) for e in entries] == [
+        ("delete", root), ("update", child),
+        ("create", child), ("create", root)]
+    update = entries[1]
+    assert update["before"] == {"status": "pending"}
+    assert update["after"] == {"status": "completed"}
+    # 级联删除只写根计划一条记录，子计划的快照放在 before["descendants"] 中
+    assert entries[0]["detail"] == {"cascade": 2}
+    assert entries[0]["before"]["name"] == "审计计划"
+    assert [d["id"] for d in entries[0]["before"]["descendants"]] == [child]
+
+    # 按计划和操作类型筛选，并按游标翻页
+    page = db.query_audit(item_id=child, page_size=1)
+    assert [e["op"] for e in page["entries"]] == ["update"]
+    rest = db.query_audit(item_id=child, page_size=1, cursor=page["next_cursor"])
+    assert [e["op"] for e in rest["entries"]] == ["create"]
+    assert rest["next_cursor"] is None
+    assert len(db.query_audit(op="create")["entries"]) == 2
+    assert db.query_audit(since="2999-01-01")["entries"] == []
+
+
+def test_audit_rolls_back_with_mutation(db):
+    with pytest.raises(RuntimeError):
+        with db.transaction():
+            db.create_item(name="会回滚")
+            raise RuntimeError("boom")
+    assert db.query_audit()["entries"] == []
+
+
+@pytest.mark.parametrize("compact", [False, True])
+def test_snapshot_rotation(db, tmp_path, monkeypatch, compact):
+    monkeypatch.setattr(main, "db", db)
+    root = db.create_item(name="快照计划")
+    db.create_item(name="步骤", parent_id=root)
+
+    snapshot_dir = tmp_path / "snapshots"
+    for _ in range(3):
+        result = main.create_snapshot(str(snapshot_dir), keep=2, compact=compact)
+    assert result["method"] == ("vacuum_into" if compact else "backup_api")
+    assert len(result["removed"]) == 1
+    remaining = sorted(snapshot_dir.iterdir())
+    assert len(remaining) == 2
+    assert remaining[-1].name == os.path.basename(result["path"])
+
+    copy = SQLiteDB(result["path"])
+    assert copy.get_plan_tree_count(root) == 2
+    copy.close()
+
+
+def test_memory_backend_is_isolated_and_shared_across_threads():
+    first = main.open_store("memory")
+    second = main.open_store("memory")
+    assert isinstance(first, main.PlanStore)
+    parent, child = first.create_items_bulk({"name": "云南旅行"}, [{"name": "昆明"}])
+
+    # 其他线程拿到的连接看到同一个内存数据库
+    seen = []
+    worker = threading.Thread(target=lambda: seen.append(first.get_tree(parent)))
+    worker.start()
+    worker.join()
+    assert [c["id"] for c in seen[0]["children"]] == [child]
+    assert second.query_items() == []
+    first.close()
+    second.close()
+
+    with pytest.raises(ValueError):
+        main.open_store("postgres")
+
+
+def test_query_items_by_name_and_date_range(db):
+    a = db.create_item(name="周报", scheduled_at="2025-05-01")
+    db.create_item(name="周报", scheduled_at="2025-06-01")
+    db.create_item(name="周报", parent_id=a, scheduled_at="2025-05-02")
+    assert len(db.query_items(name="周报")) == 2
+    assert [i["id"] for i in db.query_items(date_range=("2025-05-01", "2025-05-31"))] == [a]
+
+
+def test_legacy_items_table_is_migrated(tmp_path):
+    path = str(tmp_path / "legacy.db")
+    conn = sqlite3.connect(path)
+    conn.execute("CREATE TABLE items (id INTEGER PRIMARY KEY AUTOINCREMENT, parent_id INTEGER, "
+                 "name TEXT NOT NULL, description TEXT, status TEXT DEFAULT 'pending', "
+                 "scheduled_at TEXT, deadline TEXT, category TEXT DEFAULT 'general', "
+                 "metadata TEXT DEFAULT '{}', created_at TEXT, updated_at TEXT)")
+    # 旧版的索引名与 plans 表的索引同名
+    for name, column in (("idx_parent_id", "parent_id"), ("idx_category", "category"),
+                         ("idx_status", "status"), ("idx_scheduled_at", "scheduled_at")):
+        conn.execute(f"CREATE INDEX {name} ON items({column})")
+    conn.execute("INSERT INTO items (id, name, status) VALUES (7, '旧计划', 'completed')")
+    conn.execute("INSERT INTO items (id, parent_id, name, metadata) VALUES (9, 7, '旧步骤', '{\"a\": 1}')")
+    conn.commit()
+    conn.close()
+
+    database = SQLiteDB(path)
+    root = database.query_items(name="旧计划")[0]
+    tree = database.get_tree(root["id"])
+    assert root["status"] == "completed" and root["metadata"] is None
+    assert [(c["name"], c["metadata"]) for c in tree["children"]] == [("旧步骤", {"a": 1})]
+    assert database.get_progress([root["id"]])[root["id"]]["total"] == 1
+    with database.connection() as conn:
+        assert conn.execute("SELECT 1 FROM sqlite_master WHERE name = 'items'").fetchone() is None
+        indexes = {row[1] for row in conn.execute("PRAGMA index_list('plans')")}
+    assert {"idx_parent_id", "idx_category", "idx_parent_created"} <= indexes
+    assert not {"idx_status", "idx_scheduled_at"} & indexes
+    database.close()
+
+
+def test_json_codecs_round_trip():
+    value = {"城市": "东京", "budget": 5000.5, "tags": ["a", None], "nested": {"n": 1}}
+    for name in main.JSON_CODECS:
+        try:
+            codec = main.select_json_codec(name)
+        except ValueError:
+            continue  # 可选依赖未安装
+        text = codec.dumps(value)
+        assert "东京" in text and ": " not in text
+        assert codec.loads(text) == value
+        assert codec.loads(text.encode()) == value
+    with pytest.raises(ValueError):
+        main.select_json_codec("yaml")
+    # 超出 orjson 范围的整数退回标准库
+    assert main.json_loads(main.json_dumps({"n": 2 ** 70})) == {"n": 2 ** 70}
+
+
+def test_metadata_decoding_can_be_skipped(db):
+    item_id = db.create_item(name="东京旅行", metadata={"城市": "东京"})
+    assert db.query_items()[0]["metadata"] == {"城市": "东京"}
+    raw = db.query_items(decode_metadata=False)[0]["metadata"]
+    assert isinstance(raw, str) and main.json_loads(raw) == {"城市": "东京"}
+    assert db.search_items("东京", decode_metadata=False)[0]["metadata"] == raw
+    assert db.get_item(item_id)["metadata"] == {"城市": "东京"}
+
+
+def test_field_projection(db):
+    root, step = db.create_items_bulk({"name": "东京旅行", "description": "x" * 100,
+                                       "metadata": {"城市": "东京"}}, [{"name": "订酒店"}])
+    assert db.query_items(fields=["name"]) == [{"id": root, "name": "东京旅行"}]
+    page = db.query_items_page(fields=["name"], page_size=1)
+    assert page["items"] == [{"id": root, "name": "东京旅行"}] and page["next_cursor"] is None
+    assert db.search_items("东京", fields=["status"]) == [{"id": root, "status": "pending"}]
+
+    # 未缓存时直接投影查询，且不写入缓存
+    db.cache.clear()
+    tree = db.get_tree(root, fields=["name"])
+    assert tree == {"id": root, "parent_id": None, "name": "东京旅行",
+                    "children": [{"id": step, "parent_id": root, "name": "订酒店"}]}
+    assert db.cache.get(("tree", root)) is None
+    # 有完整缓存时从缓存投影，修改返回值不影响缓存
+    full = db.get_tree(root)
+    projected = db.get_tree(root, fields=["metadata"])
+    projected["metadata"]["城市"] = "大阪"
+    assert set(projected) == {"id", "parent_id", "metadata", "children"}
+    assert db.get_tree(root) == full
+    assert db.get_item(root, fields=["metadata"]) == {"id": root, "metadata": {"城市": "东京"}}
+
+    with pytest.raises(ValueError):
+        db.query_items(fields=["name", "password"])
+
+
+def test_cache_holds_compact_plan_items(db):
+    root = db.create_item(name="东京旅行", metadata={"城市": "东京"})
+    step = db.create_item(name="订酒店", parent_id=root)
+
+    tree = db.get_tree(root)
+    cached = db.cache.get(("tree", root))
+    assert isinstance(cached, main.PlanItem) and not hasattr(cached, "__dict__")
+    assert main.json_loads(cached.metadata) == {"城市": "东京"}
+    assert [child.id for child in cached.children] == [step]
+    assert cached.tree_to_dict() == tree
+
+    # 每次返回新的字典（metadata 重新解析），嵌套修改不会污染缓存
+    tree["metadata"]["城市"] = "大阪"
+    assert db.get_tree(root)["metadata"] == {"城市": "东京"}
+    assert "children" not in db.get_tree(step)
+    assert cached.to_dict(["id", "name"]) == {"id": root, "name": "东京旅行"}
+
+
+def test_delete_tree_preview_delete_and_undo(db):
+    trip, day1, day2 = db.create_items_bulk({"name": "旅行", "metadata": {"预算": 100}},
+                                            [{"name": "第一天"}, {"name": "第二天"}])
+    visit = db.create_item(name="参观", parent_id=day1)
+    db.update_item(visit, status="completed")
+    other = db.create_item(name="其他计划")
+    db.update_item(trip, parent_id=other)
+
+    preview = db.delete_tree(trip, dry_run=True, fields=["name"])
+    assert (preview["count"], preview["deleted"]) == (4, False)
+    assert [child["name"] for child in preview["tree"]["children"]] == ["第一天", "第二天"]
+    assert db.get_item(trip) is not None
+    assert db.delete_tree(9999) is None and db.delete_tree(9999, dry_run=True) is None
+
+    before = db.get_tree(other)
+    result = db.delete_tree(trip)
+    assert (result["count"], result["deleted"]) == (4, True)
+    assert result["tree"]["children"][0]["children"][0]["id"] == visit
+    assert [db.get_item(item_id) for item_id in (trip, day1, day2, visit)] == [None] * 4
+    assert db.get_progress([other])[other]["total"] == 0
+    assert len(db.query_audit(op="delete")["entries"]) == 1
+
+    # 按原ID从删除时的审计记录恢复，汇总和统计计数与删除前一致
+    restored = db.undo_delete(trip)
+    assert (restored["count"], restored["name"]) == (4, "旅行")
+    assert db.get_tree(other) == before
+    assert db.get_progress([other, trip])[trip]["completed"] == 1
+    assert db.reconcile_statistics()["rollup_drift"] == []
+    with pytest.raises(ValueError):
+        db.undo_delete(trip)
+
+    # 子树被单独删除后，再删除根计划：只能按删除顺序撤销
+    db.delete_item(day1)
+    db.delete_item(other)
+    with pytest.raises(ValueError):
+        db.undo_delete(day1)
+    assert db.undo_delete(other)["count"] == 3
+    assert db.undo_delete(day1)["count"] == 2
+    assert db.get_tree(other) == before